@@ -0,0 +1,6 @@
+"""Offline benchmarks for the bot, using in-process stand-ins for Steamship, OpenAI and the plugins."""
+import os
+import sys
+
+# 与main.py一样，从src目录导入机器人代码
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
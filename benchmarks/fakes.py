@@ -0,0 +1,457 @@
+"""In-process stand-ins for Steamship, its plugins, OpenAI and Telegram.
+
+The fakes answer the same client calls the bot makes against the real services
+(`client.post`, `client.use_plugin`, plugin tasks, signed URL uploads) with a
+configurable latency and payload size, so the real bot code runs end to end.
+"""
+import contextlib
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import mock
+
+from steamship import Block, File, MimeTypes, Steamship, SteamshipError, Tag
+from steamship.base.configuration import Configuration
+from steamship.base.tasks import TaskState
+from steamship.data import TagValueKey
+from steamship.data.workspace import SignedUrl, Workspace
+
+from agent.dispatch import Timing
+from agent.utils import UUID_PATTERN
+
+
+# ServiceProfile描述了模拟服务的延迟（秒）和生成内容的大小（字节）。
+class ServiceProfile:
+    """Latency and payload sizes of the simulated services."""
+
+    def __init__(
+        self,
+        api_seconds: float = 0.01,
+        llm_seconds: float = 0.3,
+        image_seconds: float = 1.0,
+        speech_seconds: float = 0.3,
+        search_seconds: float = 0.2,
+        telegram_seconds: float = 0.05,
+        upload_seconds_per_mb: float = 0.1,
+        image_bytes: int = 600_000,
+        audio_bytes: int = 80_000,
+        task_poll_interval: float = 0.05,
+    ):
+        self.api_seconds = api_seconds
+        self.llm_seconds = llm_seconds
+        self.image_seconds = image_seconds
+        self.speech_seconds = speech_seconds
+        self.search_seconds = search_seconds
+        self.telegram_seconds = telegram_seconds
+        self.upload_seconds_per_mb = upload_seconds_per_mb
+        self.image_bytes = image_bytes
+        self.audio_bytes = audio_bytes
+        self.task_poll_interval = task_poll_interval
+
+
+# 线程安全地按阶段记录耗时。
+class PhaseTimer:
+    """Thread-safe per-phase latency recorder."""
+
+    def __init__(self):
+        self._phases: Dict[str, Timing] = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self._phases.setdefault(phase, Timing()).record(seconds)
+
+    @contextlib.contextmanager
+    def measure(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {phase: timing.stats() for phase, timing in sorted(self._phases.items())}
+
+
+# ScriptedReActLLM根据提示词生成ReAct格式的输出：根据输入中的关键词依次调用工具，然后给出包含工具返回的UUID的最终回复。
+# 闲聊提示词得到简短的回复，摘要提示词得到一段固定的摘要。
+class ScriptedReActLLM:
+    """Deterministic stand-in for GPT that drives the conversational ReAct agent."""
+
+    TOOL_RULES: List[Tuple[str, str, str]] = [
+        (r"selfie|photo|picture|where are you", "GenerateSelfie", "a selfie at a sunny beach"),
+        (r"search|news|weather|today", "Search", "{input}"),
+    ]
+    FINAL_ANSWER = "I just got back from a long walk on the beach. It was lovely, you should come next time!"
+    CHAT_ANSWER = "Haha, same here! Tell me more about your day."
+    SUMMARY = "The human and the AI talked about their day."
+
+    def respond(self, prompt: str) -> str:
+        if "Progressively summarize" in prompt:
+            return self.SUMMARY
+        if "New input:" not in prompt:
+            return self.CHAT_ANSWER
+
+        _, _, tail = prompt.rpartition("New input: ")
+        user_input, _, scratchpad = tail.partition("\n")
+        planned = [
+            (tool, tool_input.format(input=user_input))
+            for pattern, tool, tool_input in self.TOOL_RULES
+            if re.search(pattern, user_input, re.IGNORECASE)
+        ]
+        step = scratchpad.count("Observation:")
+        if step < len(planned):
+            tool, tool_input = planned[step]
+            return (
+                "Thought: Do I need to use a tool? Yes\n"
+                f"Action: {tool}\n"
+                f"Action Input: {tool_input}"
+            )
+        uuids = " ".join(UUID_PATTERN.findall(scratchpad))
+        return f"Thought: Do I need to use a tool? No\nAI: {self.FINAL_ANSWER} {uuids}".rstrip()
+
+
+# FakeTask模拟一个在latency秒后完成的Steamship任务。与真正的任务一样，wait()每隔一段时间检查一次状态。
+class FakeTask:
+    def __init__(self, output: Any, latency: float, poll_interval: float):
+        self.task_id = str(uuid.uuid4())
+        self.output = output
+        self.ready_at = time.monotonic() + latency
+        self.poll_interval = poll_interval
+
+    @property
+    def state(self) -> str:
+        return TaskState.succeeded if time.monotonic() >= self.ready_at else TaskState.running
+
+    def refresh(self) -> None:
+        pass
+
+    def wait(self, max_timeout_s: float = 180, retry_delay_s: Optional[float] = None):
+        while self.state != TaskState.succeeded:
+            time.sleep(self.poll_interval if retry_delay_s is None else retry_delay_s)
+        return self.output
+
+
+class _Output:
+    def __init__(self, blocks: List[Block] = None, file: File = None):
+        self.blocks = blocks or []
+        self.file = file
+
+
+# FakePluginInstance模拟gpt-4、stable-diffusion、elevenlabs和serpapi-wrapper插件。
+class FakePluginInstance:
+    def __init__(self, client: "FakeSteamship", handle: str, config: Optional[Dict[str, Any]]):
+        self.client = client
+        self.handle = handle
+        self.config = config or {}
+
+    def generate(
+        self,
+        text: Optional[str] = None,
+        input_file_id: Optional[str] = None,
+        append_output_to_file: bool = False,
+        options: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ) -> FakeTask:
+        backend = self.client.backend
+        profile = backend.profile
+        backend.call("plugin:generate")
+        if self.handle == "gpt-4":
+            prompt = backend.files[input_file_id].blocks[-1].text
+            block = backend.new_block(text=backend.llm.respond(prompt), client=self.client)
+            return backend.task("llm", [block], profile.llm_seconds)
+        if self.handle == "stable-diffusion":
+            block = backend.new_block(mime_type=MimeTypes.PNG, content=b"\0" * profile.image_bytes, client=self.client)
+            return backend.task("image", [block], profile.image_seconds)
+        if self.handle == "elevenlabs":
+            block = backend.new_block(mime_type=MimeTypes.MP3, content=b"\0" * profile.audio_bytes, client=self.client)
+            return backend.task("speech", [block], profile.speech_seconds)
+        raise SteamshipError(f"Plugin {self.handle} is not simulated")
+
+    def tag(self, doc: str, **kwargs) -> FakeTask:
+        backend = self.client.backend
+        backend.call("plugin:tag")
+        result = Tag(
+            kind="search-result",
+            value={TagValueKey.STRING_VALUE: f"Top result for '{doc}': sunny, 24 degrees."},
+        )
+        file = File.construct(id=str(uuid.uuid4()), blocks=[Block.construct(tags=[result])])
+        task = FakeTask(_Output(file=file), backend.profile.search_seconds, backend.profile.task_poll_interval)
+        backend.timer.record("search", backend.profile.search_seconds)
+        return task
+
+
+# FakeBackend保存模拟的文件、块、上传的内容和键值存储，并记录各阶段的耗时。
+class FakeBackend:
+    def __init__(self, profile: ServiceProfile, timer: PhaseTimer, llm: ScriptedReActLLM):
+        self.profile = profile
+        self.timer = timer
+        self.llm = llm
+        self.files: Dict[str, File] = {}
+        self.file_handles: Dict[str, str] = {}
+        self.blocks: Dict[str, Block] = {}
+        self.contents: Dict[str, bytes] = {}
+        self.uploads: Dict[str, int] = {}
+        self.api_calls = 0
+        self._lock = threading.Lock()
+
+    # 模拟一次Steamship API调用的往返延迟
+    def call(self, operation: str) -> None:
+        with self._lock:
+            self.api_calls += 1
+        with self.timer.measure(f"api:{operation}"):
+            time.sleep(self.profile.api_seconds)
+
+    def task(self, phase: str, blocks: List[Block], latency: float) -> FakeTask:
+        self.timer.record(phase, latency)
+        return FakeTask(_Output(blocks=blocks), latency, self.profile.task_poll_interval)
+
+    def new_block(
+        self,
+        text: Optional[str] = None,
+        mime_type: Optional[str] = None,
+        content: Optional[bytes] = None,
+        file_id: Optional[str] = None,
+        tags: Optional[List[Tag]] = None,
+        client: Optional[Steamship] = None,
+    ) -> Block:
+        block = Block.construct(
+            client=client,
+            id=str(uuid.uuid4()),
+            file_id=file_id,
+            text=text,
+            mime_type=mime_type,
+            tags=tags or [],
+            content_url=None,
+            url=None,
+            index_in_file=None,
+            upload_type=None,
+            upload_bytes=None,
+        )
+        with self._lock:
+            self.blocks[block.id] = block
+            if content is not None:
+                self.contents[block.id] = content
+        return block
+
+    # 模拟上传到签名URL：按内容大小计算延迟
+    def upload(self, signed_url: str, data: bytes) -> None:
+        with self.timer.measure("upload"):
+            time.sleep(self.profile.api_seconds + len(data) / 1e6 * self.profile.upload_seconds_per_mb)
+        with self._lock:
+            self.uploads[signed_url] = len(data)
+
+
+# FakeSteamship是一个不访问网络的Steamship客户端，所有请求都由FakeBackend处理。
+class FakeSteamship(Steamship):
+    """Steamship client whose requests are served in-process by a FakeBackend."""
+
+    @classmethod
+    def create(
+        cls,
+        profile: Optional[ServiceProfile] = None,
+        timer: Optional[PhaseTimer] = None,
+        llm: Optional[ScriptedReActLLM] = None,
+        workspace_handle: str = "benchmark",
+    ) -> "FakeSteamship":
+        client = cls.construct(
+            config=Configuration.construct(
+                api_key="benchmark",
+                api_base="http://localhost/api/v1/",
+                app_base="http://localhost/",
+                web_base="http://localhost/",
+                workspace_handle=workspace_handle,
+                workspace_id=f"{workspace_handle}-{uuid.uuid4()}",
+            )
+        )
+        backend = FakeBackend(profile or ServiceProfile(), timer or PhaseTimer(), llm or ScriptedReActLLM())
+        object.__setattr__(client, "backend", backend)
+        return client
+
+    def use_plugin(
+        self,
+        plugin_handle: str,
+        instance_handle: Optional[str] = None,
+        config: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ) -> FakePluginInstance:
+        self.backend.call("plugin:use")
+        return FakePluginInstance(self, plugin_handle, config)
+
+    def get_workspace(self) -> Workspace:
+        self.backend.call("workspace:get")
+        return Workspace.construct(
+            id=self.config.workspace_id, handle=self.config.workspace_handle, client=self
+        )
+
+    def post(
+        self,
+        operation: str,
+        payload: Any = None,
+        file: Any = None,
+        expect: Any = None,
+        raw_response: bool = False,
+        **kwargs,
+    ) -> Any:
+        backend = self.backend
+        backend.call(operation)
+        if operation == "file/create":
+            file_id = str(uuid.uuid4())
+            blocks = [
+                backend.new_block(
+                    text=block.get("text"),
+                    file_id=file_id,
+                    tags=[Tag.parse_obj(tag) for tag in block.get("tags", [])],
+                )
+                for block in payload.get("blocks", [])
+            ]
+            created = File.construct(id=file_id, handle=payload.get("handle"), blocks=blocks, client=self)
+            with backend._lock:
+                backend.files[file_id] = created
+                if created.handle:
+                    backend.file_handles[created.handle] = file_id
+            return created
+        if operation == "file/get":
+            file_id = payload.id or backend.file_handles.get(payload.handle)
+            found = backend.files.get(file_id)
+            if found is None:
+                raise SteamshipError(message=f"File {payload.handle or payload.id} not found")
+            return File.construct(**{**found.__dict__, "blocks": list(found.blocks)})
+        if operation == "file/delete":
+            with backend._lock:
+                deleted = backend.files.pop(payload.id, None)
+                if deleted is not None and deleted.handle:
+                    backend.file_handles.pop(deleted.handle, None)
+            return deleted
+        if operation == "block/create":
+            block = backend.new_block(
+                text=payload.get("text"),
+                mime_type=payload.get("mimeType"),
+                file_id=payload.get("fileId"),
+                tags=[Tag.parse_obj(tag) for tag in payload.get("tags", [])],
+            )
+            backend.files[block.file_id].blocks.append(block)
+            return block
+        if operation == "block/get":
+            block = backend.blocks[payload.id]
+            return Block.construct(**{**block.__dict__, "tags": list(block.tags), "client": self})
+        if operation == "tag/create":
+            tag = payload.copy(update={"id": str(uuid.uuid4()), "client": self})
+            block = backend.blocks.get(payload.block_id)
+            if block is not None:
+                block.tags.append(tag)
+            return tag
+        if operation == "block/raw":
+            return backend.contents[payload["id"]]
+        if operation == "workspace/createSignedUrl":
+            return SignedUrl.Response(
+                bucket=payload.bucket,
+                filepath=payload.filepath,
+                operation=payload.operation,
+                expires_in_minutes=payload.expires_in_minutes,
+                signedUrl=f"https://storage.invalid/{payload.filepath}?op={payload.operation}",
+            )
+        raise SteamshipError(message=f"Operation {operation} is not simulated")
+
+
+# 模拟Telegram发送：记录发送的消息数量。
+class FakeTelegramTransport:
+    def __init__(self, profile: ServiceProfile, timer: PhaseTimer):
+        self.profile = profile
+        self.timer = timer
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def send(self, messages: List[Any]) -> None:
+        with self.timer.measure("telegram"):
+            time.sleep(self.profile.telegram_seconds)
+        with self._lock:
+            self.sent += len(messages)
+
+
+# 基于字典的KeyValueStore，与steamship.utils.kv_store.KeyValueStore的接口一致。
+class FakeKeyValueStore:
+    _stores: Dict[str, Dict[str, Dict]] = {}
+
+    def __init__(self, client: Steamship, store_identifier: str = "KeyValueStore"):
+        self.store = self._stores.setdefault(f"{client.config.workspace_id}/{store_identifier}", {})
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.store.get(key)
+
+    def set(self, key: str, value: Dict[str, Any]):
+        self.store[key] = value
+
+    def delete(self, key: str) -> bool:
+        return self.store.pop(key, None) is not None
+
+    def items(self, filter_keys: Optional[List[str]] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        return [
+            (key, value)
+            for key, value in self.store.items()
+            if filter_keys is None or key in filter_keys
+        ]
+
+    def reset(self):
+        self.store.clear()
+
+
+# 不需要下载tiktoken编码表的近似token计数
+def approximate_num_tokens(self, text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+# 在上下文中把机器人使用的网络服务替换为本文件中的模拟实现。
+@contextlib.contextmanager
+def offline(client: FakeSteamship):
+    """Route uploads, key-value stores and token counting to in-process fakes.
+
+    The process-wide caches are swapped for empty ones, because the block ids they
+    hold only exist in the backend of the client that created them.
+    """
+    import api
+    import agent.aio
+    import agent.plugins
+    import agent.transport
+    import agent.utils
+    from agent.cache import LRUCache
+    from agent.image_cache import ImageCache
+    from agent.tools import search
+    from agent.tts_cache import MemoryTTSCacheBackend, TTSCache
+    from steamship_langchain.llms import OpenAIChat
+    from steamship_langchain.tools import search_tool
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(
+            mock.patch.object(
+                agent.utils,
+                "upload_stream_to_signed_url",
+                lambda url, content, size: client.backend.upload(url, content.read()),
+            )
+        )
+        stack.enter_context(mock.patch.object(api, "KeyValueStore", FakeKeyValueStore))
+        stack.enter_context(mock.patch.object(search_tool, "KeyValueStore", FakeKeyValueStore))
+        stack.enter_context(mock.patch.object(OpenAIChat, "get_num_tokens", approximate_num_tokens))
+        stack.enter_context(
+            mock.patch.object(agent.aio, "TASK_POLL_INTERVAL_SECONDS", client.backend.profile.task_poll_interval)
+        )
+        agent_cache = LRUCache(maxsize=api.AGENT_CACHE_SIZE, ttl=api.AGENT_CACHE_TTL_SECONDS)
+        stack.enter_context(mock.patch.object(api, "AGENT_CACHE", agent_cache))
+        tts_backend = MemoryTTSCacheBackend(maxsize=api.TTS_CACHE_SIZE, ttl=api.TTS_CACHE_TTL_SECONDS)
+        stack.enter_context(mock.patch.object(api, "TTS_CACHE", TTSCache(tts_backend)))
+        image_cache = ImageCache(maxsize=api.IMAGE_CACHE_SIZE, max_reuse=api.IMAGE_CACHE_MAX_REUSE)
+        stack.enter_context(mock.patch.object(api, "IMAGE_CACHE", image_cache))
+        stack.enter_context(mock.patch.object(search, "SEARCH_CACHE", LRUCache(maxsize=search.SEARCH_CACHE_SIZE)))
+        stack.enter_context(mock.patch.object(agent.utils, "_PUBLIC_URLS", LRUCache(maxsize=1024)))
+        stack.enter_context(mock.patch.object(agent.utils, "_WORKSPACES", {}))
+        # 提醒只保存在内存中，退出时停止本次创建的调度器的发送线程
+        stack.enter_context(mock.patch.object(api, "REMINDER_STORE_BACKEND", "memory"))
+        schedulers = {}
+        stack.enter_context(mock.patch.object(api, "_REMINDER_SCHEDULERS", schedulers))
+        stack.callback(lambda: [scheduler.stop() for scheduler in schedulers.values()])
+        stack.enter_context(mock.patch.object(agent.transport, "_SEND_QUEUES", {}))
+        stack.callback(agent.plugins.clear_plugin_instances)
+        yield
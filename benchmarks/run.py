@@ -0,0 +1,293 @@
+"""Drive GirlfriendGPT end to end against the offline fakes and report latency, throughput and allocations."""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+from steamship.experimental.transports.chat import ChatMessage
+
+from benchmarks.fakes import (
+    FakeSteamship,
+    FakeTelegramTransport,
+    PhaseTimer,
+    ServiceProfile,
+    offline,
+)
+
+import api
+from api import GirlfriendGPT
+
+# 每个场景中用户依次发送的消息
+SCENARIOS = {
+    "chitchat": ["thanks", "haha", "love you", "good night"],
+    "search": ["can you search the news for today?", "what's the weather today?"],
+    "selfie": ["send me a selfie", "where are you? show me a picture"],
+    "mixed": ["hey, how was work?", "send me a selfie", "lol", "what's the weather today?"],
+}
+
+DEFAULT_CONFIG = {
+    "bot_token": "benchmark",
+    "elevenlabs_api_key": "benchmark",
+    "elevenlabs_voice_id": "benchmark",
+    # 自拍池会在后台生成图片，默认关闭以免影响测量
+    "selfie_pool_size": 0,
+}
+
+# p50至少变慢这么多秒才算作回归，避免毫秒级的抖动触发报警
+MIN_REGRESSION_SECONDS = 0.005
+
+# 在报告中显示的阶段（api:*的详细耗时只写入JSON）
+REPORTED_PHASES = [
+    "create_response",
+    "turn",
+    "get_agent",
+    "llm",
+    "search",
+    "image",
+    "speech",
+    "tts",
+    "publish",
+    "upload",
+    "telegram",
+]
+
+
+# BenchmarkBot在GirlfriendGPT的基础上记录每轮对话中各个阶段的耗时。
+class BenchmarkBot(GirlfriendGPT):
+    """GirlfriendGPT that records how long each phase of a turn takes."""
+
+    timer: Optional[PhaseTimer] = None
+
+    def get_agent(self, chat_id: str):
+        with self.timer.measure("get_agent"):
+            return super().get_agent(chat_id)
+
+    async def _arun_turn(self, incoming_message: ChatMessage):
+        with self.timer.measure("turn"):
+            return await super()._arun_turn(incoming_message)
+
+    async def aadd_voice_to_response(self, audio_tool, response: List[str]) -> List[str]:
+        with self.timer.measure("tts"):
+            return await super().aadd_voice_to_response(audio_tool, response)
+
+    async def aagent_output_to_chat_messages(self, chat_id: str, agent_output: List[str]):
+        with self.timer.measure("publish"):
+            return await super().aagent_output_to_chat_messages(chat_id, agent_output)
+
+
+# 运行一个场景：chats个聊天，每个聊天依次发送turns条消息，最多concurrency个聊天同时进行。
+# 与Steamship上的webhook一样，每个聊天在自己的线程中调用同步的create_response()。
+def run_scenario(
+    name: str,
+    concurrency: int,
+    chats: int,
+    turns: int,
+    profile: ServiceProfile,
+    config: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Run one scenario and return its per-phase latency and throughput."""
+    messages = SCENARIOS[name]
+    timer = PhaseTimer()
+    client = FakeSteamship.create(profile=profile, timer=timer, workspace_handle=f"bench-{name}")
+    with offline(client), mock.patch.object(api, "VERBOSE", False), mock.patch.object(
+        api, "warm_up_once"
+    ):
+        bot = BenchmarkBot(client=client, config={**DEFAULT_CONFIG, **(config or {})})
+        # 测量的是预热后的稳定状态，冷启动见benchmarks.startup
+        bot.warm_up()
+        bot.timer = timer
+        transport = FakeTelegramTransport(profile, timer)
+        bot.telegram_transport = bot.rate_limited(transport)
+
+        def chat(index: int) -> None:
+            # 聊天id包含workspace id，避免不同的运行共享缓存的代理
+            chat_id = f"{client.config.workspace_id}-{index}"
+            for turn in range(turns):
+                text = messages[(index + turn) % len(messages)]
+                with timer.measure("create_response"):
+                    bot.create_response(ChatMessage(text=text, chat_id=chat_id))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(chat, range(chats)))
+        wall = time.perf_counter() - started
+
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "turns": chats * turns,
+        "wall_seconds": wall,
+        "throughput": chats * turns / wall,
+        "api_calls": client.backend.api_calls,
+        "telegram_messages": transport.sent,
+        "phases": timer.stats(),
+    }
+
+
+# 在tracemalloc下以零延迟运行一个场景，报告分配的内存峰值和运行结束后仍然保留的内存。
+def measure_allocations(
+    name: str, turns: int, profile: ServiceProfile, config: Optional[Dict[str, Any]] = None
+) -> Dict[str, float]:
+    """Return peak and retained allocations of a single-chat run of `name`."""
+    instant = ServiceProfile(
+        api_seconds=0,
+        llm_seconds=0,
+        image_seconds=0,
+        speech_seconds=0,
+        search_seconds=0,
+        telegram_seconds=0,
+        upload_seconds_per_mb=0,
+        image_bytes=profile.image_bytes,
+        audio_bytes=profile.audio_bytes,
+        task_poll_interval=0,
+    )
+    # 先不追踪地运行一次，使一次性的初始化（导入、正则编译等）不计入结果
+    run_scenario(name, concurrency=1, chats=1, turns=1, profile=instant, config=config)
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        run_scenario(name, concurrency=1, chats=1, turns=turns, profile=instant, config=config)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_kb": (peak - baseline) / 1024,
+        "retained_kb": (current - baseline) / 1024,
+        "retained_kb_per_turn": (current - baseline) / 1024 / turns,
+    }
+
+
+# 与基线结果比较，返回p50耗时或吞吐量超出容差的项目。
+def find_regressions(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """List phases whose p50 latency or whose throughput regressed beyond `tolerance`."""
+    previous_runs = {(run["scenario"], run["concurrency"]): run for run in baseline["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        previous = previous_runs.get((run["scenario"], run["concurrency"]))
+        if previous is None:
+            continue
+        label = f"{run['scenario']} x{run['concurrency']}"
+        if run["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{label} throughput: {previous['throughput']:.2f} -> {run['throughput']:.2f} turns/s"
+            )
+        for phase, stats in run["phases"].items():
+            old = previous["phases"].get(phase)
+            if (
+                old
+                and stats["p50"] > old["p50"] * (1 + tolerance)
+                and stats["p50"] - old["p50"] >= MIN_REGRESSION_SECONDS
+            ):
+                regressions.append(
+                    f"{label} {phase} p50: {old['p50'] * 1000:.1f} -> {stats['p50'] * 1000:.1f} ms"
+                )
+    return regressions
+
+
+def print_run(run: Dict[str, Any]) -> None:
+    print(
+        f"\n== {run['scenario']} (concurrency {run['concurrency']}): {run['turns']} turns in "
+        f"{run['wall_seconds']:.2f}s, {run['throughput']:.2f} turns/s, {run['api_calls']} API calls"
+    )
+    print(f"{'phase':<16}{'count':>7}{'avg ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for phase in REPORTED_PHASES:
+        stats = run["phases"].get(phase)
+        if stats is None:
+            continue
+        print(
+            f"{phase:<16}{stats['count']:>7}{stats['avg'] * 1000:>10.1f}{stats['p50'] * 1000:>10.1f}"
+            f"{stats['p95'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}"
+        )
+    allocations = run.get("allocations")
+    if allocations:
+        print(
+            f"allocations: peak {allocations['peak_kb']:.0f} KiB, retained "
+            f"{allocations['retained_kb']:.0f} KiB ({allocations['retained_kb_per_turn']:.0f} KiB/turn)"
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--chats", type=int, default=4, help="Chats per run")
+    parser.add_argument("--turns", type=int, default=2, help="Messages per chat")
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="Multiply every simulated service latency (0 measures the bot's own overhead)",
+    )
+    parser.add_argument(
+        "--config",
+        nargs="*",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Bot config overrides, values are parsed as JSON when possible",
+    )
+    parser.add_argument("--no-allocations", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare against the results in this file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    return parser.parse_args(argv)
+
+
+def parse_config(pairs: List[str]) -> Dict[str, Any]:
+    config = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        try:
+            config[key] = json.loads(value)
+        except ValueError:
+            config[key] = value
+    return config
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    defaults = ServiceProfile()
+    profile = ServiceProfile(
+        **{
+            name: value * args.latency_scale if name.endswith("seconds") or name.endswith("_mb") else value
+            for name, value in vars(defaults).items()
+        }
+    )
+    config = parse_config(args.config)
+
+    results = {"config": config, "latency_scale": args.latency_scale, "runs": []}
+    for name in args.scenario:
+        allocations = None
+        if not args.no_allocations:
+            allocations = measure_allocations(name, args.turns, profile, config)
+        for concurrency in args.concurrency:
+            run = run_scenario(name, concurrency, args.chats, args.turns, profile, config)
+            run["allocations"] = allocations
+            results["runs"].append(run)
+            print_run(run)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Measure cold-start cost: `import api` time, and the first turn of a fresh process with and without warm-up."""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+
+# 在一个全新的进程中导入api所允许的最长时间（秒）
+IMPORT_BUDGET_SECONDS = 1.0
+# 导入api时不应该加载的模块：它们只在构建代理时才需要
+DEFERRED_MODULES = ["langchain", "steamship_langchain", "agent.tools.search", "agent.tools.selfie"]
+# 每次测量中依次发送的消息：第一条是冷启动的轮次，之后的是已预热的轮次
+MESSAGES = ["hey, how was work?", "lol", "love you", "good night"]
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import api
+seconds = time.perf_counter() - started
+loaded = [m for m in %r if m in sys.modules]
+from agent.warmup import import_agent_stack
+started = time.perf_counter()
+import_agent_stack()
+print(json.dumps({"seconds": seconds, "loaded": loaded, "agent_stack_seconds": time.perf_counter() - started}))
+"""
+
+
+# 在全新的进程中导入api，返回导入耗时、其中提前加载了的延迟模块，以及之后导入代理所需模块（预热或第一轮对话时）的耗时。
+def measure_import() -> Dict[str, Any]:
+    output = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT % (DEFERRED_MODULES,)],
+        cwd=SRC,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# 在全新的进程中运行一个聊天的几轮对话，warm为True时先同步执行预热。
+def measure_turns(warm: bool) -> Dict[str, Any]:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", "warm" if warm else "cold"],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# 子进程：使用离线的替身运行MESSAGES中的消息，记录预热和每一轮的耗时。服务延迟为零，只测量机器人自身的开销。
+# 替身需要修补langchain中的类，因此这里代理所需的模块已经导入，其耗时由measure_import()单独测量。
+def run_child(warm: bool) -> Dict[str, Any]:
+    from steamship.experimental.transports.chat import ChatMessage
+
+    from benchmarks.fakes import FakeSteamship, FakeTelegramTransport, ServiceProfile, offline
+    from benchmarks.run import DEFAULT_CONFIG
+
+    import api
+
+    profile = ServiceProfile(
+        api_seconds=0,
+        llm_seconds=0,
+        image_seconds=0,
+        speech_seconds=0,
+        search_seconds=0,
+        telegram_seconds=0,
+        upload_seconds_per_mb=0,
+        task_poll_interval=0,
+    )
+    client = FakeSteamship.create(profile=profile, workspace_handle="startup")
+    result = {"warm_up_seconds": None, "warm_up_steps": {}, "turns": []}
+    with offline(client), mock.patch.object(api, "VERBOSE", False), mock.patch.object(
+        api, "warm_up_once"
+    ):
+        bot = api.GirlfriendGPT(client=client, config=DEFAULT_CONFIG)
+        bot.telegram_transport = bot.rate_limited(FakeTelegramTransport(profile, client.backend.timer))
+        if warm:
+            stats = bot.warm_up()
+            result["warm_up_seconds"] = stats["warm_up_seconds"]
+            result["warm_up_steps"] = stats["warm_up_steps"]
+        for text in MESSAGES:
+            turn_started = time.perf_counter()
+            bot.create_response(ChatMessage(text=text, chat_id="startup"))
+            result["turns"].append(time.perf_counter() - turn_started)
+    return result
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:8.1f} ms"
+
+
+# 没有预热时，第一轮对话需要先导入代理所需的模块；预热在初始化之后的空闲时间里在后台完成这些工作。
+def print_report(imports: List[Dict[str, Any]], cold: Dict[str, Any], warm: Dict[str, Any]) -> None:
+    seconds = [run["seconds"] for run in imports]
+    stack = min(run["agent_stack_seconds"] for run in imports)
+    loaded = sorted({module for run in imports for module in run["loaded"]})
+    print(f"import api:               {_ms(min(seconds))} (best of {len(seconds)}, median {_ms(statistics.median(seconds)).strip()})")
+    print(f"deferred modules:         {'none loaded' if not loaded else 'loaded ' + ', '.join(loaded)}")
+    print(f"import agent stack:       {_ms(stack)}")
+    print(f"first turn, no warm-up:   {_ms(stack + cold['turns'][0])} (imports + {_ms(cold['turns'][0]).strip()})")
+    print(f"first turn, warmed up:    {_ms(warm['turns'][0])}")
+    print(f"steady-state turn:        {_ms(statistics.median(warm['turns'][1:]))}")
+    steps = {name: stack if name == "imports" else step for name, step in warm["warm_up_steps"].items()}
+    print(f"warm-up (background):     {_ms(sum(steps.values()))}")
+    for name, step in steps.items():
+        print(f"  {name:<24}{_ms(step)}")
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup", description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3, help="Number of fresh processes used to time the import")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        nargs="?",
+        const=IMPORT_BUDGET_SECONDS,
+        default=None,
+        help=f"Exit with status 1 if importing api takes longer than this many seconds (default {IMPORT_BUDGET_SECONDS}) or loads a deferred module",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--child", choices=["cold", "warm"], help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.child:
+        print(json.dumps(run_child(args.child == "warm")))
+        return 0
+
+    imports = [measure_import() for _ in range(max(1, args.repeat))]
+    cold = measure_turns(warm=False)
+    warm = measure_turns(warm=True)
+    if args.json:
+        print(json.dumps({"imports": imports, "cold": cold, "warm": warm}, indent=2))
+    else:
+        print_report(imports, cold, warm)
+
+    if args.budget is not None:
+        best = min(run["seconds"] for run in imports)
+        loaded = sorted({module for run in imports for module in run["loaded"]})
+        if best > args.budget or loaded:
+            print(
+                f"import budget exceeded: {best:.3f}s (budget {args.budget:.3f}s), deferred modules loaded: {loaded or 'none'}",
+                file=sys.stderr,
+            )
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,36 @@
+import argparse
+import json
 import logging
 import os
 import sys
+import threading
+import time
 
 sys.path.insert(0, "src")
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import List
+from typing import Dict, List, NamedTuple, Optional
 
 from steamship.experimental.transports.chat import ChatMessage
 from steamship import Steamship, SteamshipError
 from steamship.cli.ship_spinner import ship_spinner
 from termcolor import colored
+import api
 from api import GirlfriendGPT
+from agent.tracing import SPAN_METRICS
+
+# 没有回放文件时，合成聊天依次发送的消息
+SYNTHETIC_MESSAGES = [
+    "hi!",
+    "how was your day?",
+    "send me a selfie",
+    "haha",
+    "what's the weather today?",
+    "good night, love you",
+]
+# 报告中显示的延迟百分位数
+LATENCY_PERCENTILES = (50, 90, 95, 99)
 
 
 # 这个函数接受一个response_messages参数（类型为List[ChatMessage]），并打印结果。它遍历response_messages列表中的每个消息对象，如果消息对象包含mime_type属性，则打印其URL；否则，打印消息的文本内容。
@@ -34,7 +54,53 @@ class LoggingDisabled:
         logging.disable(logging.NOTSET)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Chat with the companion, or replay a transcript against it as a load test."
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        help='JSONL file of {"chat_id", "text", "delay"} events; delay is the seconds to wait after the previous message of the same chat',
+    )
+    parser.add_argument(
+        "--synthetic-chats",
+        type=int,
+        default=0,
+        help="Replay the transcript once per synthetic chat, or without --replay send built-in messages from this many chats",
+    )
+    parser.add_argument(
+        "--turns", type=int, default=3, help="Messages per synthetic chat without --replay"
+    )
+    parser.add_argument(
+        "--delay", type=float, default=1.0, help="Seconds between messages of a synthetic chat without --replay"
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="Messages processed at the same time")
+    parser.add_argument(
+        "--wait-for-reply",
+        action="store_true",
+        help="Send the next message of a chat only after the reply to the previous one (default: send on schedule)",
+    )
+    parser.add_argument(
+        "--fake",
+        action="store_true",
+        help="Use the in-process stand-ins from benchmarks/ instead of Steamship, OpenAI and the plugins",
+    )
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="With --fake, multiply every simulated service latency",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    if args.replay or args.synthetic_chats:
+        load_test(args)
+        return
+
     # 首先创建了一个Steamship实例。
     Steamship()
 
@@ -88,6 +154,191 @@ def run_agent(agent, prompt: str, as_api: bool = False) -> None:
     show_results(response)
 
 
+class ReplayEvent(NamedTuple):
+    chat_id: str
+    text: str
+    delay: float = 0.0
+
+
+# 从JSONL文件读取回放事件，按chat_id分组并保持每个聊天中的顺序。
+def load_events(path: str) -> Dict[str, List[ReplayEvent]]:
+    chats: Dict[str, List[ReplayEvent]] = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            chat_id = str(event["chat_id"])
+            chats.setdefault(chat_id, []).append(
+                ReplayEvent(chat_id, event["text"], float(event.get("delay", 0)))
+            )
+    return chats
+
+
+# 生成合成聊天：有回放文件时，为每个合成聊天复制一份回放的聊天（chat_id加上序号）；否则每个合成聊天依次发送SYNTHETIC_MESSAGES。
+def synthesize_chats(
+    count: int,
+    transcript: Optional[Dict[str, List[ReplayEvent]]],
+    turns: int,
+    delay: float,
+) -> Dict[str, List[ReplayEvent]]:
+    chats: Dict[str, List[ReplayEvent]] = {}
+    for i in range(count):
+        if transcript:
+            for chat_id, events in transcript.items():
+                copy_id = f"{chat_id}-{i}"
+                chats[copy_id] = [event._replace(chat_id=copy_id) for event in events]
+        else:
+            chat_id = f"synthetic-{i}"
+            chats[chat_id] = [
+                ReplayEvent(chat_id, SYNTHETIC_MESSAGES[(i + turn) % len(SYNTHETIC_MESSAGES)], delay if turn else 0.0)
+                for turn in range(turns)
+            ]
+    return chats
+
+
+# 回放的结果：每条消息从计划发送到得到回复的延迟、按异常类型统计的错误数、没有回复（被合并）的消息数和总耗时。
+class LoadReport:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self.no_reply = 0
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: Optional[BaseException] = None, replied: bool = True):
+        with self._lock:
+            if error is not None:
+                self.errors[type(error).__name__] += 1
+                return
+            self.latencies.append(latency)
+            if not replied:
+                self.no_reply += 1
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+# 并发地回放所有聊天。默认每条消息在计划的时间发送（与Telegram的webhook一样，不等待上一条消息的回复），
+# wait_for_reply为True时，每个聊天等到上一条消息的回复后才开始计算下一条消息的延迟。
+def replay(agent, chats: Dict[str, List[ReplayEvent]], concurrency: int, wait_for_reply: bool) -> LoadReport:
+    report = LoadReport()
+
+    def send(event: ReplayEvent, scheduled_at: float) -> None:
+        try:
+            response = agent.create_response(
+                incoming_message=ChatMessage(text=event.text, chat_id=event.chat_id)
+            )
+        except Exception as e:
+            logging.warning(f"Message to chat {event.chat_id} failed: {e}")
+            report.record(time.perf_counter() - scheduled_at, error=e)
+            return
+        report.record(time.perf_counter() - scheduled_at, replied=response is not None)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        if wait_for_reply:
+
+            def run_chat(events: List[ReplayEvent]) -> None:
+                for event in events:
+                    time.sleep(event.delay)
+                    send(event, time.perf_counter())
+
+            list(pool.map(run_chat, chats.values()))
+        else:
+            schedule = []
+            for events in chats.values():
+                at = 0.0
+                for event in events:
+                    at += event.delay
+                    schedule.append((at, event))
+            schedule.sort(key=lambda item: item[0])
+            for at, event in schedule:
+                time.sleep(max(0.0, started + at - time.perf_counter()))
+                pool.submit(send, event, started + at)
+    report.wall_seconds = time.perf_counter() - started
+    return report
+
+
+def show_load_report(report: LoadReport, chats: int, concurrency: int) -> None:
+    total = len(report.latencies) + sum(report.errors.values())
+    print(colored("\nLoad test: ", "blue", attrs=["bold"]), end="")
+    print(
+        f"{total} messages from {chats} chats in {report.wall_seconds:.2f}s "
+        f"({total / report.wall_seconds:.2f} msg/s), concurrency {concurrency}"
+    )
+    errors = sum(report.errors.values())
+    details = ", ".join(f"{name}: {count}" for name, count in report.errors.most_common())
+    print(f"Errors: {errors}" + (f" ({details})" if details else ""))
+    print(f"Messages merged into another turn (no reply): {report.no_reply}")
+    percentiles = "  ".join(f"p{q} {report.percentile(q):.2f}" for q in LATENCY_PERCENTILES)
+    latest = max(report.latencies, default=0.0)
+    print(f"Latency (s): {percentiles}  max {latest:.2f}")
+
+    print(colored("\nPhases (s, estimated from histograms): ", "blue", attrs=["bold"]))
+    print(f"{'phase':<28}{'count':>7}{'errors':>8}{'avg':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for phase, stats in SPAN_METRICS.stats().items():
+        print(
+            f"{phase:<28}{stats['count']:>7}{stats['errors']:>8}{stats['avg']:>9.3f}"
+            f"{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}"
+        )
+
+
+# 回放/压测模式：使用真实的Steamship服务（临时workspace），或者使用benchmarks中的本地模拟服务（--fake）。
+def load_test(args) -> None:
+    transcript = load_events(args.replay) if args.replay else None
+    if args.synthetic_chats:
+        chats = synthesize_chats(args.synthetic_chats, transcript, args.turns, args.delay)
+    else:
+        chats = transcript
+    SPAN_METRICS.clear()
+    # 并发回放时代理的详细输出会互相交错，没有参考价值
+    api.VERBOSE = False
+
+    if args.fake:
+        from benchmarks.fakes import FakeSteamship, FakeTelegramTransport, ServiceProfile, offline
+
+        defaults = vars(ServiceProfile())
+        profile = ServiceProfile(
+            **{
+                name: value * args.latency_scale if name.endswith(("seconds", "_mb")) else value
+                for name, value in defaults.items()
+            }
+        )
+        client = FakeSteamship.create(profile=profile)
+        with offline(client):
+            agent = GirlfriendGPT(
+                client=client,
+                config={
+                    "bot_token": "test",
+                    "elevenlabs_voice_id": "fake",
+                    "elevenlabs_api_key": "fake",
+                    "selfie_pool_size": 0,
+                },
+            )
+            agent.telegram_transport = agent.rate_limited(
+                FakeTelegramTransport(profile, client.backend.timer)
+            )
+            report = replay(agent, chats, args.concurrency, args.wait_for_reply)
+    else:
+        Steamship()
+        with Steamship.temporary_workspace() as client:
+            agent = GirlfriendGPT(
+                client=client,
+                config={
+                    "bot_token": "test",
+                    "elevenlabs_voice_id": os.environ.get("ELEVENLABS_VOICE_ID"),
+                    "elevenlabs_api_key": os.environ.get("ELEVENLABS_API_KEY"),
+                },
+            )
+            report = replay(agent, chats, args.concurrency, args.wait_for_reply)
+
+    show_load_report(report, len(chats), args.concurrency)
+
+
 # 代码的最后部分使用__name__ == "__main__"条件来检查脚本是否被直接运行。如果是直接运行，它会禁用Python的日志记录，然后调用main函数。如果在执行过程中遇到SteamshipError异常，它会捕获该异常并打印错误信息。
 if __name__ == "__main__":
     # when running locally, we can use print statements to capture logs / info.
@@ -0,0 +1,96 @@
+"""Per-turn token accounting for the conversational agent."""
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from agent.cache import LRUCache
+from prompts import SUFFIX
+
+# 提示词中动态部分的名称，与SUFFIX中的占位符一致
+DYNAMIC_SECTIONS = ["chat_history", "input", "agent_scratchpad"]
+
+
+# 根据SUFFIX构造一个正则表达式，用于从渲染后的提示词中取出聊天记录、输入和ReAct草稿区。
+# 已知用户输入时按原文匹配输入，避免输入中的换行导致错误切分。
+def _suffix_pattern(user_input: Optional[str]) -> "re.Pattern":
+    pattern = re.escape(SUFFIX)
+    for name in DYNAMIC_SECTIONS:
+        placeholder = re.escape("{" + name + "}")
+        if name == "input" and user_input is not None:
+            group = f"(?P<input>{re.escape(user_input)})"
+        elif name == "agent_scratchpad":
+            group = "(?P<agent_scratchpad>.*)"
+        else:
+            group = f"(?P<{name}>.*?)"
+        pattern = pattern.replace(placeholder, group, 1)
+    return re.compile(pattern + r"$", re.DOTALL)
+
+
+# 把渲染后的提示词切分成各个部分：static_sections中的静态文本（个性、工具描述、格式说明等），SUFFIX中的动态部分，SUFFIX之前剩下的文本视为"other"。
+def split_prompt(
+    prompt: str, static_sections: Dict[str, str], user_input: Optional[str] = None
+) -> Dict[str, str]:
+    """Split a rendered agent prompt into named sections."""
+    sections = {}
+    rest = prompt
+    for name, text in static_sections.items():
+        if text and text in rest:
+            sections[name] = text
+            rest = rest.replace(text, "", 1)
+
+    match = _suffix_pattern(user_input).search(rest) or _suffix_pattern(None).search(rest)
+    if match:
+        for name in DYNAMIC_SECTIONS:
+            sections[name] = match.group(name)
+        rest = rest[: match.start()]
+    sections["other"] = rest
+    return sections
+
+
+# 按聊天汇总的token使用情况，只保留最近活跃的聊天。
+class TokenUsageLog:
+    """Queryable per-chat summary of token usage."""
+
+    def __init__(self, maxsize: int = 1024):
+        self._chats = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def record_turn(self, chat_id: str, turn: Dict[str, Any]) -> None:
+        with self._lock:
+            summary = self._chats.get(chat_id)
+            if summary is None:
+                summary = {
+                    "turns": 0,
+                    "llm_calls": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "prompt_tokens_by_section": Counter(),
+                    "tool_invocations": Counter(),
+                    "last_turn": None,
+                }
+                self._chats.put(chat_id, summary)
+            summary["turns"] += 1
+            summary["llm_calls"] += turn["llm_calls"]
+            summary["prompt_tokens"] += turn["prompt_tokens"]
+            summary["completion_tokens"] += turn["completion_tokens"]
+            summary["prompt_tokens_by_section"].update(turn["prompt_tokens_by_section"])
+            summary["tool_invocations"].update(turn["tool_invocations"])
+            summary["last_turn"] = turn
+
+    def summary(self, chat_id: Optional[str] = None) -> Dict[str, Any]:
+        """Return the summary of one chat, or of every tracked chat."""
+        with self._lock:
+            if chat_id:
+                return self._to_json(self._chats.get(chat_id) or {})
+            return {
+                key: self._to_json(value) for key, value in list(self._chats._data.items())
+            }
+
+    @staticmethod
+    def _to_json(summary: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            key: dict(value) if isinstance(value, Counter) else value
+            for key, value in summary.items()
+        }
+
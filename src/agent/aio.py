@@ -0,0 +1,84 @@
+"""Asyncio helpers for running the blocking Steamship client without tying up the event loop."""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Optional, TypeVar
+
+from steamship.base.error import SteamshipError
+from steamship.base.tasks import Task, TaskState
+
+from agent.tracing import traced
+
+T = TypeVar("T")
+
+# 执行阻塞调用（Steamship HTTP请求、块下载等）的线程池大小
+ASYNC_MAX_WORKERS = 32
+# 异步等待Steamship任务时的轮询间隔和超时时间（秒），与Task.wait()的默认值一致
+TASK_POLL_INTERVAL_SECONDS = 1
+TASK_TIMEOUT_SECONDS = 180
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=ASYNC_MAX_WORKERS, thread_name_prefix="aio")
+
+
+# 在共享线程池中执行一个阻塞调用，并在当前的上下文变量中运行，使日志和追踪信息在线程中保持一致。
+async def run_blocking(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking call in the shared worker pool."""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, call)
+
+
+# 在同步代码中运行一个协程。当前线程没有事件循环时直接使用asyncio.run()；
+# 如果已经在事件循环中（例如在异步代码里调用了同步API），则在一个新线程的事件循环中运行，避免嵌套事件循环。
+def run_sync(coroutine: Awaitable[T]) -> T:
+    """Run `coroutine` to completion from synchronous code."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    result: List[Any] = []
+    error: List[BaseException] = []
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            result.append(context.run(asyncio.run, coroutine))
+        except BaseException as e:
+            error.append(e)
+
+    thread = threading.Thread(target=run, name="aio-run-sync")
+    thread.start()
+    thread.join()
+    if error:
+        raise error[0]
+    return result[0]
+
+
+# Task.wait()的异步版本：在两次刷新任务状态之间使用asyncio.sleep()，等待期间不占用任何线程。
+@traced("task_wait")
+async def wait_for_task(
+    task: Task,
+    max_timeout_s: float = TASK_TIMEOUT_SECONDS,
+    retry_delay_s: Optional[float] = None,
+) -> Any:
+    """Poll a Steamship task until it has succeeded or failed, without blocking the event loop."""
+    if retry_delay_s is None:
+        retry_delay_s = TASK_POLL_INTERVAL_SECONDS
+    started = time.perf_counter()
+    while time.perf_counter() - started < max_timeout_s and task.state not in (
+        TaskState.succeeded,
+        TaskState.failed,
+    ):
+        await asyncio.sleep(retry_delay_s)
+        await run_blocking(task.refresh)
+
+    if task.state not in (TaskState.succeeded, TaskState.failed):
+        raise SteamshipError(
+            message=f"Task {task.task_id} did not complete within requested timeout of {max_timeout_s}s."
+        )
+    return task.output
+
@@ -1,33 +1,155 @@
 """Define your LangChain chatbot."""
-import re
+import asyncio
+import logging
+import time
 from abc import abstractmethod
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 
-from langchain.agents import AgentExecutor
-from langchain.tools import Tool
-from steamship import Block
+from steamship import Block, MimeTypes, Tag
+from steamship.data.tags.tag_constants import ChatTag, DocTag, TagValueKey
 from steamship.experimental.package_starters.telegram_bot import TelegramBot
 from steamship.experimental.transports.chat import ChatMessage
-from steamship.invocable import post
+from steamship.invocable import InvocableResponse, get, post
 
-from agent.utils import is_valid_uuid, make_block_public, UUID_PATTERN
+from agent.aio import run_blocking, run_sync
+from agent.block_cache import BLOCK_CONTENT_STATS, cache_block_contents
+from agent.blocks import (
+    BLOCK_STATS,
+    collect_blocks,
+    current_blocks,
+    is_attachment,
+    segment_response,
+)
+from agent.coalesce import MessageCoalescer
+from agent.dispatch import ChatDispatcher, DispatcherOverloaded, get_dispatcher
+from agent.router import MessageRouter, Route, RouterStats, RuleBasedRouter
+from agent.tracing import SPAN_METRICS, span, turn
+from agent.transport import (
+    PRIORITY_BACKGROUND,
+    RateLimitedTransport,
+    TracedTelegramTransport,
+    get_send_queue,
+)
+from agent.utils import amake_block_public
+from agent.warmup import STARTUP
+
+# langchain导入很慢，只在类型检查时导入，运行时在第一次需要时才导入
+if TYPE_CHECKING:
+    from langchain.agents import AgentExecutor
+    from langchain.chains.base import Chain
+    from langchain.tools import Tool
+
+# 并发生成语音的默认线程数
+DEFAULT_VOICE_CONCURRENCY = 4
+# 并发解析回复中的块的最大线程数
+BLOCK_RESOLVE_MAX_WORKERS = 8
+# 队列已满、无法处理新消息时的回复
+OVERLOADED_MESSAGE = "I'm a little overwhelmed right now, give me a moment and try again."
+
+DEFAULT_ROUTER = RuleBasedRouter()
+ROUTER_STATS = RouterStats()
+COALESCER = MessageCoalescer()
 
 # 它提供了与Telegram进行交互的功能，并使用多模态代理生成聊天回复。
 # 这里定义了一个名为LangChainAgentBot的类，它是TelegramBot类的子类，继承了TelegramBot类的属性和方法。
 class LangChainAgentBot(TelegramBot):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # 使用记录发送耗时的TelegramTransport，所有发送都经过按Telegram频率限制排队的发送队列
+        self.telegram_transport = self.rate_limited(
+            TracedTelegramTransport(bot_token=self.config.bot_token, client=self.client)
+        )
+
+    # 在transport前面加上这个机器人的进程级发送队列。替换telegram_transport时（例如离线测试）也应该使用它。
+    def rate_limited(self, transport) -> RateLimitedTransport:
+        return RateLimitedTransport(transport, get_send_queue(self.config.bot_token))
+
     # 使用@abstractmethod装饰器定义了一个抽象方法get_agent()。
     @abstractmethod
-    def get_agent(self, chat_id: str) -> AgentExecutor:
+    def get_agent(self, chat_id: str) -> "AgentExecutor":
         raise NotImplementedError()
 
+    # 丢弃给定chat_id缓存的代理对象。默认情况下没有缓存，因此什么也不做。
+    def invalidate_agent(self, chat_id: str) -> None:
+        pass
+
+    # 这个方法返回对消息进行分类的路由器。返回None时所有消息都交给代理处理。
+    def get_router(self) -> Optional[MessageRouter]:
+        return DEFAULT_ROUTER
+
+    # 这个方法返回用于闲聊的精简对话链，与代理使用相同的内存。默认情况下返回None，表示闲聊也交给代理处理。
+    def get_chat_chain(self, chat_id: str) -> Optional["Chain"]:
+        return None
+
+    # 这个方法返回调度对话轮次的ChatDispatcher，默认使用默认限制的进程级对象。
+    def dispatcher(self) -> ChatDispatcher:
+        return get_dispatcher()
+
     # 这个方法返回一个可选的Tool对象，用于处理语音相关的工具。默认情况下返回None，表示没有语音工具可用。
-    def voice_tool(self) -> Optional[Tool]:
+    def voice_tool(self) -> Optional["Tool"]:
         return None
 
+    # 这个方法返回并发生成语音时使用的最大线程数。
+    def voice_concurrency(self) -> int:
+        return DEFAULT_VOICE_CONCURRENCY
+
+    # 这个方法返回一个布尔值，表示是否在最终回复生成时按句子流式地生成并发送语音。默认情况下返回False。
+    def is_voice_streaming_enabled(self) -> bool:
+        return False
+
+    # 这个方法返回合并连续消息时等待的窗口（秒）。默认情况下返回0，表示不合并。
+    def coalesce_window(self) -> float:
+        return 0
+
     # 这个方法返回一个布尔值，表示是否启用详细日志记录。默认情况下返回True，表示启用详细日志记录。
     def is_verbose_logging_enabled(self):
         return True
 
+    @get("router_stats")
+    def router_stats(self) -> dict:
+        """Return how many turns took each path and the estimated latency saved."""
+        return ROUTER_STATS.stats()
+
+    @get("coalesce_stats")
+    def coalesce_stats(self) -> dict:
+        """Return how many messages were merged into other turns."""
+        return COALESCER.stats()
+
+    @get("block_stats")
+    def block_stats(self) -> dict:
+        """Return how many produced blocks were quoted, auto-attached, and how many unknown ids were ignored."""
+        return BLOCK_STATS.stats()
+
+    @get("block_content_stats")
+    def block_content_stats(self) -> dict:
+        """Return hit / miss counters and the bytes not downloaded again thanks to the per-turn block content cache."""
+        return BLOCK_CONTENT_STATS.stats()
+
+    @get("dispatch_stats")
+    def dispatch_stats(self) -> dict:
+        """Return queue depths, rejected turns, and queue-wait vs processing time."""
+        return self.dispatcher().stats()
+
+    @get("span_stats")
+    def span_stats(self) -> dict:
+        """Return count, errors and estimated p50 / p95 / p99 of every traced phase."""
+        return SPAN_METRICS.stats()
+
+    @get("outbound_stats")
+    def outbound_stats(self) -> dict:
+        """Return sent / throttled counters and queue delay of the outbound send queue."""
+        return get_send_queue(self.config.bot_token).stats()
+
+    @get("startup_stats")
+    def startup_stats(self) -> dict:
+        """Return init and warm-up timings and the first (cold) turn vs. later (warm) turns."""
+        return STARTUP.stats()
+
+    @get("metrics")
+    def metrics(self) -> InvocableResponse:
+        """Return the phase duration histograms in the Prometheus text format."""
+        return InvocableResponse(string=SPAN_METRICS.render(), mime_type=MimeTypes.TXT)
+
     # 使用@post装饰器将它标记为一个HTTP POST请求的处理方法。它接收一个message和chat_id参数，用于发送消息到Telegram。
     # 在方法内部，通过self.telegram_transport.send()方法发送了一条ChatMessage对象的列表，该对象包含要发送的消息内容和聊天id。最后，方法返回字符串"ok"。
     @post("send_message")
@@ -35,7 +157,9 @@ class LangChainAgentBot(TelegramBot):
         """Send a message to Telegram.
 
         Note: This is a private endpoint that requires authentication."""
-        self.telegram_transport.send([ChatMessage(text=message, chat_id=chat_id)])
+        self.telegram_transport.send(
+            [ChatMessage(text=message, chat_id=chat_id)], priority=PRIORITY_BACKGROUND
+        )
         return "ok"
 
     # 用于延迟一定时间后调用send_message()方法发送消息。它接收delay_ms、message和chat_id参数，其中delay_ms表示延迟的时间（以毫秒为单位）。
@@ -51,45 +175,182 @@ class LangChainAgentBot(TelegramBot):
         )
 
     # 这个方法用于根据用户输入生成聊天机器人的回复。它接收一个ChatMessage对象作为输入，并返回一个包含多个ChatMessage对象的列表作为回复。
+    # 同步版本只是acreate_response()的简单包装。
     def create_response(
         self, incoming_message: ChatMessage
     ) -> Optional[List[ChatMessage]]:
         """Use the LLM to prepare the next response by appending the user input to the file and then generating."""
-        # 首先检查如果用户输入是"/start"，则返回一条初始回复消息。
-        if incoming_message.text == "/start":
-            return [
-                ChatMessage(
-                    text="New conversation started.",
-                    chat_id=incoming_message.get_chat_id(),
+        return run_sync(self.acreate_response(incoming_message))
+
+    # create_response()的异步版本。代理、工具和块的发布都以异步方式运行，等待图片或语音生成时不占用线程，
+    # 因此一个进程可以同时处理多个聊天。
+    async def acreate_response(
+        self, incoming_message: ChatMessage
+    ) -> Optional[List[ChatMessage]]:
+        """Prepare the next response without blocking the event loop."""
+        chat_id = incoming_message.get_chat_id()
+        # 这一轮中记录的所有span都带有同一个turn_id和chat_id
+        with turn(chat_id), span("response"):
+            # 首先检查如果用户输入是"/start"，则返回一条初始回复消息。
+            if incoming_message.text == "/start":
+                await run_blocking(self.invalidate_agent, chat_id)
+                return [
+                    ChatMessage(
+                        text="New conversation started.",
+                        chat_id=chat_id,
+                    )
+                ]
+
+            # 短时间内连续发送的多条消息合并为一条输入，只运行一次代理。被并入其它消息的调用不需要回复。
+            # 合并只发生在同一个进程中（见MessageCoalescer），其它进程处理的消息仍然单独回复。
+            window = self.coalesce_window()
+            if window > 0 and incoming_message.text and not incoming_message.text.startswith("/"):
+                merged = await COALESCER.coalesce(
+                    (self.config.bot_token, chat_id), incoming_message.text, window
                 )
-            ]
+                if merged is None:
+                    return None
+                incoming_message.text = merged
 
-        # 否则，它通过调用self.get_agent()方法获取聊天机器人的执行者对象
-        conversation = self.get_agent(
-            chat_id=incoming_message.get_chat_id(),
-        )
-        # 使用conversation.run()方法传入用户输入来获取机器人的回复。
-        response = conversation.run(input=incoming_message.text)
-        response = UUID_PATTERN.split(response)
-        # 对列表中的每个元素进行处理，去掉开头的非单词字符
-        response = [re.sub(r"^\W+", "", el) for el in response]
-        # 如果存在语音工具（voice_tool()方法返回非None），则对每个回复进行判断
-        if audio_tool := self.voice_tool():
-            response_messages = []
-            for message in response:
-                response_messages.append(message)
-                # 如果不是有效的UUID（表示文本消息），则通过语音工具将文本转换为语音，并将语音的UUID添加到回复列表中。
-                if not is_valid_uuid(message):
-                    audio_uuid = audio_tool.run(message)
-                    response_messages.append(audio_uuid)
+            async def run_turn() -> List[ChatMessage]:
+                started = time.perf_counter()
+                try:
+                    # 收集本轮中工具生成的块，回复中只有这些块会作为附件发送
+                    with span("turn"), collect_blocks(), cache_block_contents():
+                        messages = await self._arun_turn(incoming_message)
+                except Exception:
+                    STARTUP.record_turn(time.perf_counter() - started, error=True)
+                    raise
+                STARTUP.record_turn(time.perf_counter() - started)
+                return messages
+
+            # 同一个聊天的轮次按顺序逐个执行，不同聊天并行执行，但同时运行的轮数有上限。队列已满时返回一条繁忙提示。
+            # 这些限制只在当前进程内有效（见ChatDispatcher）。
+            try:
+                return await self.dispatcher().run((self.config.bot_token, chat_id), run_turn)
+            except DispatcherOverloaded as e:
+                logging.warning(f"Rejected turn for chat {chat_id}: {e}")
+                return [ChatMessage(text=OVERLOADED_MESSAGE, chat_id=chat_id)]
+
+    # 运行一轮对话：选择处理路径，运行代理或聊天链，并把回复转换为ChatMessage对象的列表。
+    async def _arun_turn(self, incoming_message: ChatMessage) -> List[ChatMessage]:
+        chat_id = incoming_message.get_chat_id()
+        started = time.perf_counter()
+        # 使用路由器对消息进行分类。闲聊消息交给精简的单次调用的聊天链处理，其它消息交给完整的ReAct代理。
+        router = self.get_router()
+        route = router.classify(incoming_message.text) if router else Route.TOOL
+        conversation = None
+        if route == Route.CHITCHAT:
+            with span("get_chat_chain"):
+                conversation = await run_blocking(self.get_chat_chain, chat_id)
+        if conversation is None:
+            if route == Route.CHITCHAT:
+                route = Route.TOOL
+            # 否则，它通过调用self.get_agent()方法获取聊天机器人的执行者对象
+            with span("get_agent"):
+                conversation = await run_blocking(self.get_agent, chat_id)
+
+        audio_tool = self.voice_tool()
+        # 如果启用了流式语音，则在最终回复的每个句子就绪后立即生成并发送语音。
+        if audio_tool and self.is_voice_streaming_enabled():
+            messages = await self.acreate_streaming_voice_response(
+                conversation, incoming_message, audio_tool
+            )
+            ROUTER_STATS.record(route, time.perf_counter() - started)
+            return messages
+
+        # 使用conversation.arun()方法传入用户输入来获取机器人的回复。
+        response = await conversation.arun(input=incoming_message.text)
+        # 将回复切分为文本和本轮生成的块
+        response = segment_response(response)
+        # 如果存在语音工具（voice_tool()方法返回非None），则为每段文本生成语音
+        if audio_tool:
+            response_messages = await self.aadd_voice_to_response(audio_tool, response)
         else:
             response_messages = response
 
-        # 调用self.agent_output_to_chat_messages()方法将回复转换为ChatMessage对象的列表，并返回该列表作为方法的结果。
-        return self.agent_output_to_chat_messages(
-            chat_id=incoming_message.get_chat_id(), agent_output=response_messages
+        # 调用self.aagent_output_to_chat_messages()方法将回复转换为ChatMessage对象的列表，并返回该列表作为方法的结果。
+        messages = await self.aagent_output_to_chat_messages(
+            chat_id=chat_id, agent_output=response_messages
+        )
+        ROUTER_STATS.record(route, time.perf_counter() - started)
+        return messages
+
+    # 流式语音模式：最终回复按句子切分，每个句子立即交给语音工具，语音按顺序在就绪后直接发送到聊天中。
+    # 文本和图片仍然作为方法的返回值，在所有语音发送完毕后返回。
+    def create_streaming_voice_response(
+        self, conversation: "Chain", incoming_message: ChatMessage, audio_tool: "Tool"
+    ) -> List[ChatMessage]:
+        """Run the conversation and send speech for each sentence of the final answer as soon as it is ready."""
+        return run_sync(
+            self.acreate_streaming_voice_response(conversation, incoming_message, audio_tool)
         )
 
+    async def acreate_streaming_voice_response(
+        self, conversation: "Chain", incoming_message: ChatMessage, audio_tool: "Tool"
+    ) -> List[ChatMessage]:
+        """Async version of `create_streaming_voice_response`."""
+        from agent.streaming import FinalAnswerStreamHandler, VoiceStreamer
+
+        chat_id = incoming_message.get_chat_id()
+
+        produced = current_blocks()
+
+        # 语音在VoiceStreamer的线程中生成并发送，已经发送的语音不会再附在回复中
+        def send_audio(audio_uuid: str):
+            if produced is not None:
+                produced.mark_delivered(audio_uuid)
+            self.telegram_transport.send(
+                self.agent_output_to_chat_messages(chat_id=chat_id, agent_output=[audio_uuid])
+            )
+
+        streamer = VoiceStreamer(
+            audio_tool, send=send_audio, max_workers=self.voice_concurrency()
+        )
+        try:
+            handler = FinalAnswerStreamHandler(on_sentence=streamer.submit)
+            response = await conversation.arun(
+                input=incoming_message.text, callbacks=[handler]
+            )
+            # 不是代理的对话链（例如闲聊链）不会触发on_agent_finish，在这里处理最终回复
+            handler.finish(response)
+        finally:
+            await run_blocking(streamer.close)
+        logging.info(f"[voice-stream] time to first audio: {streamer.time_to_first_audio}s")
+
+        response = segment_response(response, produced)
+        return await self.aagent_output_to_chat_messages(chat_id=chat_id, agent_output=response)
+
+    # 并发地为每段文本生成语音（最多voice_concurrency()个同时进行），并将语音的UUID插入到对应文本之后，保持原有顺序。
+    # 某一段语音生成失败时，只保留该段文本，不影响整个回复。
+    def add_voice_to_response(self, audio_tool: "Tool", response: List[str]) -> List[str]:
+        """Synthesize speech for every text segment concurrently, preserving the reply order."""
+        return run_sync(self.aadd_voice_to_response(audio_tool, response))
+
+    async def aadd_voice_to_response(
+        self, audio_tool: "Tool", response: List[str]
+    ) -> List[str]:
+        """Async version of `add_voice_to_response`."""
+        limit = asyncio.Semaphore(max(1, self.voice_concurrency()))
+
+        async def synthesize(message: str) -> Optional[str]:
+            if not message.strip() or is_attachment(message):
+                return None
+            async with limit:
+                try:
+                    return await audio_tool.arun(message)
+                except Exception as e:
+                    logging.warning(f"Unable to generate speech for segment, sending text only: {e}")
+                    return None
+
+        audio = await asyncio.gather(*[synthesize(message) for message in response])
+        response_messages = []
+        for message, audio_uuid in zip(response, audio):
+            response_messages.append(message)
+            if audio_uuid is not None:
+                response_messages.append(audio_uuid)
+        return response_messages
+
     # 这个方法用于将多模态代理的输出转换为`ChatMessage`对象的列表。多模态代理的回复可能包含一个或多个可解析的UUID（表示包含二进制数据的块）或文本。
     # 在这个方法中，对每个字符串进行检查，并根据其类型创建相应类型的`ChatMessage`对象。
     def agent_output_to_chat_messages(
@@ -98,22 +359,35 @@ class LangChainAgentBot(TelegramBot):
         """Transform the output of the Multi-Modal Agent into a list of ChatMessage objects.
 
         The response of a Multi-Modal Agent contains one or more:
-        - parseable UUIDs, representing a block containing binary data, or:
+        - ids of blocks produced in this turn, representing binary data, or:
         - Text
 
         This method inspects each string and creates a ChatMessage of the appropriate type.
         """
+        return run_sync(
+            self.aagent_output_to_chat_messages(chat_id=chat_id, agent_output=agent_output)
+        )
+
+    async def aagent_output_to_chat_messages(
+        self, chat_id: str, agent_output: List[str]
+    ) -> List[ChatMessage]:
+        """Async version of `agent_output_to_chat_messages`."""
+        # 所有UUID对应的块并发解析（最多BLOCK_RESOLVE_MAX_WORKERS个同时进行），结果按原有顺序重新组装。
+        limit = asyncio.Semaphore(BLOCK_RESOLVE_MAX_WORKERS)
+
+        async def resolve(block_id: str) -> ChatMessage:
+            async with limit:
+                return await self.ablock_to_chat_message(chat_id, block_id)
+
+        uuids = list(dict.fromkeys(part for part in agent_output if is_attachment(part)))
+        resolved = await asyncio.gather(*[resolve(block_id) for block_id in uuids])
+        block_messages = dict(zip(uuids, resolved))
+
         ret = []
         for part_response in agent_output:
-            # 如果字符串是有效的UUID，则通过`Block.get()`方法获取对应的块对象，并使用`ChatMessage.from_block()`方法创建一个基于该块的`ChatMessage`对象。
-            if is_valid_uuid(part_response):
-                block = Block.get(self.client, _id=part_response)
-                message = ChatMessage.from_block(
-                    block,
-                    chat_id=chat_id,
-                )
-                # 通过`make_block_public()`方法将块设置为公开访问，并将其URL赋值给`message.url`属性。
-                message.url = make_block_public(self.client, block)
+            # 如果字符串是本轮生成的块，则使用并发解析得到的`ChatMessage`对象。
+            if part_response in block_messages:
+                message = block_messages[part_response]
 
             # 如果字符串不是有效的UUID，则创建一个普通文本消息的`ChatMessage`对象。
             else:
@@ -126,3 +400,32 @@ class LangChainAgentBot(TelegramBot):
             # 将创建的`ChatMessage`对象添加到结果列表中，并返回该列表作为方法的结果。
             ret.append(message)
         return ret
+
+    # 通过`Block.get()`方法获取块对象，使用`ChatMessage.from_block()`方法创建一个基于该块的`ChatMessage`对象，
+    # 再通过`make_block_public()`方法将块设置为公开访问，并将其URL赋值给`message.url`属性。每一步的耗时都会被记录。
+    def block_to_chat_message(self, chat_id: str, block_id: str) -> ChatMessage:
+        """Resolve a block id into a published ChatMessage."""
+        return run_sync(self.ablock_to_chat_message(chat_id, block_id))
+
+    async def ablock_to_chat_message(self, chat_id: str, block_id: str) -> ChatMessage:
+        """Async version of `block_to_chat_message`."""
+        with span("block_get"):
+            block = await run_blocking(Block.get, self.client, _id=block_id)
+        # 缓存的块可能已经发送到其它聊天中，去掉其原有的chat id标签，避免与当前chat id冲突。
+        block.tags = [
+            tag
+            for tag in block.tags
+            if not (tag.kind == DocTag.CHAT and tag.name == ChatTag.CHAT_ID)
+        ]
+        message = ChatMessage.from_block(block)
+        # chat id只作为本地标签加在发出的消息上：set_chat_id()会在服务端为块创建一个新标签，
+        # 缓存的语音每发送一次就会多一个标签。
+        message.tags.append(
+            Tag(
+                kind=DocTag.CHAT,
+                name=ChatTag.CHAT_ID,
+                value={TagValueKey.STRING_VALUE: str(chat_id)},
+            )
+        )
+        message.url = await amake_block_public(self.client, block)
+        return message
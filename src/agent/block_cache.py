@@ -0,0 +1,109 @@
+"""Turn-scoped, size-bounded cache of block contents shared by tools and publishing."""
+import contextlib
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+# 每轮对话缓存的块内容的总字节数上限，超过时淘汰最久未使用的内容；单个内容超过上限时不缓存
+BLOCK_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+
+# 一轮对话中已经下载或生成的块内容，例如语音工具为了写入语音缓存而下载的音频，发布时直接上传，不再重新下载。
+class BlockContentCache:
+    """Size-bounded LRU of block contents for one turn."""
+
+    def __init__(self, max_bytes: int = BLOCK_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._contents: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, block_id: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._contents.get(block_id)
+            if data is not None:
+                self._contents.move_to_end(block_id)
+        BLOCK_CONTENT_STATS.record(hit=data is not None, saved=len(data) if data is not None else 0)
+        return data
+
+    def put(self, block_id: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._contents.pop(block_id, None)
+            if previous is not None:
+                self.size -= len(previous)
+            while self._contents and self.size + len(data) > self.max_bytes:
+                _, evicted = self._contents.popitem(last=False)
+                self.size -= len(evicted)
+                BLOCK_CONTENT_STATS.record_eviction()
+            self._contents[block_id] = data
+            self.size += len(data)
+
+
+# 统计块内容缓存的命中情况：每次命中都省去了一次下载，saved_bytes是省去下载的字节数。
+class BlockContentStats:
+    """Process-wide counters of the turn-scoped block content caches."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_bytes = 0
+
+    def record(self, hit: bool, saved: int = 0) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.saved_bytes += saved
+            else:
+                self.misses += 1
+
+    def record_eviction(self) -> None:
+        with self._lock:
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "saved_bytes": self.saved_bytes,
+            }
+
+
+BLOCK_CONTENT_STATS = BlockContentStats()
+
+_CONTENTS: ContextVar[Optional[BlockContentCache]] = ContextVar("block_contents", default=None)
+
+
+# 在上下文中缓存块内容，退出时释放。run_blocking在线程池中执行的工具调用也使用同一个缓存。
+@contextlib.contextmanager
+def cache_block_contents(max_bytes: int = BLOCK_CACHE_MAX_BYTES):
+    """Share block contents between tools and publishing within this context."""
+    cache = BlockContentCache(max_bytes)
+    token = _CONTENTS.set(cache)
+    try:
+        yield cache
+    finally:
+        _CONTENTS.reset(token)
+
+
+# 工具已经得到块的内容时调用，供本轮之后的发布使用。不在对话轮次中时什么也不做。
+def remember_block_content(block_id: str, data: bytes) -> None:
+    """Keep the content of `block_id` for the rest of the current turn."""
+    cache = _CONTENTS.get()
+    if cache is not None:
+        cache.put(block_id, data)
+
+
+# 返回本轮已经缓存的块内容，没有时返回None。
+def cached_block_content(block_id: str) -> Optional[bytes]:
+    """Return the content of `block_id` if it was kept earlier in this turn."""
+    cache = _CONTENTS.get()
+    if cache is None:
+        return None
+    return cache.get(block_id)
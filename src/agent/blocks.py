@@ -0,0 +1,181 @@
+"""Turn-scoped registry of the blocks produced by tools, and segmentation of replies into text and attachments."""
+import asyncio
+import contextlib
+import functools
+import logging
+import re
+import threading
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+from agent.utils import UUID_PATTERN, is_valid_uuid
+
+# 附件之前的文本末尾残留的括号、引号等，以及附件之后的文本开头残留的标点
+LEADING_PUNCTUATION = re.compile(r"^\W+")
+TRAILING_OPENERS = " \t\n([{<\"'`"
+
+
+# 一轮对话中工具生成的块，按生成的顺序保存，并记录哪些已经发送给了用户。
+class ProducedBlocks:
+    """Block ids produced by tools during one turn, in production order."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources: Dict[str, str] = {}
+        self._delivered = set()
+
+    def register(self, block_id: str, source: str = "") -> None:
+        with self._lock:
+            self._sources.setdefault(block_id, source)
+
+    def __contains__(self, block_id: str) -> bool:
+        with self._lock:
+            return block_id in self._sources
+
+    def source(self, block_id: str) -> Optional[str]:
+        with self._lock:
+            return self._sources.get(block_id)
+
+    def mark_delivered(self, block_id: str) -> None:
+        with self._lock:
+            self._delivered.add(block_id)
+
+    # 已经生成、但还没有发送的块
+    def undelivered(self) -> List[str]:
+        with self._lock:
+            return [block_id for block_id in self._sources if block_id not in self._delivered]
+
+
+_PRODUCED: ContextVar[Optional[ProducedBlocks]] = ContextVar("produced_blocks", default=None)
+
+
+# 在上下文中收集一轮对话中生成的块。run_blocking在线程池中执行的工具调用也会登记到同一个对象中。
+@contextlib.contextmanager
+def collect_blocks():
+    """Collect the blocks that tools produce within this context."""
+    produced = ProducedBlocks()
+    token = _PRODUCED.set(produced)
+    try:
+        yield produced
+    finally:
+        _PRODUCED.reset(token)
+
+
+def current_blocks() -> Optional[ProducedBlocks]:
+    """Return the blocks produced so far in this turn, if a turn is being collected."""
+    return _PRODUCED.get()
+
+
+# 工具生成块后调用，登记到当前这一轮中。不在对话轮次中（例如自拍池在后台生成图片）时什么也不做。
+def register_block(block_id: str, source: str = "") -> str:
+    """Record that `block_id` was produced in the current turn and return it."""
+    produced = _PRODUCED.get()
+    if produced is not None:
+        produced.register(block_id, source)
+    return block_id
+
+
+# 把工具的run()或arun()返回的块UUID登记到当前这一轮中，来源为工具的名称。
+def registers_block(method: Callable) -> Callable:
+    """Decorate a tool's `run` or `arun` so that the block id it returns is registered in the current turn."""
+    if asyncio.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            return register_block(await method(self, *args, **kwargs), self.name)
+
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return register_block(method(self, *args, **kwargs), self.name)
+
+    return wrapper
+
+
+# 判断回复中的一段是否是附件：在对话轮次中只接受本轮生成的块，否则退回到检查是否是有效的UUID。
+def is_attachment(part: str, produced: Optional[ProducedBlocks] = None) -> bool:
+    if produced is None:
+        produced = _PRODUCED.get()
+    if produced is None:
+        return is_valid_uuid(part)
+    return part in produced
+
+
+# 统计附件的处理情况：LLM引用的、LLM忘记引用而自动附上的，以及不是本轮生成而被忽略的UUID（每个都省去了一次Block.get）。
+class BlockStats:
+    """Counters of quoted, auto-attached and ignored block ids."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.quoted = 0
+        self.auto_attached = 0
+        self.ignored = 0
+
+    def record(self, quoted: int, auto_attached: int, ignored: int) -> None:
+        with self._lock:
+            self.quoted += quoted
+            self.auto_attached += auto_attached
+            self.ignored += ignored
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "quoted": self.quoted,
+                "auto_attached": self.auto_attached,
+                "ignored": self.ignored,
+            }
+
+
+BLOCK_STATS = BlockStats()
+
+
+def _append_text(segments: List[str], text: str, after_attachment: bool) -> None:
+    if after_attachment:
+        text = LEADING_PUNCTUATION.sub("", text)
+    text = text.strip()
+    if text:
+        segments.append(text)
+
+
+# 一次遍历把回复切分为文本和附件（块的UUID），保持原有顺序。
+# 只有本轮生成的块会成为附件，其它UUID（LLM编造的或者抄错的）从文本中去掉，不会去请求不存在的块。
+# 本轮生成、但LLM忘记引用的块附在回复的最后。
+def segment_response(text: str, produced: Optional[ProducedBlocks] = None) -> List[str]:
+    """Split a reply into text segments and attachment block ids, attaching produced media the reply forgot."""
+    if produced is None:
+        produced = _PRODUCED.get()
+    segments: List[str] = []
+    quoted = []
+    ignored = 0
+    pending = ""
+    after_attachment = False
+    start = 0
+    for match in UUID_PATTERN.finditer(text):
+        block_id = match.group(0)
+        pending += text[start : match.start()]
+        start = match.end()
+        if not is_attachment(block_id, produced):
+            ignored += 1
+            pending = pending.rstrip(" \t")
+            continue
+        _append_text(segments, pending.rstrip(TRAILING_OPENERS), after_attachment)
+        pending = ""
+        if block_id not in quoted:
+            segments.append(block_id)
+            quoted.append(block_id)
+        after_attachment = True
+    _append_text(segments, pending + text[start:], after_attachment)
+
+    auto_attached = []
+    if produced is not None:
+        auto_attached = [block_id for block_id in produced.undelivered() if block_id not in quoted]
+        segments.extend(auto_attached)
+        for block_id in quoted + auto_attached:
+            produced.mark_delivered(block_id)
+    if ignored:
+        logging.info(f"Ignored {ignored} block id(s) that were not produced in this turn")
+    if auto_attached:
+        logging.info(f"Attached {len(auto_attached)} produced block(s) the reply did not mention")
+    BLOCK_STATS.record(len(quoted), len(auto_attached), ignored)
+    return segments
@@ -0,0 +1,175 @@
+"""Small in-process caches shared by the bot and its tools."""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+# LRUCache是一个线程安全的LRU缓存，支持容量上限(maxsize)和空闲过期时间(ttl，单位秒)，并记录命中、未命中和淘汰次数。
+class LRUCache:
+    """Thread-safe LRU cache with a size cap and an optional idle TTL."""
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._last_access: Dict[Hashable, float] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data and not self._is_expired(key, time.monotonic())
+
+    def _is_expired(self, key: Hashable, now: float) -> bool:
+        return self.ttl is not None and now - self._last_access[key] > self.ttl
+
+    def _remove(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        self._last_access.pop(key, None)
+
+    # 读取缓存。如果条目已过期则将其淘汰并视为未命中；命中时刷新其访问时间和LRU顺序。
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for `key`, or `default` on a miss."""
+        with self._lock:
+            now = time.monotonic()
+            if key in self._data:
+                if not self._is_expired(key, now):
+                    self._data.move_to_end(key)
+                    self._last_access[key] = now
+                    self.hits += 1
+                    return self._data[key]
+                self._remove(key)
+                self.evictions += 1
+            self.misses += 1
+            return default
+
+    # 写入缓存，超过容量时淘汰最久未使用的条目。
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store `value` under `key`, evicting the least recently used entries if needed."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._last_access[key] = time.monotonic()
+            self.prune()
+            while len(self._data) > self.maxsize:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    # 如果缓存中没有该键，则调用factory创建值并写入缓存。
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the cached value for `key`, creating it with `factory` on a miss."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove `key` from the cache, returning its value if present."""
+        with self._lock:
+            value = self._data.get(key, default)
+            self._remove(key)
+            return value
+
+    # 删除所有满足predicate条件的键，返回删除的数量。
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Remove every key for which `predicate(key)` is true."""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    # 淘汰所有已过期的条目。
+    def prune(self) -> int:
+        """Evict all expired entries."""
+        if self.ttl is None:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            expired = [key for key in self._data if self._is_expired(key, now)]
+            for key in expired:
+                self._remove(key)
+            self.evictions += len(expired)
+            return len(expired)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._last_access.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hit / miss / eviction counters of this cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# SingleFlight保证同一个键同时只有一个调用在执行，其它并发的相同调用等待并共享同一个结果（或异常）。
+class SingleFlight:
+    """Deduplicate concurrent calls that share the same key."""
+
+    def __init__(self):
+        self.shared = 0
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.shared += 1
+        return future, leader
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run `fn` for `key`, or wait for the call already in flight for it."""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+    # do()的异步版本，fn返回一个协程。正在进行的调用保存在线程安全的Future中，因此同步和异步的调用者，以及不同事件循环中的调用者可以共享同一次调用。
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `fn()` for `key`, or wait for the call already in flight for it."""
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            future.set_result(await fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
@@ -0,0 +1,90 @@
+"""Merge bursts of consecutive messages in a chat into a single agent turn."""
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional
+
+# 一次合并最多等待的时间是窗口的多少倍，避免用户持续发送消息时一直不回复
+COALESCE_MAX_WAIT_FACTOR = 4
+# 合并后的消息之间的分隔符
+COALESCE_SEPARATOR = "\n"
+
+
+class _Burst:
+    def __init__(self, text: str, window: float, now: float):
+        self.texts: List[str] = [text]
+        self.window = window
+        self.started = now
+        self.last = now
+
+    @property
+    def deadline(self) -> float:
+        return min(
+            self.last + self.window,
+            self.started + self.window * COALESCE_MAX_WAIT_FACTOR,
+        )
+
+
+# MessageCoalescer在每个聊天的第一条消息到达后等待一个短窗口，窗口内到达的后续消息会并入同一次合并，并把窗口顺延。
+# 窗口结束时，第一条消息的调用者得到合并后的文本并运行一次代理；后续消息的调用者得到None，不需要回复。
+# 状态由线程锁保护，因此不同线程、不同事件循环中处理的消息也可以合并。
+# 合并的状态只保存在进程内存中：只有同一个聊天的webhook调用落在同一个进程中时才会合并，
+# 落在其它进程（或其它Steamship实例副本）中的消息会各自得到一次回复，不会丢失。
+class MessageCoalescer:
+    """Per-chat debounce that merges rapid consecutive messages into one input."""
+
+    def __init__(self, separator: str = COALESCE_SEPARATOR):
+        self.separator = separator
+        self.messages = 0
+        self.turns = 0
+        self.merged = 0
+        self.largest_burst = 0
+        self._bursts: Dict[Hashable, _Burst] = {}
+        self._lock = threading.Lock()
+
+    # 返回需要回复的合并后的文本。如果消息被并入了其它调用者正在等待的合并中，则返回None。
+    async def coalesce(self, key: Hashable, text: str, window: float) -> Optional[str]:
+        """Wait for the burst of `key` to settle and return its merged text, or None if `text` joined another burst."""
+        now = time.monotonic()
+        with self._lock:
+            self.messages += 1
+            burst = self._bursts.get(key)
+            if burst is not None:
+                burst.texts.append(text)
+                burst.last = now
+                self.merged += 1
+                return None
+            burst = _Burst(text, window, now)
+            self._bursts[key] = burst
+
+        try:
+            while True:
+                with self._lock:
+                    delay = burst.deadline - time.monotonic()
+                    if delay <= 0:
+                        del self._bursts[key]
+                        texts = burst.texts
+                        self.turns += 1
+                        self.largest_burst = max(self.largest_burst, len(texts))
+                        break
+                await asyncio.sleep(delay)
+        finally:
+            # 等待被取消时移除这次合并，否则之后的消息会并入一个没有人回复的合并中
+            with self._lock:
+                if self._bursts.get(key) is burst:
+                    del self._bursts[key]
+        return self.separator.join(texts)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how many messages were merged and how many agent runs were avoided."""
+        with self._lock:
+            return {
+                "messages": self.messages,
+                "turns": self.turns,
+                "messages_merged": self.merged,
+                # 每条被合并的消息本来都需要至少一次完整的代理运行（读取历史并调用LLM）
+                "llm_calls_avoided": self.merged,
+                "avg_burst_size": self.messages / self.turns if self.turns else 0.0,
+                "largest_burst": self.largest_burst,
+                "pending": len(self._bursts),
+            }
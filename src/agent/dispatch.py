@@ -0,0 +1,202 @@
+"""Per-chat serialized turns over a bounded number of concurrent agent runs."""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# 默认同时运行的轮数上限、每个聊天排队的轮数上限，以及所有聊天排队的轮数上限
+DISPATCH_MAX_WORKERS = 8
+DISPATCH_MAX_QUEUE_PER_CHAT = 4
+DISPATCH_MAX_PENDING = 64
+# 用于计算百分位数的最近样本数量
+TIMING_SAMPLES = 1024
+
+_DISPATCHERS: Dict[Tuple[int, int, int], "ChatDispatcher"] = {}
+_DISPATCHERS_LOCK = threading.Lock()
+
+
+class DispatcherOverloaded(Exception):
+    """Raised when a turn cannot be queued because the queues are full."""
+
+
+# 记录耗时的次数、总和、最大值，并根据最近的样本计算百分位数。
+class Timing:
+    """Count, mean, max and percentiles of recent durations."""
+
+    def __init__(self, samples: int = TIMING_SAMPLES):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent: Deque[float] = deque(maxlen=samples)
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._recent.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max,
+        }
+
+
+# ChatDispatcher保证同一个聊天的轮次按到达顺序逐个执行，不同聊天的轮次并行执行，但同时运行的轮数不超过max_workers。
+# 某个聊天排队的轮数达到max_queue_per_chat，或者所有聊天排队的轮数达到max_pending时，新的轮次会被拒绝（DispatcherOverloaded）。
+# 排队使用线程安全的Future，因此不同线程、不同事件循环中处理的消息共享同一个队列。
+# 顺序和并发的限制只在一个进程内有效：同一个聊天的webhook调用落在不同进程中时，它们的轮次可能并行执行，
+# 所有进程合计同时运行的轮数也可能超过max_workers。
+class ChatDispatcher:
+    """Run one turn at a time per chat, and at most `max_workers` turns overall."""
+
+    def __init__(
+        self,
+        max_workers: int = DISPATCH_MAX_WORKERS,
+        max_queue_per_chat: int = DISPATCH_MAX_QUEUE_PER_CHAT,
+        max_pending: int = DISPATCH_MAX_PENDING,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_per_chat = max(1, max_queue_per_chat)
+        self.max_pending = max(1, max_pending)
+        self.rejected = 0
+        self.queue_wait = Timing()
+        self.processing = Timing()
+        # 每个聊天的轮次队列，队首是正在运行或等待工作槽的轮次
+        self._chats: Dict[Hashable, Deque[Future]] = {}
+        # 等待工作槽的轮次
+        self._slot_waiters: Deque[Future] = deque()
+        self._pending = 0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    # 按顺序运行key对应聊天的一轮对话，返回fn()的结果。
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Queue `fn` behind the earlier turns of `key` and run it once a worker slot is free."""
+        enqueued = time.perf_counter()
+        turn = self._enqueue(key)
+        slot = None
+        try:
+            await asyncio.wrap_future(turn)
+            slot = self._acquire_slot()
+            await asyncio.wrap_future(slot)
+        except BaseException:
+            self._abandon(key, turn, slot)
+            raise
+
+        started = time.perf_counter()
+        try:
+            return await fn()
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self.queue_wait.record(started - enqueued)
+                self.processing.record(finished - started)
+            self._release_slot()
+            self._finish(key, turn)
+
+    def _enqueue(self, key: Hashable) -> Future:
+        turn = Future()
+        with self._lock:
+            queue = self._chats.get(key)
+            if queue is not None and len(queue) >= self.max_queue_per_chat:
+                self.rejected += 1
+                raise DispatcherOverloaded(f"Too many turns queued for chat {key}")
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise DispatcherOverloaded("Too many turns queued")
+            if queue is None:
+                queue = self._chats[key] = deque()
+            queue.append(turn)
+            self._pending += 1
+            if len(queue) == 1:
+                turn.set_result(None)
+        return turn
+
+    def _acquire_slot(self) -> Future:
+        slot = Future()
+        with self._lock:
+            if self._running < self.max_workers:
+                self._running += 1
+                slot.set_result(None)
+            else:
+                self._slot_waiters.append(slot)
+        return slot
+
+    # 把工作槽直接交给下一个等待的轮次，没有等待的轮次时释放工作槽。
+    def _release_slot(self) -> None:
+        with self._lock:
+            while self._slot_waiters:
+                waiter = self._slot_waiters.popleft()
+                if not waiter.cancelled():
+                    waiter.set_result(None)
+                    return
+            self._running -= 1
+
+    # 结束key对应聊天的当前轮次，并让该聊天的下一个轮次开始。
+    def _finish(self, key: Hashable, turn: Future) -> None:
+        with self._lock:
+            queue = self._chats[key]
+            queue.remove(turn)
+            self._pending -= 1
+            if queue:
+                if not queue[0].done():
+                    queue[0].set_result(None)
+            else:
+                del self._chats[key]
+
+    # 等待中的轮次被取消时，把它从队列中移除；如果它已经拿到了工作槽，则释放工作槽。
+    def _abandon(self, key: Hashable, turn: Future, slot: Optional[Future]) -> None:
+        holds_slot = False
+        if slot is not None:
+            with self._lock:
+                if slot in self._slot_waiters:
+                    self._slot_waiters.remove(slot)
+                else:
+                    holds_slot = True
+        if holds_slot:
+            self._release_slot()
+        self._finish(key, turn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depths, rejections, and queue-wait vs processing time."""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "pending": self._pending,
+                "chats": len(self._chats),
+                "deepest_chat_queue": max((len(q) for q in self._chats.values()), default=0),
+                "rejected": self.rejected,
+                "queue_wait": self.queue_wait.stats(),
+                "processing": self.processing.stats(),
+            }
+
+
+# 返回给定限制的进程级ChatDispatcher，相同的限制共享同一个对象。
+def get_dispatcher(
+    max_workers: int = DISPATCH_MAX_WORKERS,
+    max_queue_per_chat: int = DISPATCH_MAX_QUEUE_PER_CHAT,
+    max_pending: int = DISPATCH_MAX_PENDING,
+) -> ChatDispatcher:
+    """Return the process-wide dispatcher for these limits."""
+    key = (max_workers, max_queue_per_chat, max_pending)
+    with _DISPATCHERS_LOCK:
+        dispatcher = _DISPATCHERS.get(key)
+        if dispatcher is None:
+            dispatcher = ChatDispatcher(max_workers, max_queue_per_chat, max_pending)
+            _DISPATCHERS[key] = dispatcher
+        return dispatcher
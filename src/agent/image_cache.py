@@ -0,0 +1,108 @@
+"""Cache of generated images keyed by normalized prompt and generation config."""
+import json
+import re
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from agent.cache import LRUCache, SingleFlight
+
+
+# 规范化提示词：合并连续空白、忽略大小写并去掉首尾的标点，使只有空白或大小写差异的提示词命中同一个缓存条目。
+def normalize_prompt(prompt: str) -> str:
+    prompt = re.sub(r"\s+", " ", prompt).strip().casefold()
+    return prompt.strip(" .,;:!?\"'")
+
+
+# ImageCache把(规范化提示词, 生成配置)映射到已生成的图片块的UUID。
+# 为了保持多样性，每个缓存条目最多复用max_reuse次，之后会重新生成图片；max_reuse为None时不限制。
+class ImageCache:
+    """Reuse previously generated images for repeated prompts."""
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        ttl: Optional[float] = None,
+        max_reuse: Optional[int] = None,
+    ):
+        self.max_reuse = max_reuse
+        self.hits = 0
+        self.misses = 0
+        self.refreshed = 0
+        # 缓存的值是[block_id, 复用次数]
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight = SingleFlight()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt: str, config: Optional[Dict[str, Any]] = None) -> str:
+        return json.dumps(
+            [normalize_prompt(prompt), config or {}], sort_keys=True, default=str
+        )
+
+    def get_or_generate(
+        self,
+        prompt: str,
+        generate: Callable[[], str],
+        config: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Return a cached image block id for `prompt`, calling `generate` on a miss."""
+        key = self.key(prompt, config)
+        block_id = self._lookup(key)
+        if block_id is not None:
+            return block_id
+
+        def generate_and_store() -> str:
+            block_id = generate()
+            self._cache.put(key, [block_id, 0])
+            return block_id
+
+        return self._in_flight.do(key, generate_and_store)
+
+    # get_or_generate()的异步版本，generate返回一个协程。
+    async def aget_or_generate(
+        self,
+        prompt: str,
+        generate: Callable[[], Awaitable[str]],
+        config: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Return a cached image block id for `prompt`, awaiting `generate` on a miss."""
+        key = self.key(prompt, config)
+        block_id = self._lookup(key)
+        if block_id is not None:
+            return block_id
+
+        async def generate_and_store() -> str:
+            block_id = await generate()
+            self._cache.put(key, [block_id, 0])
+            return block_id
+
+        return await self._in_flight.ado(key, generate_and_store)
+
+    # 查找缓存的图片并增加其复用次数。未命中或已达到复用上限时返回None。
+    def _lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if self.max_reuse is None or entry[1] < self.max_reuse:
+                    entry[1] += 1
+                    self.hits += 1
+                    return entry[0]
+                # 已达到复用上限，丢弃该条目并重新生成
+                self._cache.pop(key)
+                self.refreshed += 1
+            self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit rate and eviction counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "evictions": self._cache.evictions,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "max_reuse": self.max_reuse,
+            "refreshed": self.refreshed,
+            "deduplicated": self._in_flight.shared,
+        }
@@ -0,0 +1,70 @@
+"""LLM wrapper used by the agent, chat chain and summary memory."""
+from typing import List, Optional
+
+from steamship import Steamship
+from steamship_langchain.llms import OpenAIChat
+
+from agent.aio import run_blocking
+from agent.plugins import get_plugin_instance
+from agent.tracing import span
+
+# Steamship中提供OpenAI聊天模型的插件句柄
+PLUGIN_HANDLE = "gpt-4"
+# 会传递给插件配置的模型参数，与steamship_langchain的OpenAIChat一致
+PLUGIN_MODEL_ARGS = [
+    "max_tokens",
+    "temperature",
+    "top_p",
+    "presence_penalty",
+    "frequency_penalty",
+    "max_retries",
+]
+
+
+# 返回给定模型和参数对应的插件配置，与OpenAIChat.__init__中构造的配置相同。
+def plugin_config(
+    model_name: str,
+    moderate_output: bool = True,
+    openai_api_key: Optional[str] = None,
+    **model_kwargs,
+) -> dict:
+    config = {"model": model_name, "moderate_output": moderate_output}
+    if openai_api_key:
+        config["openai_api_key"] = openai_api_key
+    for arg in PLUGIN_MODEL_ARGS:
+        if model_kwargs.get(arg):
+            config[arg] = model_kwargs[arg]
+    return config
+
+
+# Steamship的OpenAIChat不支持异步调用。AsyncOpenAIChat在线程池中执行同步的generate，使代理可以通过arun()运行。
+# OpenAIChat每次构造时都会调用一次client.use_plugin；这里改为通过进程级的插件注册表解析，相同配置的插件实例只解析一次。
+# 每次LLM调用都记录为一个名为"llm:<模型名称>"的span。
+class AsyncOpenAIChat(OpenAIChat):
+    """OpenAIChat whose async API runs the synchronous generation in the shared worker pool."""
+
+    def __init__(
+        self, client: Steamship, model_name: str = "gpt-4", moderate_output: bool = True, **kwargs
+    ):
+        # 跳过OpenAIChat.__init__，只初始化字段，插件实例从注册表中获取
+        super(OpenAIChat, self).__init__(client=client, **kwargs)
+        self._plugin_model = model_name
+        self._llm_plugin = get_plugin_instance(
+            client,
+            PLUGIN_HANDLE,
+            plugin_config(
+                model_name, moderate_output, self.openai_api_key, **self.model_kwargs
+            ),
+        )
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None):
+        with span(f"llm:{self._plugin_model}", prompts=len(prompts)):
+            return super()._generate(prompts, stop=stop)
+
+    async def agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        callbacks=None,
+    ):
+        return await run_blocking(self.generate, prompts, stop=stop, callbacks=callbacks)
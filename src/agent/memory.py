@@ -0,0 +1,107 @@
+"""Conversation memory that keeps a bounded window and a rolling summary of older turns."""
+from typing import Any, Dict, List, Optional
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.summary import SummarizerMixin
+from langchain.schema import BaseMessage, get_buffer_string
+from pydantic import PrivateAttr
+
+from agent.tracing import span
+
+SUMMARY_KEY = "summary"
+
+
+# SummaryWindowMemory只把最近的max_turns轮对话原样放入提示词，并且这些消息连同摘要不超过max_token_limit个token。
+# 更早的消息被合并到一个增量更新的摘要中：每次只对新移出窗口的消息做摘要。摘要和已摘要的消息数量保存在summary_store中，
+# 因此重新创建内存对象时不必从头重新计算摘要。
+class SummaryWindowMemory(BaseChatMemory, SummarizerMixin):
+    """Keep the last turns verbatim within a token budget and fold older turns into a persisted summary."""
+
+    memory_key: str = "chat_history"
+    max_turns: int = 6
+    max_token_limit: int = 1500
+    # 具有get(key) -> Optional[dict]、set(key, dict)和delete(key)方法的存储，例如steamship的KeyValueStore
+    summary_store: Optional[Any] = None
+    summary_key: str = SUMMARY_KEY
+
+    _summary: str = PrivateAttr(default="")
+    _summarized: int = PrivateAttr(default=0)
+    _loaded: bool = PrivateAttr(default=False)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    @property
+    def summary(self) -> str:
+        self._load_summary()
+        return self._summary
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the summary followed by the recent window of messages."""
+        with span("memory_load"):
+            self._load_summary()
+        messages = self._window(self.chat_memory.messages[self._summarized :])
+        if self._summary:
+            messages = [self.summary_message_cls(content=self._summary)] + messages
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {
+            self.memory_key: get_buffer_string(
+                messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+            )
+        }
+
+    # 保存本轮对话，并把移出窗口的消息合并到摘要中。
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """Save this turn and fold the messages that left the window into the summary."""
+        with span("memory_save"):
+            super().save_context(inputs, outputs)
+        self._load_summary()
+        unsummarized = self.chat_memory.messages[self._summarized :]
+        evicted = unsummarized[: len(unsummarized) - len(self._window(unsummarized))]
+        if not evicted:
+            return
+
+        with span("memory_summarize", messages=len(evicted)):
+            self._summary = self.predict_new_summary(evicted, self._summary)
+        self._summarized += len(evicted)
+        if self.summary_store is not None:
+            self.summary_store.set(
+                self.summary_key,
+                {"summary": self._summary, "summarized": self._summarized},
+            )
+
+    def clear(self) -> None:
+        super().clear()
+        self._summary = ""
+        self._summarized = 0
+        if self.summary_store is not None:
+            self.summary_store.delete(self.summary_key)
+
+    # 从最近的消息开始保留最多max_turns轮对话，并在超出token预算时继续丢弃最早的消息。
+    def _window(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        window = messages[-self.max_turns * 2 :] if self.max_turns > 0 else []
+        budget = self.max_token_limit
+        if self._summary:
+            budget -= self.llm.get_num_tokens(self._summary)
+        while window and self._num_tokens(window) > budget:
+            window = window[1:]
+        return window
+
+    def _num_tokens(self, messages: List[BaseMessage]) -> int:
+        return self.llm.get_num_tokens(
+            get_buffer_string(
+                messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+            )
+        )
+
+    def _load_summary(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.summary_store is None:
+            return
+        saved = self.summary_store.get(self.summary_key) or {}
+        self._summary = saved.get("summary", "")
+        self._summarized = min(saved.get("summarized", 0), len(self.chat_memory.messages))
@@ -1,18 +1,80 @@
 from __future__ import annotations
 
-import json
-from typing import Union, Any
+import logging
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Union
 
 from langchain.agents import AgentOutputParser
-from langchain.schema import AgentAction, AgentFinish
+from langchain.schema import AgentAction, AgentFinish, OutputParserException
 
 from prompts import FORMAT_INSTRUCTIONS
 
+# 只包含代码块标记（```或```text等）的行
+CODE_FENCE_PATTERN = re.compile(r"^[ \t]*```[\w-]*[ \t]*$\n?", re.MULTILINE)
+# 大小写、空格或下划线与格式说明不一致的"Action:"和"Action Input:"
+LOOSE_ACTION_PATTERN = re.compile(
+    r"^\W*Action\s*:\s*(?P<action>.+?)\s*$\s*^\W*Action[\s_]*Input\s*:\s*(?P<input>.*?)\s*(?:^\W*Observation\s*:|\Z)",
+    re.IGNORECASE | re.MULTILINE | re.DOTALL,
+)
+# 写成函数调用形式的动作，例如"Action: Search[today's news]"或"Action: Search(today's news)"
+CALL_ACTION_PATTERN = re.compile(
+    r"^\W*Action\s*:\s*(?P<action>[\w ]+?)\s*[\[(]\s*(?P<input>.*?)\s*[\])]\s*$",
+    re.IGNORECASE | re.MULTILINE | re.DOTALL,
+)
+# ReAct格式中的"Thought: ..."行，以及决定使用工具的想法
+THOUGHT_LINE_PATTERN = re.compile(r"^\W*Thought\s*:.*$\n?", re.IGNORECASE | re.MULTILINE)
+USE_TOOL_PATTERN = re.compile(r"^\W*Thought\s*:.*\btool\?\s*Yes\b", re.IGNORECASE | re.MULTILINE)
+
+
+# 按修复方式统计解析器的结果：直接解析成功、本地修复成功，或者无法修复、由代理重新询问LLM（多一次LLM调用）。
+class ParserStats:
+    """Counters of agent outputs that parsed cleanly, were repaired locally, or needed another LLM call."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.parsed = 0
+        self.repaired: Counter = Counter()
+        self.reprompted = 0
+
+    def record_parsed(self) -> None:
+        with self._lock:
+            self.parsed += 1
+
+    def record_repaired(self, repair: str) -> None:
+        with self._lock:
+            self.repaired[repair] += 1
+
+    def record_reprompted(self) -> None:
+        with self._lock:
+            self.reprompted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            repaired = sum(self.repaired.values())
+            return {
+                "parsed": self.parsed,
+                "repaired": repaired,
+                "repaired_by_kind": dict(self.repaired),
+                "reprompted": self.reprompted,
+                # 每次本地修复都省去了一次重新询问LLM
+                "llm_calls_saved": repaired,
+            }
+
+
+PARSER_STATS = ParserStats()
+
 
 # 定义了一个名为MultiModalOutputParser的类，它是AgentOutputParser类的子类。
+# 解析失败时，按顺序尝试几种确定性的本地修复（去掉代码块标记、宽松地匹配动作、把没有前缀的回复视为最终回复），
+# 只有都失败时才抛出异常，由AgentExecutor（handle_parsing_errors=True）把错误作为观察结果交给LLM重新生成。
 class MultiModalOutputParser(AgentOutputParser):
     # 用于存储对AgentOutputParser类的实例的引用
     parser: AgentOutputParser
+    # 可用工具的名称，用于纠正动作名称的大小写
+    tool_names: List[str] = []
+    ai_prefix: str = "AI"
 
     # 接收一个parser参数和可变的关键字参数data。
     def __init__(self, parser, **data: Any):
@@ -25,15 +87,103 @@ class MultiModalOutputParser(AgentOutputParser):
 
     # 用于解析聊天输出文本，将其转换为AgentAction或AgentFinish对象。
     def parse(self, text: str) -> Union[AgentAction, AgentFinish]:
-        # 首先，将输入文本去除首尾的空白字符
+        # 首先，将输入文本去除首尾的空白字符，交给存储在parser属性中的AgentOutputParser实例解析。
         cleaned_output = text.strip()
+        try:
+            result = self.parser.parse(cleaned_output)
+        except OutputParserException:
+            result = None
+        if result is not None:
+            # 最终回复末尾残留的代码块标记
+            if isinstance(result, AgentFinish) and "```" in result.return_values.get("output", ""):
+                result.return_values["output"] = self._strip_fences(result.return_values["output"])
+                PARSER_STATS.record_repaired("code_fence")
+            # 大小写与工具名称不一致的动作，否则AgentExecutor会把它当作无效的工具，多一次LLM调用
+            elif (
+                isinstance(result, AgentAction)
+                and self.tool_names
+                and result.tool not in self.tool_names
+                and self._tool_name(result.tool) is not None
+            ):
+                result = AgentAction(self._tool_name(result.tool), result.tool_input, result.log)
+                PARSER_STATS.record_repaired("tool_name")
+            else:
+                PARSER_STATS.record_parsed()
+            return result
+
+        # 依次尝试本地修复，第一个成功的修复的结果作为解析结果。
+        for repair, fix in self._repairs():
+            result = fix(cleaned_output)
+            if result is not None:
+                logging.info(f"Repaired malformed agent output ({repair})")
+                PARSER_STATS.record_repaired(repair)
+                return result
+
+        PARSER_STATS.record_reprompted()
+        raise OutputParserException(f"Could not parse LLM output: `{text}`")
+
+    def _repairs(self) -> List[tuple]:
+        return [
+            ("code_fence", self._parse_without_fences),
+            ("loose_action", self._parse_loose_action),
+            ("call_action", self._parse_call_action),
+            ("bare_answer", self._parse_bare_answer),
+        ]
+
+    @staticmethod
+    def _strip_fences(text: str) -> str:
+        return CODE_FENCE_PATTERN.sub("", text).replace("```", "").strip()
+
+    # 去掉代码块标记后再交给parser解析。
+    def _parse_without_fences(self, text: str) -> Optional[Union[AgentAction, AgentFinish]]:
+        if "```" not in text:
+            return None
+        try:
+            return self.parser.parse(self._strip_fences(text))
+        except OutputParserException:
+            return None
+
+    # "Action:"和"Action Input:"的大小写、空格与格式不一致，或者两者之间有空行。
+    def _parse_loose_action(self, text: str) -> Optional[AgentAction]:
+        match = LOOSE_ACTION_PATTERN.search(self._strip_fences(text))
+        return self._action(match, text)
+
+    # 写成函数调用形式的动作，例如"Action: Search[today's news]"。
+    def _parse_call_action(self, text: str) -> Optional[AgentAction]:
+        match = CALL_ACTION_PATTERN.search(self._strip_fences(text))
+        return self._action(match, text)
+
+    # 没有任何动作的输出视为最终回复：去掉"Thought: ..."行和各种写法的回复前缀（"AI :"、"**AI**:"等），剩下的文本就是回复。
+    # 决定使用工具却没有给出动作的输出无法确定要调用哪个工具，不在这里修复。
+    def _parse_bare_answer(self, text: str) -> Optional[AgentFinish]:
+        cleaned = self._strip_fences(text)
+        if USE_TOOL_PATTERN.search(cleaned) or re.search(
+            r"^\W*Action\s*:", cleaned, re.IGNORECASE | re.MULTILINE
+        ):
+            return None
+        cleaned = THOUGHT_LINE_PATTERN.sub("", cleaned).strip()
+        prefix = re.compile(rf"^\W*{re.escape(self.ai_prefix)}\W*:\s*", re.IGNORECASE)
+        cleaned = prefix.sub("", cleaned, count=1).strip()
+        if not cleaned:
+            return None
+        return AgentFinish({"output": cleaned}, text)
 
-        # 检查如果文本以"AI: "开头，则将开头部分删除，只保留后面的内容。
-        if cleaned_output.startswith("AI: "):
-            cleaned_output = cleaned_output[len("AI: ") :]
+    def _action(self, match: Optional[re.Match], text: str) -> Optional[AgentAction]:
+        if match is None:
+            return None
+        action = self._tool_name(match.group("action").strip().strip("`*\"'"))
+        if action is None:
+            return None
+        return AgentAction(action, match.group("input").strip().strip('"'), text)
 
-        # 通过调用self.parser.parse(cleaned_output)方法，将清理后的文本传递给存储在parser属性中的AgentOutputParser实例进行进一步的解析。将解析结果作为方法的返回值，可以是AgentAction或AgentFinish对象。
-        return self.parser.parse(cleaned_output)
+    # 将动作名称与可用的工具名称按不区分大小写的方式匹配；没有提供工具名称时原样返回。
+    def _tool_name(self, action: str) -> Optional[str]:
+        if not self.tool_names:
+            return action or None
+        for name in self.tool_names:
+            if name.lower() == action.lower():
+                return name
+        return None
 
     @property
     #  返回一个字符串，表示解析器的类型。在这里，它返回字符串"conversational_chat"
@@ -0,0 +1,69 @@
+"""Process-wide registry of resolved Steamship plugin instances."""
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from steamship import Steamship
+from steamship.data.plugin.plugin_instance import PluginInstance
+
+from agent.cache import SingleFlight
+
+# (workspace, plugin_handle, 冻结后的配置) -> PluginInstance
+_PLUGIN_INSTANCES: Dict[Tuple[str, str, str], PluginInstance] = {}
+_RESOLVING = SingleFlight()
+
+
+# 将配置字典冻结为一个可哈希的、与键顺序无关的字符串。
+def _freeze(config: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(config or {}, sort_keys=True, default=str)
+
+
+def _key(client: Steamship, plugin_handle: str, config: Optional[Dict[str, Any]]):
+    workspace = client.config.workspace_id or client.config.workspace_handle
+    return workspace, plugin_handle, _freeze(config)
+
+
+# 返回给定插件和配置对应的插件实例。每个(workspace, 插件, 配置)组合只会调用一次client.use_plugin，之后在所有工具和聊天之间共享。
+def get_plugin_instance(
+    client: Steamship, plugin_handle: str, config: Optional[Dict[str, Any]] = None
+) -> PluginInstance:
+    """Return the plugin instance for `plugin_handle` and `config`, resolving it only once per process."""
+    key = _key(client, plugin_handle, config)
+    instance = _PLUGIN_INSTANCES.get(key)
+    if instance is not None:
+        return instance
+
+    def resolve() -> PluginInstance:
+        logging.info(f"Resolving plugin instance for {plugin_handle}")
+        resolved = client.use_plugin(plugin_handle=plugin_handle, config=config)
+        _PLUGIN_INSTANCES[key] = resolved
+        return resolved
+
+    return _RESOLVING.do(key, resolve)
+
+
+# 预先解析一组插件实例，使第一条用户消息不必等待。background为True时在后台线程中执行，不阻塞调用方。
+def warm_up_plugins(
+    client: Steamship,
+    plugins: List[Tuple[str, Optional[Dict[str, Any]]]],
+    background: bool = False,
+) -> None:
+    """Resolve the given `(plugin_handle, config)` pairs ahead of the first request."""
+
+    def warm_up():
+        for plugin_handle, config in plugins:
+            try:
+                get_plugin_instance(client, plugin_handle, config)
+            except Exception as e:
+                logging.warning(f"Unable to warm up plugin {plugin_handle}: {e}")
+
+    if background:
+        threading.Thread(target=warm_up, name="plugin-warm-up", daemon=True).start()
+    else:
+        warm_up()
+
+
+def clear_plugin_instances() -> None:
+    """Forget every resolved plugin instance."""
+    _PLUGIN_INSTANCES.clear()
@@ -0,0 +1,325 @@
+"""Persistent reminder scheduler that delivers due reminders in batches."""
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# 到期时间相差不超过这么多秒的提醒合并为一批发送
+REMINDER_BATCH_WINDOW_SECONDS = 1.0
+# 每批最多发送的提醒数量
+REMINDER_BATCH_SIZE = 100
+# 发送失败后多少秒重试
+REMINDER_RETRY_SECONDS = 30.0
+# 每个聊天最多保留的未到期提醒数量
+MAX_REMINDERS_PER_CHAT = 50
+
+
+# 一条提醒：interval_seconds不为None时为周期性提醒，每次发送后按间隔重新安排。
+class Reminder(NamedTuple):
+    id: str
+    chat_id: str
+    message: str
+    due_at: float
+    interval_seconds: Optional[float] = None
+    created_at: float = 0.0
+
+
+class ReminderStore(ABC):
+    """Storage for pending reminders."""
+
+    @abstractmethod
+    def put(self, reminder: Reminder) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def delete(self, reminder_ids: List[str]) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def all(self) -> List[Reminder]:
+        raise NotImplementedError()
+
+
+# 基于内存的存储，进程重启后提醒会丢失。
+class MemoryReminderStore(ReminderStore):
+    """In-process store."""
+
+    def __init__(self):
+        self._reminders: Dict[str, Reminder] = {}
+        self._lock = threading.Lock()
+
+    def put(self, reminder: Reminder) -> None:
+        with self._lock:
+            self._reminders[reminder.id] = reminder
+
+    def delete(self, reminder_ids: List[str]) -> None:
+        with self._lock:
+            for reminder_id in reminder_ids:
+                self._reminders.pop(reminder_id, None)
+
+    def all(self) -> List[Reminder]:
+        with self._lock:
+            return list(self._reminders.values())
+
+
+# 基于Steamship KeyValueStore的存储，部署后使用：提醒保存在平台上，不依赖进程或本地文件。
+# kv是一个实例专用的KeyValueStore，每条提醒以其id为键保存。
+class KeyValueReminderStore(ReminderStore):
+    """Reminder store backed by a Steamship KeyValueStore."""
+
+    def __init__(self, kv: Any):
+        self.kv = kv
+
+    def put(self, reminder: Reminder) -> None:
+        self.kv.set(reminder.id, reminder._asdict())
+
+    def delete(self, reminder_ids: List[str]) -> None:
+        for reminder_id in reminder_ids:
+            self.kv.delete(reminder_id)
+
+    def all(self) -> List[Reminder]:
+        return [Reminder(**value) for _, value in self.kv.items()]
+
+
+# 基于本地SQLite文件的存储，进程重启后未到期的提醒仍然有效。
+# 同一个文件可以被多个实例共享，每个实例只读写自己的提醒（instance列），不会发送其它实例的提醒。
+class SqliteReminderStore(ReminderStore):
+    """Local SQLite store that survives restarts, scoped to one instance."""
+
+    def __init__(self, path: str, instance: str = ""):
+        self.instance = instance
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS reminders ("
+                "instance TEXT NOT NULL DEFAULT '', id TEXT NOT NULL, chat_id TEXT NOT NULL, "
+                "message TEXT NOT NULL, due_at REAL NOT NULL, interval_seconds REAL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (instance, id))"
+            )
+
+    def put(self, reminder: Reminder) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO reminders "
+                "(instance, id, chat_id, message, due_at, interval_seconds, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.instance, *reminder),
+            )
+
+    def delete(self, reminder_ids: List[str]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM reminders WHERE instance = ? AND id = ?",
+                [(self.instance, reminder_id) for reminder_id in reminder_ids],
+            )
+
+    def all(self) -> List[Reminder]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, chat_id, message, due_at, interval_seconds, created_at "
+                "FROM reminders WHERE instance = ?",
+                (self.instance,),
+            ).fetchall()
+        return [Reminder(*row) for row in rows]
+
+
+# ReminderScheduler把所有提醒放在一个按到期时间排序的最小堆中。到期时间相近的提醒合并为一批，调用一次deliver发送；
+# 周期性提醒发送后重新入堆，其它提醒从存储中删除。创建时从存储中加载所有未发送的提醒，重启期间错过的提醒会立即发送。
+# 由谁调用dispatch_due()有两种方式：本地运行时start()启动一个后台线程等待最早的到期时间；
+# 部署后进程之间不保留线程，on_next_due在最早的到期时间变化时被调用，由平台在那个时间再次调用dispatch_due()。
+class ReminderScheduler:
+    """Min-heap reminder dispatcher backed by a persistent store."""
+
+    def __init__(
+        self,
+        store: ReminderStore,
+        deliver: Callable[[List[Reminder]], None],
+        batch_window: float = REMINDER_BATCH_WINDOW_SECONDS,
+        batch_size: int = REMINDER_BATCH_SIZE,
+        retry_seconds: float = REMINDER_RETRY_SECONDS,
+        max_per_chat: int = MAX_REMINDERS_PER_CHAT,
+        on_next_due: Optional[Callable[[float], None]] = None,
+    ):
+        self.store = store
+        self.deliver = deliver
+        self.on_next_due = on_next_due
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self.max_per_chat = max_per_chat
+        self._reminders: Dict[str, Reminder] = {}
+        # (到期时间, 提醒id)；取消或重新安排的提醒在出堆时根据_reminders跳过
+        self._heap: List[Tuple[float, str]] = []
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self.delivered = 0
+        self.batches = 0
+        self.failures = 0
+        for reminder in store.all():
+            self._reminders[reminder.id] = reminder
+            self._heap.append((reminder.due_at, reminder.id))
+        heapq.heapify(self._heap)
+
+    # 启动后台的发送线程。重复调用不会启动多个线程。
+    def start(self) -> "ReminderScheduler":
+        with self._condition:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def schedule(
+        self,
+        chat_id: str,
+        message: str,
+        delay_seconds: float,
+        interval_seconds: Optional[float] = None,
+    ) -> Reminder:
+        """Schedule `message` for `chat_id` in `delay_seconds`, repeating every `interval_seconds` if given."""
+        if interval_seconds is not None and interval_seconds <= 0:
+            raise ValueError("The interval of a recurring reminder must be positive.")
+        now = time.time()
+        reminder = Reminder(
+            id=uuid.uuid4().hex[:8],
+            chat_id=str(chat_id),
+            message=message,
+            due_at=now + max(0.0, delay_seconds),
+            interval_seconds=interval_seconds,
+            created_at=now,
+        )
+        with self._condition:
+            if len(self.list(chat_id)) >= self.max_per_chat:
+                raise ValueError(f"A chat can have at most {self.max_per_chat} pending reminders.")
+            self.store.put(reminder)
+            self._push(reminder)
+        self._notify_next_due()
+        return reminder
+
+    def cancel(self, chat_id: str, reminder_id: str) -> bool:
+        """Cancel a pending reminder of `chat_id`; return whether it existed."""
+        with self._condition:
+            reminder = self._reminders.get(reminder_id)
+            if reminder is None or reminder.chat_id != str(chat_id):
+                return False
+            del self._reminders[reminder_id]
+            self.store.delete([reminder_id])
+            return True
+
+    def list(self, chat_id: str) -> List[Reminder]:
+        """Return the pending reminders of `chat_id`, soonest first."""
+        with self._condition:
+            reminders = [r for r in self._reminders.values() if r.chat_id == str(chat_id)]
+        return sorted(reminders, key=lambda reminder: reminder.due_at)
+
+    # 发送所有在now + batch_window之前到期的提醒，每batch_size条调用一次deliver，返回发送的数量。
+    def dispatch_due(self, now: Optional[float] = None) -> int:
+        """Deliver every reminder that is due, in batches."""
+        now = time.time() if now is None else now
+        sent = 0
+        while True:
+            with self._condition:
+                batch = self._pop_due(now + self.batch_window)
+            if not batch:
+                self._notify_next_due()
+                return sent
+            try:
+                self.deliver(batch)
+            except Exception as e:
+                logging.warning(f"Unable to deliver {len(batch)} reminder(s), retrying in {self.retry_seconds}s: {e}")
+                with self._condition:
+                    self.failures += 1
+                    for reminder in batch:
+                        self._push(reminder._replace(due_at=now + self.retry_seconds))
+                self._notify_next_due()
+                return sent
+            with self._condition:
+                self._finish(batch, now)
+            sent += len(batch)
+
+    # 最早的未发送提醒的到期时间，没有时返回None
+    def next_due(self) -> Optional[float]:
+        with self._condition:
+            return min((r.due_at for r in self._reminders.values()), default=None)
+
+    def _notify_next_due(self) -> None:
+        if self.on_next_due is None:
+            return
+        next_due = self.next_due()
+        if next_due is not None:
+            self.on_next_due(next_due)
+
+    def stats(self) -> Dict[str, float]:
+        """Return pending / delivered counters and the time until the next reminder."""
+        next_due = self.next_due()
+        with self._condition:
+            return {
+                "pending": len(self._reminders),
+                "delivered": self.delivered,
+                "batches": self.batches,
+                "failures": self.failures,
+                "seconds_until_next": None if next_due is None else max(0.0, next_due - time.time()),
+            }
+
+    # 必须在持有self._condition时调用。
+    def _push(self, reminder: Reminder) -> None:
+        self._reminders[reminder.id] = reminder
+        heapq.heappush(self._heap, (reminder.due_at, reminder.id))
+        # 唤醒后台线程，使其按新的最早到期时间等待
+        self._condition.notify_all()
+
+    def _pop_due(self, deadline: float) -> List[Reminder]:
+        batch = []
+        while self._heap and self._heap[0][0] <= deadline and len(batch) < self.batch_size:
+            due_at, reminder_id = heapq.heappop(self._heap)
+            reminder = self._reminders.get(reminder_id)
+            if reminder is None or reminder.due_at != due_at:
+                continue
+            del self._reminders[reminder_id]
+            batch.append(reminder)
+        return batch
+
+    # 周期性提醒至少顺延一个间隔，并跳过已经过去的时间点（重启期间错过的多次只发送一次），其它提醒从存储中删除。
+    def _finish(self, batch: List[Reminder], now: float) -> None:
+        done = []
+        for reminder in batch:
+            if reminder.interval_seconds:
+                due_at = reminder.due_at + reminder.interval_seconds
+                while due_at <= now:
+                    due_at += reminder.interval_seconds
+                reminder = reminder._replace(due_at=due_at)
+                if reminder.id not in self._reminders:
+                    self.store.put(reminder)
+                    self._push(reminder)
+            else:
+                done.append(reminder.id)
+        if done:
+            self.store.delete(done)
+        self.delivered += len(batch)
+        self.batches += 1
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+            self.dispatch_due()
@@ -0,0 +1,147 @@
+"""Cheap classification of incoming messages into agent / chat paths."""
+import re
+import threading
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import Dict, List
+
+# 被视为闲聊的消息最多包含的单词数
+CHITCHAT_MAX_WORDS = 4
+
+# 闲聊中常见的短语（规范化后比较）。不包括"yes"、"ok"、"no"等肯定和否定的回答：路由器不知道上一条回复的内容，
+# 它们可能是在接受机器人提出的操作（例如"要看自拍吗？"），需要交给可以使用工具的代理处理。
+CHITCHAT_PHRASES = {
+    "lol",
+    "lmao",
+    "haha",
+    "hahaha",
+    "hehe",
+    "thanks",
+    "thank you",
+    "thx",
+    "ty",
+    "cool",
+    "nice",
+    "great",
+    "hi",
+    "hello",
+    "hey",
+    "good morning",
+    "good night",
+    "gn",
+    "bye",
+    "love you",
+    "i love you",
+    "miss you",
+    "i miss you",
+}
+
+# 可以跟在闲聊短语后面的称呼和语气词，例如"thanks babe"、"good night love"、"haha so cute"
+CHITCHAT_FILLER_WORDS = {
+    "babe",
+    "baby",
+    "dear",
+    "honey",
+    "love",
+    "darling",
+    "sweetie",
+    "there",
+    "you",
+    "u",
+    "too",
+    "so",
+    "much",
+    "very",
+    "a",
+    "lot",
+    "cute",
+    "again",
+}
+
+# 出现这些词时消息可能需要使用工具（自拍、图片、搜索、语音、提醒等）
+TOOL_KEYWORDS = re.compile(
+    r"\b(selfie|photo|pic|pics|picture|image|draw|show me|look like|wearing|where are you|"
+    r"what are you doing|search|google|look up|news|weather|today|tonight|latest|current|"
+    r"price|score|remind|reminder|voice|audio|say it|speak|sing)\b",
+    re.IGNORECASE,
+)
+
+
+class Route(str, Enum):
+    COMMAND = "command"
+    CHITCHAT = "chitchat"
+    TOOL = "tool"
+
+
+class MessageRouter(ABC):
+    """Decide which path handles an incoming message."""
+
+    @abstractmethod
+    def classify(self, text: str) -> Route:
+        raise NotImplementedError()
+
+
+# RuleBasedRouter只用简单的规则分类：以"/"开头的是命令；没有任何文字的消息（例如只有表情符号）、常见的闲聊短语，
+# 以及以闲聊短语开头、后面只有称呼和语气词的短消息都是闲聊；其余的消息（包括含义不明确的短消息）交给完整的ReAct代理处理。
+class RuleBasedRouter(MessageRouter):
+    """Keyword and length based router."""
+
+    def classify(self, text: str) -> Route:
+        text = (text or "").strip()
+        if text.startswith("/"):
+            return Route.COMMAND
+        if not re.search(r"\w", text):
+            return Route.CHITCHAT
+        if TOOL_KEYWORDS.search(text):
+            return Route.TOOL
+        normalized = re.sub(r"[^\w\s']", "", text).strip().casefold()
+        if normalized in CHITCHAT_PHRASES:
+            return Route.CHITCHAT
+        if "?" not in text and _is_greeting_or_ack(normalized.split()):
+            return Route.CHITCHAT
+        return Route.TOOL
+
+
+# 不超过CHITCHAT_MAX_WORDS个单词，以闲聊短语开头，其余的单词都是闲聊短语或称呼、语气词。
+def _is_greeting_or_ack(words: List[str]) -> bool:
+    if not words or len(words) > CHITCHAT_MAX_WORDS:
+        return False
+    for length in range(len(words), 0, -1):
+        if " ".join(words[:length]) in CHITCHAT_PHRASES:
+            return all(
+                word in CHITCHAT_FILLER_WORDS or word in CHITCHAT_PHRASES
+                for word in words[length:]
+            )
+    return False
+
+
+# 统计每条路径处理的轮数和耗时，并根据平均耗时估算闲聊路径节省的时间。
+class RouterStats:
+    """Turn counts and latency per route."""
+
+    def __init__(self):
+        self._turns: Dict[str, int] = {}
+        self._latency: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, route: Route, latency: float) -> None:
+        with self._lock:
+            self._turns[route.value] = self._turns.get(route.value, 0) + 1
+            self._latency[route.value] = self._latency.get(route.value, 0.0) + latency
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            average = {
+                route: self._latency[route] / turns for route, turns in self._turns.items()
+            }
+            chitchat_turns = self._turns.get(Route.CHITCHAT.value, 0)
+            latency_saved = None
+            if chitchat_turns and Route.TOOL.value in average:
+                latency_saved = chitchat_turns * (
+                    average[Route.TOOL.value] - average[Route.CHITCHAT.value]
+                )
+            return {
+                "turns": dict(self._turns),
+                "avg_latency": average,
+                "estimated_latency_saved": latency_saved,
+            }
@@ -0,0 +1,121 @@
+"""Pool of pre-generated images that is refilled in the background."""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+
+# SelfiePool预先生成一批图片，请求时立即返回其中一张。当池中的图片数量降到低水位线(low_watermark)时，
+# 后台线程会继续生成图片，直到达到高水位线(high_watermark)。每张图片最多被使用max_uses次。
+class SelfiePool:
+    """Serve pre-generated image block ids and refill the pool in the background."""
+
+    def __init__(
+        self,
+        generate: Callable[[], str],
+        low_watermark: int = 1,
+        high_watermark: int = 3,
+        max_uses: int = 1,
+    ):
+        self.generate = generate
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark)
+        self.max_uses = max(1, max_uses)
+        self.served = 0
+        self.empty = 0
+        self.generated = 0
+        self.failures = 0
+        self.last_refill_latency: Optional[float] = None
+        self.total_refill_latency = 0.0
+        # 池中的每个元素是[block_id, 已使用次数]
+        self._images = deque()
+        # 正在生成、尚未放入池中的图片数量，它们已经占用了池中的位置
+        self._generating = 0
+        self._refilling = False
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self) -> int:
+        return len(self._images)
+
+    # 从池中取出一张图片。如果图片还可以继续使用，则把它放回队尾。池为空时返回None，由调用方同步生成。
+    def get(self) -> Optional[str]:
+        """Return a pre-generated block id, or None if the pool is empty."""
+        with self._lock:
+            if self._images:
+                image = self._images.popleft()
+                image[1] += 1
+                if image[1] < self.max_uses:
+                    self._images.append(image)
+                self.served += 1
+                block_id = image[0]
+            else:
+                self.empty += 1
+                block_id = None
+        self.refill()
+        return block_id
+
+    # 修改水位线，例如实例的配置改变了池的大小。池中多出的图片保留到被使用完为止。
+    def resize(self, low_watermark: int, high_watermark: int) -> None:
+        with self._lock:
+            self.low_watermark = low_watermark
+            self.high_watermark = max(high_watermark, low_watermark)
+        self.refill()
+
+    # 如果池中的图片数量不高于低水位线并且没有正在进行的补充，则启动后台线程补充图片。
+    def refill(self) -> None:
+        """Start a background refill if the pool is at or below its low watermark."""
+        with self._lock:
+            if self._refilling or len(self._images) > self.low_watermark:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, name="selfie-pool-refill", daemon=True).start()
+
+    # 在锁内检查池的大小并预留位置后再生成，同时进行的补充不会使池中的图片超过高水位线。
+    def _refill(self) -> None:
+        try:
+            while True:
+                with self._lock:
+                    if len(self._images) + self._generating >= self.high_watermark:
+                        return
+                    self._generating += 1
+                started = time.perf_counter()
+                try:
+                    block_id = self.generate()
+                except Exception as e:
+                    with self._lock:
+                        self._generating -= 1
+                        self.failures += 1
+                    logging.warning(f"[selfie-pool] unable to generate image: {e}")
+                    return
+                latency = time.perf_counter() - started
+                with self._lock:
+                    self._generating -= 1
+                    self._images.append([block_id, 0])
+                    self.generated += 1
+                    self.last_refill_latency = latency
+                    self.total_refill_latency += latency
+                logging.info(
+                    f"[selfie-pool] generated image in {latency:.2f}s, depth {len(self._images)}"
+                )
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def stats(self) -> Dict[str, object]:
+        """Return pool depth and refill metrics."""
+        return {
+            "depth": self.depth,
+            "low_watermark": self.low_watermark,
+            "high_watermark": self.high_watermark,
+            "served": self.served,
+            "empty": self.empty,
+            "generated": self.generated,
+            "failures": self.failures,
+            "refilling": self._refilling,
+            "last_refill_latency": self.last_refill_latency,
+            "avg_refill_latency": self.total_refill_latency / self.generated
+            if self.generated
+            else None,
+        }
@@ -0,0 +1,157 @@
+"""Stream the agent's final answer into speech, one sentence at a time."""
+import contextvars
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import AgentFinish
+from langchain.tools import Tool
+
+from agent.utils import UUID_PATTERN
+
+# 句子结束的标点（包括中文标点）后面跟着空白，或者换行，视为句子边界。
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?。！？])\s+|\n+")
+
+
+# SentenceSplitter在不断追加的文本中按句子边界切分，返回已经完整的句子，未完成的部分保留在缓冲区中。
+class SentenceSplitter:
+    """Incrementally cut a stream of text into complete sentences."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Append `text` and return the sentences completed by it."""
+        self._buffer += text
+        parts = SENTENCE_BOUNDARY.split(self._buffer)
+        self._buffer = parts.pop()
+        return [part.strip() for part in parts if part.strip()]
+
+    def flush(self) -> List[str]:
+        """Return whatever is left in the buffer as a final sentence."""
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+# FinalAnswerStreamHandler是一个LangChain回调，它只关注最终回复（"AI:"之后的内容），并把完整的句子交给on_sentence。
+# 如果LLM不支持逐token输出（例如Steamship的OpenAIChat），则在代理结束时一次性切分最终回复。
+class FinalAnswerStreamHandler(BaseCallbackHandler):
+    """Feed the final answer of a conversational agent to `on_sentence`, sentence by sentence."""
+
+    def __init__(self, on_sentence: Callable[[str], Any], ai_prefix: str = "AI"):
+        self.on_sentence = on_sentence
+        self.answer_marker = f"{ai_prefix}:"
+        self.splitter = SentenceSplitter()
+        self.streamed = False
+        self.finished = False
+        self._llm_output = ""
+        self._answer_offset: Optional[int] = None
+
+    def on_llm_start(self, serialized, prompts, **kwargs: Any) -> None:
+        self._llm_output = ""
+        self._answer_offset = None
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._llm_output += token
+        if self._answer_offset is None:
+            marker = self._llm_output.find(self.answer_marker)
+            if marker == -1:
+                return
+            self._answer_offset = marker + len(self.answer_marker)
+            token = self._llm_output[self._answer_offset :]
+        self.streamed = True
+        self._emit(self.splitter.feed(token))
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> None:
+        self.finish(finish.return_values.get("output", ""))
+
+    # 处理最终回复：如果没有逐token输出过，则切分完整的回复，然后输出缓冲区中剩余的句子。多次调用时只处理第一次。
+    def finish(self, output: str) -> None:
+        """Emit the rest of the final answer; only the first call has an effect."""
+        if self.finished:
+            return
+        self.finished = True
+        if not self.streamed:
+            self._emit(self.splitter.feed(output))
+        self._emit(self.splitter.flush())
+
+    def _emit(self, sentences: List[str]) -> None:
+        for sentence in sentences:
+            # 语音中不朗读图片等块的UUID
+            spoken = UUID_PATTERN.sub("", sentence).strip(" \t,;:")
+            if re.search(r"\w", spoken):
+                self.on_sentence(spoken)
+
+
+# VoiceStreamer在有界线程池中并发地为句子生成语音，并严格按照句子的顺序，在每段语音就绪后立即通过send发送出去。
+class VoiceStreamer:
+    """Synthesize sentences concurrently and send the audio in order as soon as it is ready."""
+
+    def __init__(
+        self,
+        audio_tool: Tool,
+        send: Callable[[str], Any],
+        max_workers: int = 4,
+    ):
+        self.audio_tool = audio_tool
+        self.send = send
+        self.started_at = time.perf_counter()
+        self.first_audio_at: Optional[float] = None
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._futures: List[Future] = []
+        self._next_to_send = 0
+        self._lock = threading.Lock()
+        # 同一时间只有一个线程发送语音，保证发送的顺序；发送时不持有self._lock，不阻塞submit()
+        self._send_lock = threading.Lock()
+        # 回调可能在没有当前轮次上下文的线程中调用submit()，因此在创建时保存上下文，使语音生成的span归属于这一轮
+        self._context = contextvars.copy_context()
+
+    def submit(self, sentence: str) -> None:
+        """Start synthesizing `sentence`."""
+        with self._lock:
+            future = self._pool.submit(self._context.copy().run, self.audio_tool.run, sentence)
+            self._futures.append(future)
+        future.add_done_callback(lambda _: self._release())
+
+    # 按顺序发送所有已经完成的语音，遇到尚未完成的句子时停止。失败的句子会被跳过。
+    # send在这一轮的上下文中调用，使发送的span和本轮产生的块的记录归属于这一轮。
+    def _release(self) -> None:
+        with self._send_lock:
+            while True:
+                with self._lock:
+                    if self._next_to_send >= len(self._futures):
+                        return
+                    future = self._futures[self._next_to_send]
+                    if not future.done():
+                        return
+                    self._next_to_send += 1
+                try:
+                    audio_uuid = future.result()
+                    self._context.copy().run(self.send, audio_uuid)
+                except Exception as e:
+                    logging.warning(f"Unable to stream speech for sentence: {e}")
+                    continue
+                if self.first_audio_at is None:
+                    self.first_audio_at = time.perf_counter()
+
+    @property
+    def time_to_first_audio(self) -> Optional[float]:
+        """Seconds between the start of the turn and the first audio message sent."""
+        if self.first_audio_at is None:
+            return None
+        return self.first_audio_at - self.started_at
+
+    def close(self) -> None:
+        """Wait for every pending sentence to be synthesized and sent."""
+        self._pool.shutdown(wait=True)
+        self._release()
+
+    def __enter__(self) -> "VoiceStreamer":
+        return self
+
+    def __exit__(self, exit_type, exit_value, exit_traceback):
+        self.close()
@@ -16,11 +16,15 @@ sending in your own custom prompt.
 """
 import json
 import logging
+from typing import Optional
 
 from langchain.agents import Tool
 from steamship import Steamship
 from steamship.base.error import SteamshipError
 from steamship.data.plugin.plugin_instance import PluginInstance
+
+from agent.image_cache import ImageCache
+from agent.tracing import traced_tool
 from .image import GenerateImageTool
 
 NAME = "GenerateAlbumArt"
@@ -40,13 +44,14 @@ class GenerateAlbumArtTool(Tool):
     tool: GenerateImageTool
 
     # 构造函数__init__接收一个client参数，并通过调用父类的构造函数来初始化工具的名称、运行函数和描述。同时，将传入的client和GenerateImageTool(client)作为属性赋值给client和tool。
-    def __init__(self, client: Steamship):
+    # 可选的cache参数会传给内部的GenerateImageTool，用于复用已经生成过的专辑封面。
+    def __init__(self, client: Steamship, cache: Optional[ImageCache] = None):
         super().__init__(
             name=NAME,
             func=self.run,
             description=DESCRIPTION,
             client=client,
-            tool=GenerateImageTool(client),
+            tool=GenerateImageTool(client, cache=cache),
         )
 
     # 这个属性指示工具是否只接受单个输入。在这种情况下，返回True。
@@ -56,6 +61,7 @@ class GenerateAlbumArtTool(Tool):
         return True
 
     # 响应LLM提示词并生成图片。
+    @traced_tool
     def run(self, prompt: str, **kwargs) -> str:
         """Respond to LLM prompt."""
 
@@ -69,3 +75,10 @@ class GenerateAlbumArtTool(Tool):
         # Then we just return the results of the wrapped GenerateImageTool,
         # passing it the new prompt that we created.
         return self.tool.run(image_gen_prompt)
+
+    # run()的异步版本，使用内部GenerateImageTool工具的arun方法生成图像。
+    @traced_tool
+    async def arun(self, prompt: str, **kwargs) -> str:
+        """Respond to LLM prompt without blocking the event loop."""
+        image_gen_prompt = f"album art, 4k, high def, pop art, professional, high quality, award winning, grammy, platinum, {prompt}"
+        return await self.tool.arun(image_gen_prompt)
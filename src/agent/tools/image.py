@@ -1,12 +1,19 @@
 """Tool for generating images."""
 import json
 import logging
+from typing import List, Optional
 
 from langchain.agents import Tool
-from steamship import Steamship
+from steamship import Block, Steamship
 from steamship.base.error import SteamshipError
 from steamship.data.plugin.plugin_instance import PluginInstance
 
+from agent.aio import run_blocking, wait_for_task
+from agent.blocks import registers_block
+from agent.image_cache import ImageCache
+from agent.plugins import get_plugin_instance
+from agent.tracing import span, traced_tool
+
 NAME = "GenerateImage"
 
 DESCRIPTION = """
@@ -16,6 +23,7 @@ Output: the UUID of a generated image
 """
 
 PLUGIN_HANDLE = "stable-diffusion"
+PLUGIN_CONFIG = {"n": 1, "size": "768x768"}
 
 
 # GenerateImageTool类继承自Tool类。它包含了一个client属性，表示Steamship客户端。
@@ -23,11 +31,17 @@ class GenerateImageTool(Tool):
     """Tool used to generate images from a text-prompt."""
 
     client: Steamship
+    cache: Optional[ImageCache] = None
 
     # 构造函数__init__接收一个client参数，并通过调用父类的构造函数来初始化工具的名称、运行函数和描述。同时，将传入的client作为属性赋值给client。
-    def __init__(self, client: Steamship):
+    # 可选的cache参数用于复用相同提示词已经生成过的图片。
+    def __init__(self, client: Steamship, cache: Optional[ImageCache] = None):
         super().__init__(
-            name=NAME, func=self.run, description=DESCRIPTION, client=client
+            name=NAME,
+            func=self.run,
+            description=DESCRIPTION,
+            client=client,
+            cache=cache,
         )
 
     # 是否只接受单个输入
@@ -36,30 +50,63 @@ class GenerateImageTool(Tool):
         """Whether the tool only accepts a single input."""
         return True
 
-    # 响应LLM提示并生成图像
+    # 响应LLM提示并生成图像。如果配置了缓存，则优先返回相同提示词和配置已经生成过的图像。
+    @traced_tool
+    @registers_block
     def run(self, prompt: str, **kwargs) -> str:
         """Respond to LLM prompt."""
+        logging.info(f"[{self.name}] {prompt}")
+        # 检查输入提示的类型，如果不是字符串，则将其转换为JSON格式的字符串。
+        if not isinstance(prompt, str):
+            prompt = json.dumps(prompt)
 
-        # 使用client.use_plugin方法创建了一个与DALL-E插件的实例image_generator。通过指定插件句柄PLUGIN_HANDLE和配置参数config来初始化插件实例。在这里，配置参数设置生成单个图像，尺寸为768x768。
-        # Use the Steamship DALL-E plugin.
-        image_generator = self.client.use_plugin(
-            plugin_handle=PLUGIN_HANDLE, config={"n": 1, "size": "768x768"}
+        if self.cache is None:
+            return self._generate(prompt)
+        return self.cache.get_or_generate(
+            prompt, lambda: self._generate(prompt), config=PLUGIN_CONFIG
         )
 
+    # run()的异步版本：等待图像生成任务时不占用线程，一个进程可以同时等待多个任务。
+    @traced_tool
+    @registers_block
+    async def arun(self, prompt: str, **kwargs) -> str:
+        """Respond to LLM prompt without blocking the event loop."""
         logging.info(f"[{self.name}] {prompt}")
-        # 检查输入提示的类型，如果不是字符串，则将其转换为JSON格式的字符串。
         if not isinstance(prompt, str):
             prompt = json.dumps(prompt)
 
+        if self.cache is None:
+            return await self._agenerate(prompt)
+        return await self.cache.aget_or_generate(
+            prompt, lambda: self._agenerate(prompt), config=PLUGIN_CONFIG
+        )
+
+    def _generate(self, prompt: str) -> str:
+        # 从插件实例注册表中获取DALL-E插件的实例image_generator。通过指定插件句柄PLUGIN_HANDLE和配置参数PLUGIN_CONFIG来获取插件实例。在这里，配置参数设置生成单个图像，尺寸为768x768。
+        # Use the Steamship DALL-E plugin.
+        image_generator = get_plugin_instance(self.client, PLUGIN_HANDLE, PLUGIN_CONFIG)
+
         # 调用image_generator.generate方法执行图像生成任务，传入输入提示作为文本参数，并设置append_output_to_file=True以将生成的图像结果附加到文件中。最后，使用task.wait()等待任务完成。
         task = image_generator.generate(text=prompt, append_output_to_file=True)
-        task.wait()
-        # 获取任务的输出结果blocks，这是生成的图像数据块的列表。
-        blocks = task.output.blocks
+        with span("task_wait"):
+            task.wait()
+        return self._first_block_id(task.output.blocks)
+
+    async def _agenerate(self, prompt: str) -> str:
+        image_generator = await run_blocking(
+            get_plugin_instance, self.client, PLUGIN_HANDLE, PLUGIN_CONFIG
+        )
+        task = await run_blocking(
+            image_generator.generate, text=prompt, append_output_to_file=True
+        )
+        output = await wait_for_task(task)
+        return await run_blocking(self._first_block_id, output.blocks)
+
+    def _first_block_id(self, blocks: List[Block]) -> str:
         # 记录日志以显示返回的数据块数量和图像大小。
         logging.info(f"[{self.name}] got back {len(blocks)} blocks")
         # 如果存在至少一个数据块，则返回第一个数据块的UUID作为生成的图像的结果。否则，抛出SteamshipError异常表示工具无法生成图像。
         if len(blocks) > 0:
-            logging.info(f"[{self.name}] image size: {len(blocks[0].raw())}")
+            logging.info(f"[{self.name}] image block {blocks[0].id} ({blocks[0].mime_type})")
             return blocks[0].id
         raise SteamshipError(f"[{self.name}] Tool unable to generate image!")
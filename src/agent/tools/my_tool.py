@@ -6,6 +6,8 @@ from langchain.agents import Tool
 from steamship import Steamship
 from steamship_langchain.llms.openai import OpenAI
 
+from agent.tracing import traced_tool
+
 NAME = "MyTool"
 
 DESCRIPTION = """
@@ -44,6 +46,7 @@ class MyTool(Tool):
         """Whether the tool only accepts a single input."""
         return True
 
+    @traced_tool
     def run(self, prompt: str, **kwargs) -> str:
         """Respond to LLM prompts."""
         # 通过调用_get_chain方法获取LLMChain实例chain。
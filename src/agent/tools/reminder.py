@@ -1,11 +1,17 @@
 """Tool for scheduling reminders."""
+import json
 import logging
-from typing import Callable
+import time
+from typing import Callable, Optional
 
 from langchain.agents import Tool
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from pytimeparse.timeparse import timeparse
 
+from agent.aio import run_blocking
+from agent.reminders import Reminder, ReminderScheduler
+from agent.tracing import traced_tool
+
 
 # ToolRequest继承自BaseModel，用于定义工具请求的基本模型结构。它提供了一个类方法get_json，该方法返回一个字典，包含每个属性的描述信息。
 class ToolRequest(BaseModel):
@@ -16,28 +22,33 @@ class ToolRequest(BaseModel):
         }
 
 
-# ReminderRequest继承自ToolRequest，并定义了after和reminder两个属性，用于表示提醒的时间差和提醒的消息内容。这两个属性都使用Field进行描述。
+# ReminderRequest继承自ToolRequest，用于表示提醒的操作（添加、列出或取消）、时间差、提醒的消息内容、重复的间隔和要取消的提醒id。这些属性都使用Field进行描述。
 class ReminderRequest(ToolRequest):
     """Provide structure for tool invocation for the LLM."""
 
-    after: str = Field(description="time delta")
-    reminder: str = Field(description="reminder message to send to the user")
+    action: str = Field(default="add", description="one of add, list or cancel")
+    after: str = Field(default="", description="time delta (add)")
+    reminder: str = Field(default="", description="reminder message to send to the user (add)")
+    every: str = Field(default="", description="optional time delta to repeat the reminder (add)")
+    reminder_id: str = Field(default="", description="id of the reminder to cancel (cancel)")
 
 
 # 几个示例提醒请求的实例。
 EXAMPLES = [
     ReminderRequest(after="15s", reminder="turn off the lights"),
-    ReminderRequest(after="60m", reminder="file your taxes"),
     ReminderRequest(after="2h5m", reminder="send a message to your wife about dinner"),
+    ReminderRequest(after="8h", reminder="drink some water", every="24h"),
+    ReminderRequest(action="list"),
+    ReminderRequest(action="cancel", reminder_id="1f3a9c2e"),
 ]
 
 # 工具的名称被设置为"REMIND"，描述了工具的用途和输入输出的说明。还定义了示例的字符串表示，其中包含了示例请求的JSON格式。
 NAME: str = "REMIND"
 
-EXAMPLES_STR = "\n".join([example.json() for example in EXAMPLES])
-DESCRIPTION: str = f"""Used to schedule reminders for the user at a future point in time. Input: time time delata and the reminder. Please use the following JSON format as Input:  
+EXAMPLES_STR = "\n".join([example.json(exclude_defaults=True) for example in EXAMPLES])
+DESCRIPTION: str = f"""Used to schedule, list or cancel reminders for the user at a future point in time, optionally repeating. Please use the following JSON format as Input:
 {ReminderRequest.get_json()}.
-            
+
 Example(s):
 {EXAMPLES_STR}""".replace(
     "{", "{{"
@@ -46,11 +57,18 @@ Example(s):
 )
 
 
-# RemindMe继承自Tool类，并定义了invoke_later和chat_id两个属性。在初始化方法中，调用父类的构造方法来设置工具的名称、功能描述和回调函数。
+def _describe(reminder: Reminder) -> str:
+    seconds = max(0, int(reminder.due_at - time.time()))
+    repeat = f", every {int(reminder.interval_seconds)}s" if reminder.interval_seconds else ""
+    return f"[{reminder.id}] in {seconds}s{repeat}: {reminder.message}"
+
+
+# RemindMe继承自Tool类，并定义了get_scheduler和chat_id两个属性。提醒保存在进程级的ReminderScheduler中，
+# 由它在到期时批量发送，而不是为每条提醒单独创建一个延迟执行的任务。
 class RemindMe(Tool):
-    """Tool used to schedule reminders via the Steamship Task system."""
+    """Tool used to schedule, list and cancel reminders of one chat."""
 
-    invoke_later: Callable
+    get_scheduler: Callable[[], ReminderScheduler]
     chat_id: str
 
     @property
@@ -58,46 +76,70 @@ class RemindMe(Tool):
         """Whether the tool only accepts a single input."""
         return True
 
-    def __init__(self, invoke_later: Callable, chat_id: str):
+    def __init__(self, get_scheduler: Callable[[], ReminderScheduler], chat_id: str):
         super().__init__(
-            name="REMIND",
+            name=NAME,
             func=self.run,
             description=DESCRIPTION,
-            invoke_later=invoke_later,
+            get_scheduler=get_scheduler,
             chat_id=chat_id,
         )
 
     # 先根据输入的prompt判断其类型，如果是字典类型，则使用ReminderRequest.parse_obj方法解析为ReminderRequest对象；
     # 如果是字符串类型，则先替换单引号为双引号，然后使用ReminderRequest.parse_raw方法解析为ReminderRequest对象。
-    # 如果无法处理输入，则返回错误消息
-    # 然后，调用self._schedule方法来安排提醒事项，并返回固定的输出消息。
+    # 如果无法处理输入，则返回错误消息，由LLM修正输入后重试。
+    @traced_tool
     def run(self, prompt, **kwargs) -> str:
         """Respond to LLM prompts."""
         logging.info(f"[remind-me] prompt: {prompt}")
-        if isinstance(prompt, dict):
-            req = ReminderRequest.parse_obj(prompt)
-        elif isinstance(prompt, str):
-            prompt = prompt.replace("'", '"')
-            req = ReminderRequest.parse_raw(prompt)
-        else:
-            return "Tool failure. Could not handle request. Sorry."
-
-        self._schedule(req)
-        return "This is the output"
-
-    # 这个方法用于根据提醒请求安排提醒事项。首先，将时间差字符串解析为秒数，并打印日志信息，记录提醒的延迟时间和提醒消息。
-    # 然后，使用self.invoke_later回调函数来安排将来的提醒事项。该函数接受延迟时间（毫秒）、提醒消息和聊天ID作为参数。
-    # 最后，再次打印日志信息，记录安排的延迟时间和提醒消息，并返回固定的成功消息。
+        try:
+            if isinstance(prompt, dict):
+                req = ReminderRequest.parse_obj(prompt)
+            elif isinstance(prompt, str):
+                req = ReminderRequest.parse_raw(prompt.replace("'", '"'))
+            else:
+                return "Tool failure. Could not handle request. Sorry."
+        except (ValidationError, json.JSONDecodeError) as e:
+            return f"Could not read the reminder request, please use the JSON format: {e}"
+
+        action = req.action.strip().lower()
+        if action == "list":
+            return self._list()
+        if action == "cancel":
+            return self._cancel(req)
+        return self._schedule(req)
+
+    # run()的异步版本。提醒保存在存储中（可能是KeyValueStore或SQLite），在共享线程池中执行。
+    async def arun(self, prompt, **kwargs) -> str:
+        """Respond to LLM prompts without blocking the event loop."""
+        return await run_blocking(self.run, prompt)
+
+    # 这个方法用于根据提醒请求安排提醒事项。首先，将时间差字符串解析为秒数，然后交给ReminderScheduler保存并在到期时发送。
     def _schedule(self, req: ReminderRequest) -> str:
-        after_seconds = timeparse(req.after)
-        logging.info(f"scheduling after {after_seconds}s, message {req.reminder}")
-
-        self.invoke_later(
-            delay_ms=after_seconds * 1_000,
-            message=req.reminder,
-            chat_id=self.chat_id,
-        )
-
-        logging.info(f"scheduling {after_seconds * 1_000}, message {req.reminder}")
-
-        return "Your reminder has been scheduled."
+        after_seconds = timeparse(req.after) if req.after else None
+        if after_seconds is None or not req.reminder:
+            return "A reminder needs a time delta such as '15m' in 'after' and a message in 'reminder'."
+        interval_seconds: Optional[float] = None
+        if req.every:
+            interval_seconds = timeparse(req.every)
+            if not interval_seconds:
+                return f"Could not understand the repeat interval '{req.every}'."
+        try:
+            reminder = self.get_scheduler().schedule(
+                self.chat_id, req.reminder, after_seconds, interval_seconds
+            )
+        except ValueError as e:
+            return f"Could not schedule the reminder: {e}"
+        logging.info(f"scheduled reminder {reminder.id} after {after_seconds}s, message {req.reminder}")
+        return f"Your reminder has been scheduled: {_describe(reminder)}"
+
+    def _list(self) -> str:
+        reminders = self.get_scheduler().list(self.chat_id)
+        if not reminders:
+            return "There are no pending reminders."
+        return "Pending reminders:\n" + "\n".join(_describe(reminder) for reminder in reminders)
+
+    def _cancel(self, req: ReminderRequest) -> str:
+        if self.get_scheduler().cancel(self.chat_id, req.reminder_id.strip()):
+            return f"Reminder {req.reminder_id} has been cancelled."
+        return f"There is no pending reminder with id '{req.reminder_id}'."
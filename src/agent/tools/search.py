@@ -1,25 +1,68 @@
 """Tool for searching the web."""
+import re
+import threading
+import time
 
 from langchain.agents import Tool
 from steamship import Steamship
 from steamship_langchain.tools import SteamshipSERP
 
+from agent.aio import run_blocking
+from agent.cache import LRUCache, SingleFlight
+from agent.tracing import traced_tool
+
 NAME = "Search"
 
 DESCRIPTION = """
 Useful for when you need to answer questions about current events
 """
 
+# 搜索结果缓存的条目数量上限，以及默认的有效期（秒）
+SEARCH_CACHE_SIZE = 512
+SEARCH_CACHE_TTL_SECONDS = 5 * 60
+
+NO_RESULT = "No search result found"
+
+# 规范化查询 -> (搜索结果, 过期时间)，在所有聊天之间共享
+SEARCH_CACHE = LRUCache(maxsize=SEARCH_CACHE_SIZE)
+_SEARCHING = SingleFlight()
+# 每个workspace复用一个SteamshipSERP对象
+_SERP_CLIENTS = {}
+_SERP_CLIENTS_LOCK = threading.Lock()
+
+
+# 规范化查询：合并连续空白、忽略大小写并去掉首尾的标点，使几乎相同的查询命中同一个缓存条目。
+def normalize_query(query: str) -> str:
+    query = re.sub(r"\s+", " ", query).strip().casefold()
+    return query.strip(" .,;:!?\"'")
+
+
+# 返回给定client所在workspace的SteamshipSERP对象，只创建一次。
+def get_serp(client: Steamship) -> SteamshipSERP:
+    key = client.config.workspace_id or client.config.workspace_handle
+    with _SERP_CLIENTS_LOCK:
+        serp = _SERP_CLIENTS.get(key)
+        if serp is None:
+            serp = SteamshipSERP(client=client)
+            _SERP_CLIENTS[key] = serp
+        return serp
+
 
 class SearchTool(Tool):
     """Tool used to search for information using SERP API."""
 
     # 用于与Steamship服务进行通信的客户端对象
     client: Steamship
+    # 搜索结果的缓存有效期（秒），为0时不使用缓存
+    cache_ttl: float = SEARCH_CACHE_TTL_SECONDS
 
-    def __init__(self, client: Steamship):
+    def __init__(self, client: Steamship, cache_ttl: float = SEARCH_CACHE_TTL_SECONDS):
         super().__init__(
-            name=NAME, func=self.run, description=DESCRIPTION, client=client
+            name=NAME,
+            func=self.run,
+            description=DESCRIPTION,
+            client=client,
+            cache_ttl=cache_ttl,
         )
 
     @property
@@ -27,11 +70,35 @@ class SearchTool(Tool):
         """Whether the tool only accepts a single input."""
         return True
 
-    # 实现了父类Tool中的run方法，用于处理LLM提示。在这个方法中，首先创建了一个SteamshipSERP对象，传入了客户端对象。然后调用search方法，将提示作为参数进行搜索，并返回搜索结果。
+    # 实现了父类Tool中的run方法，用于处理LLM提示。在这个方法中，首先在缓存中查找规范化后的查询，未命中或已过期时，
+    # 使用复用的SteamshipSERP对象进行搜索并缓存结果。并发的相同查询只会执行一次搜索。
+    @traced_tool
     def run(self, prompt: str, **kwargs) -> str:
         """Respond to LLM prompts."""
-        search = SteamshipSERP(client=self.client)
-        return search.search(prompt)
+        if self.cache_ttl <= 0:
+            return get_serp(self.client).search(prompt)
+
+        key = normalize_query(prompt)
+        cached = SEARCH_CACHE.get(key)
+        if cached is not None:
+            answer, expires_at = cached
+            if time.monotonic() < expires_at:
+                return answer
+            SEARCH_CACHE.pop(key)
+
+        def search() -> str:
+            answer = get_serp(self.client).search(prompt)
+            # SteamshipSERP在出错时返回固定的提示文本，这种结果不缓存
+            if answer and answer != NO_RESULT:
+                SEARCH_CACHE.put(key, (answer, time.monotonic() + self.cache_ttl))
+            return answer
+
+        return _SEARCHING.do(key, search)
+
+    # run()的异步版本。SteamshipSERP只提供同步接口，因此在共享线程池中执行搜索。
+    async def arun(self, prompt: str, **kwargs) -> str:
+        """Respond to LLM prompts without blocking the event loop."""
+        return await run_blocking(self.run, prompt)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,18 @@
 """Tool for generating images."""
 import logging
+import threading
+from typing import List
 
 from langchain.agents import Tool
-from steamship import Steamship
+from steamship import Block, Steamship
 from steamship.base.error import SteamshipError
+from steamship.base.tasks import Task
+
+from agent.aio import run_blocking, wait_for_task
+from agent.blocks import registers_block
+from agent.plugins import get_plugin_instance
+from agent.selfie_pool import SelfiePool
+from agent.tracing import span, traced_tool
 
 NAME = "GenerateSelfie"
 
@@ -14,6 +23,13 @@ Output: the UUID of the generated selfie showing what you're doing or where you
 """
 
 PLUGIN_HANDLE = "stable-diffusion"
+PLUGIN_CONFIG = {"n": 1, "size": "768x768"}
+
+# 自拍池中每张图片最多被使用的次数
+SELFIE_MAX_USES = 1
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
 
 NEGATIVE_PROMPT = "ugly, tiling, poorly drawn hands, poorly drawn feet, poorly drawn face, out of frame, extra limbs, disfigured, deformed, body out of frame, bad anatomy, watermark, signature, cut off, low contrast, underexposed, overexposed, bad art, beginner, amateur, distorted face, blurry, draft, grainy"
 
@@ -22,10 +38,15 @@ class SelfieTool(Tool):
     """Tool used to generate images from a text-prompt."""
 
     client: Steamship
+    pool_size: int = 0
 
-    def __init__(self, client: Steamship):
+    def __init__(self, client: Steamship, pool_size: int = 0):
         super().__init__(
-            name=NAME, func=self.run, description=DESCRIPTION, client=client
+            name=NAME,
+            func=self.run,
+            description=DESCRIPTION,
+            client=client,
+            pool_size=pool_size,
         )
 
     @property
@@ -34,40 +55,97 @@ class SelfieTool(Tool):
         return True
 
     # 实现了父类Tool中的run方法，用于处理LLM提示。
+    # 由于自拍的提示词是固定的，生成结果与输入无关，因此启用自拍池(pool_size > 0)时优先返回预先生成的图片，池为空时才同步生成。
+    @traced_tool
+    @registers_block
     def run(self, prompt: str, **kwargs) -> str:
         """Generate an image using the input prompt."""
-        # 首先创建了一个stable-diffusion插件的实例image_generator，使用客户端对象和配置参数进行初始化。
-        image_generator = self.client.use_plugin(
-            plugin_handle=PLUGIN_HANDLE, config={"n": 1, "size": "768x768"}
-        )
+        if self.pool_size > 0:
+            block_id = get_selfie_pool(self.client, self.pool_size).get()
+            if block_id is not None:
+                logging.info(f"[{self.name}] served selfie {block_id} from pool")
+                return block_id
+        return generate_selfie(self.client)
 
-        # logging.info(f"[{self.name}] {prompt}")
-        # if not isinstance(prompt, str):
-        #     prompt = json.dumps(prompt)
+    # run()的异步版本：自拍池为空时，等待生成任务时不占用线程。
+    @traced_tool
+    @registers_block
+    async def arun(self, prompt: str, **kwargs) -> str:
+        """Generate an image using the input prompt without blocking the event loop."""
+        if self.pool_size > 0:
+            block_id = get_selfie_pool(self.client, self.pool_size).get()
+            if block_id is not None:
+                logging.info(f"[{self.name}] served selfie {block_id} from pool")
+                return block_id
+        return await agenerate_selfie(self.client)
 
-        # 设置了一个prompt字符串来描述所需的自拍照片的特征，包括未来主义、人类样貌的机器人、具体的服装、超现实主义、高度细节、清晰焦点、科幻、惊人美丽、反乌托邦、电影般的光照、黑暗、4K分辨率、戏剧性光照等。
-        prompt = (
-            "A selfie of a futuristic, human-like robot looking seductive into the lens of her phone"
-            "detailed clothing, hyperrealistic, fantasy, surrealist, highly detailed, sharp focus, sci-fi, "
-            "stunningly beautiful, dystopian, cinematic lighting, dark, 4K, dramatic lighting"
-        )
-        # 调用image_generator的generate方法，传入prompt作为文本输入，并设置append_output_to_file参数为True，以便将输出附加到文件中。
-        # 传入了options参数，其中包含了negative_prompt，用于描述不希望在生成的图片中出现的特征，如丑陋、绘画不好的手、绘画不好的脚、绘画不好的脸、超出画面范围、
-        # 多余的肢体、畸形、变形、身体超出画面、不好的解剖、水印、签名、被截断、对比度低、曝光过度、不好的艺术效果、初学者、业余、面部扭曲、模糊、草稿、颗粒状等。
-        task = image_generator.generate(
-            text=prompt,
-            append_output_to_file=True,
-            options={"negative_prompt": NEGATIVE_PROMPT},
-        )
-        # 等待任务完成
+
+# 返回给定client所在workspace的自拍池，第一次调用时创建并开始在后台填充。pool_size改变时按新的大小调整水位线。
+def get_selfie_pool(client: Steamship, pool_size: int) -> SelfiePool:
+    """Return the process-wide selfie pool of the client's workspace."""
+    key = client.config.workspace_id or client.config.workspace_handle
+    low_watermark = max(0, pool_size // 2)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = SelfiePool(
+                generate=lambda: generate_selfie(client),
+                low_watermark=low_watermark,
+                high_watermark=pool_size,
+                max_uses=SELFIE_MAX_USES,
+            )
+            _POOLS[key] = pool
+            pool.refill()
+        elif pool.high_watermark != pool_size:
+            pool.resize(low_watermark, pool_size)
+        return pool
+
+
+# 使用固定的提示词启动自拍生成任务。
+def _start_selfie_task(client: Steamship) -> Task:
+    # 首先从插件实例注册表中获取stable-diffusion插件的实例image_generator。
+    image_generator = get_plugin_instance(client, PLUGIN_HANDLE, PLUGIN_CONFIG)
+
+    # 设置了一个prompt字符串来描述所需的自拍照片的特征，包括未来主义、人类样貌的机器人、具体的服装、超现实主义、高度细节、清晰焦点、科幻、惊人美丽、反乌托邦、电影般的光照、黑暗、4K分辨率、戏剧性光照等。
+    prompt = (
+        "A selfie of a futuristic, human-like robot looking seductive into the lens of her phone"
+        "detailed clothing, hyperrealistic, fantasy, surrealist, highly detailed, sharp focus, sci-fi, "
+        "stunningly beautiful, dystopian, cinematic lighting, dark, 4K, dramatic lighting"
+    )
+    # 调用image_generator的generate方法，传入prompt作为文本输入，并设置append_output_to_file参数为True，以便将输出附加到文件中。
+    # 传入了options参数，其中包含了negative_prompt，用于描述不希望在生成的图片中出现的特征，如丑陋、绘画不好的手、绘画不好的脚、绘画不好的脸、超出画面范围、
+    # 多余的肢体、畸形、变形、身体超出画面、不好的解剖、水印、签名、被截断、对比度低、曝光过度、不好的艺术效果、初学者、业余、面部扭曲、模糊、草稿、颗粒状等。
+    return image_generator.generate(
+        text=prompt,
+        append_output_to_file=True,
+        options={"negative_prompt": NEGATIVE_PROMPT},
+    )
+
+
+# 使用固定的提示词生成一张自拍，返回生成的图片块的UUID。
+def generate_selfie(client: Steamship) -> str:
+    """Generate a selfie with stable-diffusion and return its block id."""
+    task = _start_selfie_task(client)
+    # 等待任务完成
+    with span("task_wait"):
         task.wait()
-        # 获取输出的blocks列表。
-        blocks = task.output.blocks
-        logging.info(f"[{self.name}] got back {len(blocks)} blocks")
-        # 如果blocks列表不为空，则返回第一个块的UUID作为生成的自拍照片的标识符。
-        if len(blocks) > 0:
-            logging.info(f"[{self.name}] image size: {len(blocks[0].raw())}")
-            return blocks[0].id
-
-        # 如果无法生成图片，则抛出SteamshipError异常。
-        raise SteamshipError(f"[{self.name}] Tool unable to generate image!")
+    return _first_block_id(task.output.blocks)
+
+
+# generate_selfie()的异步版本，等待生成任务时不占用线程。
+async def agenerate_selfie(client: Steamship) -> str:
+    """Generate a selfie with stable-diffusion without blocking the event loop."""
+    task = await run_blocking(_start_selfie_task, client)
+    output = await wait_for_task(task)
+    return await run_blocking(_first_block_id, output.blocks)
+
+
+def _first_block_id(blocks: List[Block]) -> str:
+    logging.info(f"[{NAME}] got back {len(blocks)} blocks")
+    # 如果blocks列表不为空，则返回第一个块的UUID作为生成的自拍照片的标识符。
+    if len(blocks) > 0:
+        logging.info(f"[{NAME}] image block {blocks[0].id} ({blocks[0].mime_type})")
+        return blocks[0].id
+
+    # 如果无法生成图片，则抛出SteamshipError异常。
+    raise SteamshipError(f"[{NAME}] Tool unable to generate image!")
@@ -1,13 +1,20 @@
 """Tool for generating speech."""
 import json
 import logging
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from langchain.agents import Tool
 from langchain.tools import BaseTool
-from steamship import Steamship
+from steamship import Block, Steamship
 from steamship.base.error import SteamshipError
 
+from agent.aio import run_blocking, wait_for_task
+from agent.block_cache import remember_block_content
+from agent.blocks import registers_block
+from agent.plugins import get_plugin_instance
+from agent.tracing import span, traced_tool
+from agent.tts_cache import TTSCache
+
 NAME = "GenerateSpokenAudio"
 
 DESCRIPTION = (
@@ -27,6 +34,7 @@ class GenerateSpeechTool(Tool):
         str
     ] = "21m00Tcm4TlvDq8ikWAM"  # Voice ID to use. Defaults to Rachel
     elevenlabs_api_key: Optional[str] = ""  # API key to use for Elevenlabs.
+    cache: Optional[TTSCache] = None  # Optional cache of previously generated speech.
     name: Optional[str] = NAME
     description: Optional[str] = DESCRIPTION
 
@@ -36,6 +44,7 @@ class GenerateSpeechTool(Tool):
         client: Steamship,
         voice_id: Optional[str] = "21m00Tcm4TlvDq8ikWAM",
         elevenlabs_api_key: Optional[str] = "",
+        cache: Optional[TTSCache] = None,
     ):
         super().__init__(
             name=NAME,
@@ -44,6 +53,7 @@ class GenerateSpeechTool(Tool):
             client=client,
             voice_id=voice_id,
             elevenlabs_api_key=elevenlabs_api_key,
+            cache=cache,
         )
 
     @property
@@ -51,32 +61,75 @@ class GenerateSpeechTool(Tool):
         """Whether the tool only accepts a single input."""
         return True
 
-    # 实现了父类Tool中的run方法，用于处理LLM提示。
+    # elevenlabs插件的配置参数
+    @property
+    def plugin_config(self) -> dict:
+        return {
+            "voice_id": self.voice_id,
+            "elevenlabs_api_key": self.elevenlabs_api_key,
+        }
+
+    # 实现了父类Tool中的run方法，用于处理LLM提示。如果配置了缓存，相同语音和文本的音频只会生成一次。
+    @traced_tool
+    @registers_block
     def run(self, prompt: str, **kwargs) -> str:
         """Respond to LLM prompt."""
         logging.info(f"[{self.name}] {prompt}")
-        # 首先创建了一个elevenlabs插件的实例voice_generator，使用客户端对象和配置参数进行初始化。
-        voice_generator = self.client.use_plugin(
-            plugin_handle=PLUGIN_HANDLE,
-            config={
-                "voice_id": self.voice_id,
-                "elevenlabs_api_key": self.elevenlabs_api_key,
-            },
+        # 将输入的提示转换为字符串形式
+        if not isinstance(prompt, str):
+            prompt = json.dumps(prompt)
+
+        if self.cache is None:
+            return self._generate(prompt)[0]
+        return self.cache.get_or_generate(
+            self.voice_id, prompt, lambda: self._generate(prompt)
         )
 
-        # 将输入的提示转换为字符串形式
+    # run()的异步版本：等待语音生成任务时不占用线程。
+    @traced_tool
+    @registers_block
+    async def arun(self, prompt: str, **kwargs) -> str:
+        """Respond to LLM prompt without blocking the event loop."""
+        logging.info(f"[{self.name}] {prompt}")
         if not isinstance(prompt, str):
             prompt = json.dumps(prompt)
 
+        if self.cache is None:
+            return (await self._agenerate(prompt))[0]
+        return await self.cache.aget_or_generate(
+            self.voice_id, prompt, lambda: self._agenerate(prompt)
+        )
+
+    # 生成音频，返回生成的音频块的UUID以及音频内容。
+    def _generate(self, prompt: str) -> Tuple[str, bytes]:
+        # 首先从插件实例注册表中获取elevenlabs插件的实例voice_generator。
+        voice_generator = get_plugin_instance(self.client, PLUGIN_HANDLE, self.plugin_config)
+
         # 调用voice_generator的generate方法，传入转换后的提示作为文本输入，并设置append_output_to_file参数为True，以便将输出附加到文件中。
         task = voice_generator.generate(text=prompt, append_output_to_file=True)
-        task.wait()
+        with span("task_wait"):
+            task.wait()
+        return self._first_block(task.output.blocks)
+
+    async def _agenerate(self, prompt: str) -> Tuple[str, bytes]:
+        voice_generator = await run_blocking(
+            get_plugin_instance, self.client, PLUGIN_HANDLE, self.plugin_config
+        )
+        task = await run_blocking(
+            voice_generator.generate, text=prompt, append_output_to_file=True
+        )
+        output = await wait_for_task(task)
+        return await run_blocking(self._first_block, output.blocks)
+
+    def _first_block(self, blocks: List[Block]) -> Tuple[str, bytes]:
         # 并获取输出的blocks列表。
-        blocks = task.output.blocks
         logging.info(f"[{self.name}] got back {len(blocks)} blocks")
         # 如果blocks列表不为空，则返回第一个块的UUID作为生成的音频的标识符。
+        # 音频只下载这一次：写入语音缓存，同时留给本轮的发布使用。
         if len(blocks) > 0:
-            logging.info(f"[{self.name}] audio size: {len(blocks[0].raw())}")
-            return blocks[0].id
+            audio = blocks[0].raw()
+            logging.info(f"[{self.name}] audio size: {len(audio)}")
+            remember_block_content(blocks[0].id, audio)
+            return blocks[0].id, audio
         # 如果无法生成音频，则抛出SteamshipError异常。
         raise SteamshipError(f"[{self.name}] Tool unable to generate audio!")
@@ -0,0 +1,231 @@
+"""Per-turn timing spans, written as JSON logs and aggregated into Prometheus-style histograms."""
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+# 每个span结束时写一行JSON日志的logger，可以单独配置其级别和输出
+TRACE_LOGGER = logging.getLogger("girlfriendgpt.trace")
+# 直方图的桶上限（秒），覆盖从毫秒级的缓存命中到分钟级的图片生成
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 导出的指标名称的前缀
+METRIC_PREFIX = "girlfriendgpt"
+
+
+class TurnContext(NamedTuple):
+    turn_id: str
+    chat_id: str
+
+
+_TURN: ContextVar[Optional[TurnContext]] = ContextVar("turn", default=None)
+
+
+# 在上下文中标记一轮对话。期间记录的所有span（包括run_blocking在线程池中执行的调用）都带有同一个turn_id和chat_id。
+@contextlib.contextmanager
+def turn(chat_id: str, turn_id: Optional[str] = None):
+    """Correlate every span recorded in this context with one turn of `chat_id`."""
+    context = TurnContext(turn_id or uuid.uuid4().hex[:16], str(chat_id))
+    token = _TURN.set(context)
+    try:
+        yield context
+    finally:
+        _TURN.reset(token)
+
+
+def current_turn() -> Optional[TurnContext]:
+    """Return the turn being traced in this context, if any."""
+    return _TURN.get()
+
+
+# 固定桶的累积直方图，与Prometheus的histogram类型对应。
+class Histogram:
+    """Cumulative fixed-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets=SPAN_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.total += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+    # 与Prometheus的histogram_quantile()相同，在所在的桶内线性插值估算分位数。
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+# 按span名称汇总耗时直方图的进程级注册表。
+class SpanMetrics:
+    """Per-span duration histograms, exportable in the Prometheus text format."""
+
+    def __init__(self, buckets=SPAN_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds, error)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: h.stats() for name, h in sorted(self._histograms.items())}
+
+    # 按Prometheus的文本格式（0.0.4）导出所有直方图和错误计数。
+    def render(self) -> str:
+        duration = f"{METRIC_PREFIX}_span_duration_seconds"
+        errors = f"{METRIC_PREFIX}_span_errors_total"
+        lines: List[str] = [
+            f"# HELP {duration} Duration of each phase of a turn.",
+            f"# TYPE {duration} histogram",
+        ]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            for name, h in histograms:
+                label = _escape_label(name)
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{duration}_bucket{{span="{label}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'{duration}_bucket{{span="{label}",le="+Inf"}} {h.count}')
+                lines.append(f'{duration}_sum{{span="{label}"}} {h.total:.6f}')
+                lines.append(f'{duration}_count{{span="{label}"}} {h.count}')
+            lines.append(f"# HELP {errors} Spans that ended with an exception.")
+            lines.append(f"# TYPE {errors} counter")
+            for name, h in histograms:
+                lines.append(f'{errors}{{span="{_escape_label(name)}"}} {h.errors}')
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+SPAN_METRICS = SpanMetrics()
+
+
+# 记录一个已经结束的span：更新直方图，并在启用INFO级别时写一行JSON日志。
+def record_span(
+    name: str,
+    seconds: float,
+    error: Optional[BaseException] = None,
+    turn_context: Optional[TurnContext] = None,
+    **attributes: Any,
+) -> None:
+    """Record a finished span in the histograms and the JSON trace log."""
+    SPAN_METRICS.observe(name, seconds, error is not None)
+    if not TRACE_LOGGER.isEnabledFor(logging.INFO):
+        return
+    context = turn_context or _TURN.get()
+    entry = {
+        "span": name,
+        "turn_id": context.turn_id if context else None,
+        "chat_id": context.chat_id if context else None,
+        "duration_ms": round(seconds * 1000, 3),
+        "status": "ok" if error is None else "error",
+    }
+    if error is not None:
+        entry["error"] = type(error).__name__
+    entry.update(attributes)
+    TRACE_LOGGER.info(json.dumps(entry, default=str))
+
+
+# 记录with语句块的耗时。块中抛出的异常会被记录为错误，然后继续向上抛出。
+@contextlib.contextmanager
+def span(name: str, **attributes: Any):
+    """Time the enclosed block as span `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        record_span(name, time.perf_counter() - started, error=e, **attributes)
+        raise
+    record_span(name, time.perf_counter() - started, **attributes)
+
+
+# 把同步或异步函数的每次调用记录为一个span。
+def traced(name: str) -> Callable:
+    """Decorate a function or coroutine function so that each call is recorded as span `name`."""
+
+    def decorator(fn: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# 把工具的run()或arun()的每次调用记录为名为"tool:<工具名称>"的span。
+def traced_tool(method: Callable) -> Callable:
+    """Decorate a tool's `run` or `arun` so that each call is recorded as span `tool:<name>`."""
+    if asyncio.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def async_wrapper(self, *args, **kwargs):
+            with span(f"tool:{self.name}"):
+                return await method(self, *args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with span(f"tool:{self.name}"):
+            return method(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,341 @@
+"""Telegram transport used by the bot, and the rate-limited outbound send queue in front of it."""
+import bisect
+import contextlib
+import itertools
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from steamship import SteamshipError
+from steamship.experimental.transports import TelegramTransport
+from steamship.experimental.transports.chat import ChatMessage
+
+from agent.tracing import Histogram, span
+
+# Telegram的发送频率限制：所有聊天合计每秒约30条，单个聊天每秒约1条（允许短时间的突发）
+GLOBAL_MESSAGES_PER_SECOND = 30.0
+GLOBAL_BURST = 30
+CHAT_MESSAGES_PER_SECOND = 1.0
+CHAT_BURST = 4
+# Telegram单条文本消息的最大长度，相邻的文本消息合并后不超过这个长度
+MAX_MESSAGE_LENGTH = 4096
+# Telegram返回"retry after N"时最多重试的次数
+MAX_SEND_RETRIES = 2
+# 聊天状态的数量超过这个值时，清理空闲且令牌已满的聊天
+CHAT_STATE_PRUNE_SIZE = 1024
+# 发送的优先级，数字越小越先发送：对话中的回复优先于提醒等后台推送的消息
+PRIORITY_REPLY = 0
+PRIORITY_BACKGROUND = 1
+RETRY_AFTER_PATTERN = re.compile(r"retry after (\d+)", re.IGNORECASE)
+
+_SEND_QUEUES: Dict[str, "SendQueue"] = {}
+_SEND_QUEUES_LOCK = threading.Lock()
+
+
+# 在steamship的TelegramTransport基础上，把每次发送记录为一个"telegram_send" span。
+# 已经发布（有公开URL）的图片、音频和视频先尝试直接把URL交给Telegram，不再下载块的内容后重新上传；
+# Telegram无法从URL获取内容时（例如不接受URL的内容类型），改为上传块的内容。
+# 文本消息也检查响应的状态：steamship的TelegramTransport忽略文本发送的状态，被限流的文本会被悄悄丢弃，
+# 这里发送失败时抛出异常，"retry after"由发送队列等待后重试。
+class TracedTelegramTransport(TelegramTransport):
+    """TelegramTransport that records every send as a span and sends published media by URL."""
+
+    def _send(self, blocks: List[ChatMessage]):
+        chat_ids = sorted({str(block.get_chat_id()) for block in blocks})
+        with span("telegram_send", messages=len(blocks), chat_ids=chat_ids):
+            for block in blocks:
+                method = _media_method(block)
+                if block.is_text() or block.text:
+                    self._send_text(block)
+                elif method is not None and block.url:
+                    self._send_media(block, *method)
+                else:
+                    super()._send([block])
+
+    def _send_text(self, block: ChatMessage) -> None:
+        chat_id = block.get_chat_id()
+        resp = requests.get(
+            f"{self.api_root}/sendMessage", params={"chat_id": int(chat_id), "text": block.text}
+        )
+        _check_response(resp, chat_id)
+
+    def _send_media(self, block: ChatMessage, suffix: str, key: str) -> None:
+        try:
+            self._send_media_url(block, suffix, key)
+        except (SteamshipError, requests.RequestException) as e:
+            # 被限流时由发送队列等待后重试，不改为上传
+            if RETRY_AFTER_PATTERN.search(str(e)):
+                raise
+            logging.warning(f"Unable to send block {block.id} by URL, uploading it instead: {e}")
+            super()._send([block])
+
+    def _send_media_url(self, block: ChatMessage, suffix: str, key: str) -> None:
+        chat_id = block.get_chat_id()
+        resp = requests.post(
+            f"{self.api_root}/{suffix}", data={"chat_id": chat_id, key: block.url}
+        )
+        _check_response(resp, chat_id)
+
+
+# 与steamship的TelegramTransport发送媒体时的检查一致：响应不是200时记录错误并抛出异常（错误信息包含Telegram的"retry after N"）
+def _check_response(resp: requests.Response, chat_id: str) -> None:
+    if resp.status_code != 200:
+        logging.error(f"Error sending message: {resp.text} [{resp.status_code}]")
+        raise SteamshipError(f"Message not sent to chat {chat_id} successfully: {resp.text}")
+
+
+# Telegram发送媒体的方法和参数名，与steamship的TelegramTransport一致
+def _media_method(block: ChatMessage) -> Optional[Tuple[str, str]]:
+    if block.is_image():
+        return "sendPhoto", "photo"
+    if block.is_audio():
+        return "sendAudio", "audio"
+    if block.is_video():
+        return "sendVideo", "video"
+    return None
+
+
+# 令牌桶：每秒补充rate个令牌，最多积累burst个。服务端要求等待时暂停到指定的时间。
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # 距离可以取出一个令牌还需要等待的秒数，0表示现在就可以
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float, now: float) -> None:
+        self._refill(now)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+
+class _ChatState:
+    def __init__(self, rate: float, burst: int):
+        self.bucket = TokenBucket(rate, burst)
+        # 一次发送的多条消息作为一个整体发送，不与同一聊天的其它发送交错
+        self.lock = threading.Lock()
+        self.users = 0
+
+
+# 一个机器人（bot_token）的发送队列。每条消息发送前需要同时从全局和所在聊天的令牌桶中取得令牌；
+# 等待的消息按(优先级, 先后顺序)排队，所在聊天已经可以发送的消息中排在最前面的先取得全局令牌，
+# 因此一个被限流的聊天不会挡住其它聊天，对话中的回复也不会排在大量提醒之后。
+class SendQueue:
+    """Priority send queue with a global and per-chat token buckets."""
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_MESSAGES_PER_SECOND,
+        global_burst: int = GLOBAL_BURST,
+        chat_rate: float = CHAT_MESSAGES_PER_SECOND,
+        chat_burst: int = CHAT_BURST,
+        max_retries: int = MAX_SEND_RETRIES,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._condition = threading.Condition()
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats: Dict[str, _ChatState] = {}
+        # 等待中的消息，按(优先级, 序号, chat_id)排序
+        self._waiting: List[Tuple[int, int, str]] = []
+        self._sequence = itertools.count()
+        self._delays = {PRIORITY_REPLY: Histogram(), PRIORITY_BACKGROUND: Histogram()}
+        self.sent = 0
+        self.throttled = 0
+        self.retried = 0
+        self.merged = 0
+        self.max_waiting = 0
+
+    # 在同一聊天的其它发送完成之后，按顺序发送messages中的每一条，每条都先取得令牌。
+    def send(
+        self,
+        chat_id: str,
+        messages: List[ChatMessage],
+        send_one: Callable[[ChatMessage], Any],
+        priority: int = PRIORITY_REPLY,
+    ) -> None:
+        """Send `messages` of one chat in order with `send_one`, waiting for the rate limits."""
+        with self._reserve(str(chat_id)) as state:
+            for message in messages:
+                for attempt in range(self.max_retries + 1):
+                    self._acquire(str(chat_id), state, priority)
+                    try:
+                        send_one(message)
+                    except Exception as e:
+                        retry_after = RETRY_AFTER_PATTERN.search(str(e))
+                        if retry_after is None or attempt == self.max_retries:
+                            raise
+                        with self._condition:
+                            self.retried += 1
+                            state.bucket.pause(float(retry_after.group(1)), time.monotonic())
+                    else:
+                        with self._condition:
+                            self.sent += 1
+                        break
+
+    def record_merged(self, count: int) -> None:
+        with self._condition:
+            self.merged += count
+
+    @contextlib.contextmanager
+    def _reserve(self, chat_id: str):
+        with self._condition:
+            state = self._chats.get(chat_id)
+            if state is None:
+                if len(self._chats) >= CHAT_STATE_PRUNE_SIZE:
+                    self._prune(time.monotonic())
+                state = self._chats[chat_id] = _ChatState(self.chat_rate, self.chat_burst)
+            state.users += 1
+        try:
+            with state.lock:
+                yield state
+        finally:
+            with self._condition:
+                state.users -= 1
+
+    # 清理没有在发送、令牌也已经补满的聊天，它们重新创建后的状态相同。必须在持有self._condition时调用。
+    def _prune(self, now: float) -> None:
+        for chat_id, state in list(self._chats.items()):
+            if state.users == 0 and state.bucket.is_full(now):
+                del self._chats[chat_id]
+
+    def _acquire(self, chat_id: str, state: _ChatState, priority: int) -> None:
+        started = time.monotonic()
+        ticket = (priority, next(self._sequence), chat_id)
+        with self._condition:
+            bisect.insort(self._waiting, ticket)
+            self.max_waiting = max(self.max_waiting, len(self._waiting))
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(ticket, state, now)
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                self._global.take(now)
+                state.bucket.take(now)
+            finally:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+            delay = time.monotonic() - started
+            self._delays.setdefault(priority, Histogram()).observe(delay)
+            if delay > 0.001:
+                self.throttled += 1
+
+    # 必须在持有self._condition时调用。排在前面、所在聊天也可以发送的消息先取得全局令牌，它取走令牌后会唤醒其它等待者。
+    def _wait_time(self, ticket: Tuple[int, int, str], state: _ChatState, now: float) -> float:
+        chat_wait = state.bucket.wait_time(now)
+        if chat_wait > 0:
+            return chat_wait
+        for other in self._waiting:
+            if other == ticket:
+                break
+            other_state = self._chats.get(other[2])
+            if other_state is not None and other_state.bucket.wait_time(now) <= 0:
+                return max(self._global.wait_time(now), 0.01)
+        return self._global.wait_time(now)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return sent / throttled counters and queue delay per priority."""
+        with self._condition:
+            return {
+                "sent": self.sent,
+                "throttled": self.throttled,
+                "retried": self.retried,
+                "merged": self.merged,
+                "waiting": len(self._waiting),
+                "max_waiting": self.max_waiting,
+                "chats": len(self._chats),
+                "queue_delay": {
+                    "reply" if priority == PRIORITY_REPLY else "background": histogram.stats()
+                    for priority, histogram in self._delays.items()
+                },
+            }
+
+
+# 返回给定机器人的进程级发送队列。Steamship每次调用都会重新构造机器人对象，限流的状态必须在它们之间共享。
+def get_send_queue(key: str) -> SendQueue:
+    """Return the process-wide send queue of a bot."""
+    with _SEND_QUEUES_LOCK:
+        queue = _SEND_QUEUES.get(key)
+        if queue is None:
+            queue = _SEND_QUEUES[key] = SendQueue()
+        return queue
+
+
+# 没有块id和附件、只有文本的消息可以与相邻的文本消息合并
+def _is_plain_text(message: ChatMessage) -> bool:
+    return bool(message.text) and not message.id and not message.url and not message.mime_type
+
+
+# 把相邻的纯文本消息合并为一条（不超过MAX_MESSAGE_LENGTH），返回合并后的消息和少发送的条数。
+def merge_text_messages(chat_id: str, messages: List[ChatMessage]) -> Tuple[List[ChatMessage], int]:
+    """Merge adjacent plain-text messages of one chat."""
+    merged: List[ChatMessage] = []
+    for message in messages:
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and _is_plain_text(previous)
+            and _is_plain_text(message)
+            and len(previous.text) + 2 + len(message.text) <= MAX_MESSAGE_LENGTH
+        ):
+            merged[-1] = ChatMessage(
+                client=previous.client, chat_id=chat_id, text=f"{previous.text}\n\n{message.text}"
+            )
+        else:
+            merged.append(message)
+    return merged, len(messages) - len(merged)
+
+
+# 在任意transport前面加上发送队列：send()按聊天分组、合并相邻的文本，再通过SendQueue逐条发送。
+# 其它属性（parse_inbound、instance_init等）直接转发给被包装的transport。
+class RateLimitedTransport:
+    """Transport wrapper that sends through a rate-limited SendQueue."""
+
+    def __init__(self, transport: Any, queue: SendQueue):
+        self.transport = transport
+        self.queue = queue
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.transport, name)
+
+    def send(self, blocks: Optional[List[ChatMessage]], priority: int = PRIORITY_REPLY) -> None:
+        if not blocks:
+            return
+        chats: Dict[str, List[ChatMessage]] = {}
+        for block in blocks:
+            chats.setdefault(str(block.get_chat_id()), []).append(block)
+        for chat_id, messages in chats.items():
+            messages, merged = merge_text_messages(chat_id, messages)
+            if merged:
+                self.queue.record_merged(merged)
+            self.queue.send(
+                chat_id, messages, lambda message: self.transport.send([message]), priority
+            )
@@ -0,0 +1,171 @@
+"""Content-addressed cache of generated speech."""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from agent.aio import run_blocking
+from agent.block_cache import remember_block_content
+from agent.cache import LRUCache, SingleFlight
+
+
+# 缓存的语音：生成的音频块的UUID，以及可选的音频内容（TTSCache的store_audio为True时保存）。
+# 命中时音频内容放入本轮的块内容缓存，发布音频块时不必重新下载。
+class CachedSpeech(NamedTuple):
+    block_id: str
+    audio: Optional[bytes] = None
+
+
+# 规范化文本：去掉首尾空白、合并连续空白并忽略大小写，使内容相同的文本命中同一个缓存条目。
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+# 缓存键由语音ID和规范化后的文本计算得到。
+def speech_cache_key(voice_id: str, text: str) -> str:
+    return hashlib.sha256(f"{voice_id}\n{normalize_text(text)}".encode()).hexdigest()
+
+
+class TTSCacheBackend(ABC):
+    """Storage for cached speech."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CachedSpeech]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def put(self, key: str, speech: CachedSpeech) -> None:
+        raise NotImplementedError()
+
+
+# 基于内存的缓存后端，使用LRUCache限制大小和空闲过期时间。
+class MemoryTTSCacheBackend(TTSCacheBackend):
+    """In-process LRU backend."""
+
+    def __init__(self, maxsize: int = 512, ttl: Optional[float] = None):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: str) -> Optional[CachedSpeech]:
+        return self.cache.get(key)
+
+    def put(self, key: str, speech: CachedSpeech) -> None:
+        self.cache.put(key, speech)
+
+
+# 基于本地SQLite文件的缓存后端，进程重启后缓存仍然有效。超过maxsize时淘汰最久未访问的条目，超过ttl未访问的条目视为过期。
+class SqliteTTSCacheBackend(TTSCacheBackend):
+    """Local SQLite backend that survives restarts."""
+
+    def __init__(self, path: str, maxsize: int = 4096, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS speech ("
+                "key TEXT PRIMARY KEY, block_id TEXT NOT NULL, audio BLOB, accessed_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[CachedSpeech]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT block_id, audio, accessed_at FROM speech WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            block_id, audio, accessed_at = row
+            if self.ttl is not None and now - accessed_at > self.ttl:
+                self._connection.execute("DELETE FROM speech WHERE key = ?", (key,))
+                return None
+            self._connection.execute(
+                "UPDATE speech SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            return CachedSpeech(block_id=block_id, audio=audio)
+
+    def put(self, key: str, speech: CachedSpeech) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO speech (key, block_id, audio, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, speech.block_id, speech.audio, time.time()),
+            )
+            self._connection.execute(
+                "DELETE FROM speech WHERE key NOT IN "
+                "(SELECT key FROM speech ORDER BY accessed_at DESC LIMIT ?)",
+                (self.maxsize,),
+            )
+
+
+# TTSCache将(语音ID, 规范化文本)映射到生成的音频块。并发的相同请求只会调用一次语音生成。
+# store_audio为False时只保存块的UUID，生成时得到的音频内容不进入缓存。
+class TTSCache:
+    """Cache generated speech by voice and normalized text, deduplicating concurrent requests."""
+
+    def __init__(self, backend: TTSCacheBackend, store_audio: bool = False):
+        self.backend = backend
+        self.store_audio = store_audio
+        self.hits = 0
+        self.misses = 0
+        self._in_flight = SingleFlight()
+
+    def get_or_generate(
+        self,
+        voice_id: str,
+        text: str,
+        generate: Callable[[], Tuple[str, Optional[bytes]]],
+    ) -> str:
+        """Return the cached audio block id for `text`, calling `generate` on a miss."""
+        key = speech_cache_key(voice_id, text)
+        cached = self.backend.get(key)
+        if cached is not None:
+            self.hits += 1
+            if cached.audio is not None:
+                remember_block_content(cached.block_id, cached.audio)
+            return cached.block_id
+
+        def generate_and_store() -> str:
+            self.misses += 1
+            block_id, audio = generate()
+            self.backend.put(key, self._entry(block_id, audio))
+            return block_id
+
+        return self._in_flight.do(key, generate_and_store)
+
+    # get_or_generate()的异步版本，generate返回一个协程。
+    async def aget_or_generate(
+        self,
+        voice_id: str,
+        text: str,
+        generate: Callable[[], Awaitable[Tuple[str, Optional[bytes]]]],
+    ) -> str:
+        """Return the cached audio block id for `text`, awaiting `generate` on a miss."""
+        key = speech_cache_key(voice_id, text)
+        cached = await run_blocking(self.backend.get, key)
+        if cached is not None:
+            self.hits += 1
+            if cached.audio is not None:
+                remember_block_content(cached.block_id, cached.audio)
+            return cached.block_id
+
+        async def generate_and_store() -> str:
+            self.misses += 1
+            block_id, audio = await generate()
+            await run_blocking(self.backend.put, key, self._entry(block_id, audio))
+            return block_id
+
+        return await self._in_flight.ado(key, generate_and_store)
+
+    def _entry(self, block_id: str, audio: Optional[bytes]) -> CachedSpeech:
+        return CachedSpeech(block_id=block_id, audio=audio if self.store_audio else None)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit / miss / deduplicated request counters."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "deduplicated": self._in_flight.shared,
+        }
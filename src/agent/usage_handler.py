@@ -0,0 +1,101 @@
+"""LangChain callback that feeds the per-turn token accounting."""
+import json
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import AgentAction, LLMResult
+
+from agent.accounting import TokenUsageLog, split_prompt
+
+
+# TokenUsageHandler同时挂在AgentExecutor和LLM上：AgentExecutor的开始和结束界定一轮对话，
+# 每次LLM调用时按部分统计提示词的token数，并统计生成的token数和工具调用。每轮结束时输出一条结构化日志并写入TokenUsageLog。
+class TokenUsageHandler(BaseCallbackHandler):
+    """Record prompt / completion tokens per section, LLM calls and tool invocations for each turn."""
+
+    def __init__(
+        self,
+        chat_id: str,
+        count_tokens: Callable[[str], int],
+        static_sections: Dict[str, str],
+        usage_log: TokenUsageLog,
+    ):
+        self.chat_id = chat_id
+        self.count_tokens = count_tokens
+        self.static_sections = static_sections
+        self.usage_log = usage_log
+        self._static_tokens = {
+            name: count_tokens(text) for name, text in static_sections.items()
+        }
+        self._reset()
+
+    def _reset(self) -> None:
+        self._user_input: Optional[str] = None
+        self._calls: List[Dict[str, Any]] = []
+        self._tools: Counter = Counter()
+        self._in_turn = False
+
+    def on_chain_start(self, serialized, inputs: Dict[str, Any], **kwargs: Any) -> None:
+        self._reset()
+        self._in_turn = True
+        user_input = inputs.get("input")
+        self._user_input = user_input if isinstance(user_input, str) else None
+
+    def on_llm_start(self, serialized, prompts: List[str], **kwargs: Any) -> None:
+        for prompt in prompts:
+            sections = split_prompt(prompt, self.static_sections, self._user_input)
+            by_section = {
+                name: self._static_tokens[name]
+                if name in self._static_tokens
+                else self.count_tokens(text)
+                for name, text in sections.items()
+                if name != "other"
+            }
+            # 其余的token（SUFFIX中的固定文本、各部分之间的分隔符等）计入"other"
+            prompt_tokens = self.count_tokens(prompt)
+            by_section["other"] = max(0, prompt_tokens - sum(by_section.values()))
+            self._calls.append(
+                {
+                    "prompt_tokens": prompt_tokens,
+                    "prompt_tokens_by_section": by_section,
+                    "completion_tokens": 0,
+                }
+            )
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        if not self._calls:
+            return
+        completion = "".join(
+            generation.text for generations in response.generations for generation in generations
+        )
+        self._calls[-1]["completion_tokens"] = self.count_tokens(completion)
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> None:
+        self._tools[action.tool] += 1
+
+    def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> None:
+        self._finish_turn()
+
+    def on_chain_error(self, error, **kwargs: Any) -> None:
+        self._finish_turn()
+
+    def _finish_turn(self) -> None:
+        if not self._in_turn:
+            return
+        by_section: Counter = Counter()
+        for call in self._calls:
+            by_section.update(call["prompt_tokens_by_section"])
+        turn = {
+            "chat_id": self.chat_id,
+            "llm_calls": len(self._calls),
+            "prompt_tokens": sum(call["prompt_tokens"] for call in self._calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in self._calls),
+            "prompt_tokens_by_section": dict(by_section),
+            "tool_invocations": dict(self._tools),
+            "calls": self._calls,
+        }
+        logging.info(f"[token-usage] {json.dumps(turn)}")
+        self.usage_log.record_turn(self.chat_id, turn)
+        self._reset()
@@ -1,9 +1,23 @@
+import asyncio
+import io
 import logging
 import re
+import tempfile
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Optional
 
+import requests
+from steamship import SteamshipError
 from steamship.data.workspace import SignedUrl
-from steamship.utils.signed_urls import upload_to_signed_url
+from steamship.utils.signed_urls import apply_localstack_url_fix
+
+from agent.aio import run_blocking
+from agent.block_cache import cached_block_content
+from agent.cache import LRUCache, SingleFlight
+from agent.tracing import span, traced
 
 # 匹配UUID的字符串格式
 UUID_PATTERN = re.compile(
@@ -11,6 +25,23 @@ UUID_PATTERN = re.compile(
 )
 
 
+# 公开块的签名URL的有效期，以及在过期前多久就不再复用缓存的URL。
+SIGNED_URL_EXPIRATION_MINUTES = 60
+SIGNED_URL_EXPIRATION_MARGIN_SECONDS = 5 * 60
+# 同时发布的块的最大数量
+PUBLISH_MAX_WORKERS = 8
+# 发布时在内存中保留的块内容的最大字节数，更大的内容写入临时文件；下载时每次读取的字节数
+SPOOL_MAX_BYTES = 1024 * 1024
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# block_id -> (读取签名URL, 过期时间)
+_PUBLIC_URLS = LRUCache(maxsize=1024)
+_PUBLISHING = SingleFlight()
+_SIGNING_POOL = ThreadPoolExecutor(max_workers=PUBLISH_MAX_WORKERS)
+_WORKSPACES = {}
+_WORKSPACES_LOCK = threading.Lock()
+
+
 # 检查一个字符串是否是有效的UUID。
 def is_valid_uuid(uuid_to_test: str, version=4) -> bool:
     """Check a string to see if it is actually a UUID."""
@@ -27,36 +58,150 @@ def is_valid_uuid(uuid_to_test: str, version=4) -> bool:
 
 
 # 将给定的block对象上传到公共访问的块存储，并返回可读取块内容的签名URL。
-def make_block_public(client, block):
+# 同一个块只会上传一次：读取URL会被缓存直到接近过期，并发发布同一个块的请求会共享同一次上传。
+@traced("publish")
+def make_block_public(client, block) -> str:
+    """Upload a block to public storage and return a signed URL to read it."""
+    cached = _cached_public_url(block.id)
+    if cached is not None:
+        return cached
+    return _PUBLISHING.do(block.id, lambda: _publish_block(client, block))
+
+
+# 获取client对应的workspace，每个workspace只获取一次。
+def get_workspace(client):
+    """Return the (cached) workspace of `client`."""
+    key = (client.config.workspace_id, client.config.workspace_handle)
+    with _WORKSPACES_LOCK:
+        workspace = _WORKSPACES.get(key)
+        if workspace is None:
+            workspace = client.get_workspace()
+            _WORKSPACES[key] = workspace
+        return workspace
+
+
+# make_block_public()的异步版本：签名URL的请求和上传都在共享线程池中执行，不阻塞事件循环。
+@traced("publish")
+async def amake_block_public(client, block) -> str:
+    """Upload a block to public storage and return a signed URL to read it, without blocking the event loop."""
+    cached = _cached_public_url(block.id)
+    if cached is not None:
+        return cached
+    return await _PUBLISHING.ado(block.id, lambda: _apublish_block(client, block))
+
+
+def _cached_public_url(block_id: str) -> Optional[str]:
+    cached = _PUBLIC_URLS.get(block_id)
+    if cached is None:
+        return None
+    read_signed_url, expires_at = cached
+    if time.time() < expires_at:
+        return read_signed_url
+    _PUBLIC_URLS.pop(block_id)
+    return None
+
+
+# 创建块文件的签名URL，文件名由块的id决定，因此重复发布同一个块会覆盖同一个文件。
+def _signed_url(workspace, block, operation: SignedUrl.Operation) -> str:
     # 从block对象的mime_type属性中提取文件扩展名
     extension = block.mime_type.split("/")[1]
-    # 生成一个随机的文件名，包括UUID和扩展名。
-    filepath = f"{uuid.uuid4()}.{extension}"
-    # 调用client.get_workspace().create_signed_url()方法创建两个签名URL，一个用于写入操作 (SignedUrl.Operation.WRITE)，一个用于读取操作 (SignedUrl.Operation.READ)。
-    # 创建签名URL时，使用了指定的存储桶 (SignedUrl.Bucket.PLUGIN_DATA) 和生成的文件路径。
-    signed_url = (
-        client.get_workspace()
-        .create_signed_url(
-            SignedUrl.Request(
-                bucket=SignedUrl.Bucket.PLUGIN_DATA,
-                filepath=filepath,
-                operation=SignedUrl.Operation.WRITE,
-            )
+    return workspace.create_signed_url(
+        SignedUrl.Request(
+            bucket=SignedUrl.Bucket.PLUGIN_DATA,
+            filepath=f"{block.id}.{extension}",
+            operation=operation,
+            expires_in_minutes=SIGNED_URL_EXPIRATION_MINUTES,
         )
-        .signed_url
+    ).signed_url
+
+
+# 缓存读取签名URL，在过期前提前失效。
+def _remember_public_url(block_id: str, read_signed_url: str, requested_at: float) -> None:
+    expires_at = (
+        requested_at
+        + SIGNED_URL_EXPIRATION_MINUTES * 60
+        - SIGNED_URL_EXPIRATION_MARGIN_SECONDS
     )
-    logging.info(f"Got signed url for uploading block content: {signed_url}")
-    read_signed_url = (
-        client.get_workspace()
-        .create_signed_url(
-            SignedUrl.Request(
-                bucket=SignedUrl.Bucket.PLUGIN_DATA,
-                filepath=filepath,
-                operation=SignedUrl.Operation.READ,
-            )
-        )
-        .signed_url
+    _PUBLIC_URLS.put(block_id, (read_signed_url, expires_at))
+
+
+def _publish_block(client, block) -> str:
+    workspace = get_workspace(client)
+
+    # 并发地创建两个签名URL，一个用于写入操作 (SignedUrl.Operation.WRITE)，一个用于读取操作 (SignedUrl.Operation.READ)。
+    requested_at = time.time()
+    read_future = _SIGNING_POOL.submit(_signed_url, workspace, block, SignedUrl.Operation.READ)
+    write_signed_url = _signed_url(workspace, block, SignedUrl.Operation.WRITE)
+    logging.info(f"Got signed url for uploading block content: {write_signed_url}")
+    read_signed_url = read_future.result()
+
+    # 将block对象的原始内容上传到写入签名URL指定的位置。
+    with span("block_raw"):
+        content = _open_block_content(block)
+    with content:
+        size = _content_size(content)
+        with span("upload", bytes=size):
+            upload_stream_to_signed_url(write_signed_url, content, size)
+    _remember_public_url(block.id, read_signed_url, requested_at)
+    return read_signed_url
+
+
+async def _apublish_block(client, block) -> str:
+    workspace = await run_blocking(get_workspace, client)
+
+    requested_at = time.time()
+    read_signed_url, write_signed_url = await asyncio.gather(
+        run_blocking(_signed_url, workspace, block, SignedUrl.Operation.READ),
+        run_blocking(_signed_url, workspace, block, SignedUrl.Operation.WRITE),
     )
-    # 通过调用upload_to_signed_url()函数，将block对象的原始内容上传到写入签名URL指定的位置。最后，返回读取签名URL，以便后续访问该块的内容。
-    upload_to_signed_url(signed_url, block.raw())
+    logging.info(f"Got signed url for uploading block content: {write_signed_url}")
+
+    with span("block_raw"):
+        content = await run_blocking(_open_block_content, block)
+    with content:
+        size = _content_size(content)
+        with span("upload", bytes=size):
+            await run_blocking(upload_stream_to_signed_url, write_signed_url, content, size)
+    _remember_public_url(block.id, read_signed_url, requested_at)
     return read_signed_url
+
+
+# 以文件对象的形式返回块的内容：本轮已经缓存的内容（例如语音工具下载的音频）直接使用，不再下载；
+# 有content_url的块分块下载到临时文件，内存中最多保留SPOOL_MAX_BYTES；否则只能通过API一次读取全部内容。
+def _open_block_content(block) -> IO[bytes]:
+    data = cached_block_content(block.id)
+    if data is not None:
+        return io.BytesIO(data)
+    if not block.content_url:
+        return io.BytesIO(block.raw())
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        with requests.get(block.content_url, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(STREAM_CHUNK_BYTES):
+                spool.write(chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def _content_size(content: IO[bytes]) -> int:
+    size = content.seek(0, io.SEEK_END)
+    content.seek(0)
+    return size
+
+
+# 把文件对象的内容流式上传到签名URL，不需要把整个内容读入内存。
+def upload_stream_to_signed_url(url: str, content: IO[bytes], size: int) -> None:
+    """Upload `size` bytes read from `content` to a signed URL."""
+    response = requests.put(
+        apply_localstack_url_fix(url),
+        data=content,
+        headers={"Content-Type": "application/octet-stream", "Content-Length": str(size)},
+    )
+    # S3成功时返回204，200也视为成功
+    if response.status_code not in (200, 204):
+        logging.error(f"File upload error [{response.status_code}]: {response.text}")
+        raise SteamshipError(message=f"Unable to upload data to signed URL: {response.status_code}")
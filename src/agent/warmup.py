@@ -0,0 +1,126 @@
+"""Cold-start bookkeeping: deferred imports, warm-up steps and cold vs. warm turn latency."""
+import importlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from agent.tracing import Histogram, span
+
+# 运行代理所需、但导入很慢（主要是langchain）的模块。api.py只在需要时导入它们，预热时在后台提前导入。
+AGENT_MODULES = [
+    "langchain.agents",
+    "langchain.memory",
+    "steamship_langchain.memory",
+    "agent.llm",
+    "agent.memory",
+    "agent.parser",
+    "agent.streaming",
+    "agent.usage_handler",
+    "agent.tools.reminder",
+    "agent.tools.search",
+    "agent.tools.selfie",
+    "agent.tools.speech",
+]
+
+
+# 导入AGENT_MODULES中的所有模块。已经导入的模块不会重复导入。
+def import_agent_stack() -> None:
+    """Import the modules needed to build an agent."""
+    for module in AGENT_MODULES:
+        importlib.import_module(module)
+
+
+# 进程级的启动统计：初始化耗时、每个预热步骤的耗时，以及第一轮对话（冷启动）与之后各轮（已预热）的耗时对比。
+class StartupStats:
+    """Cold-start vs. warm timings of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.init_seconds: Optional[float] = None
+        self.warm_up_steps: Dict[str, float] = {}
+        self.warm_up_errors: Dict[str, str] = {}
+        self.warm_up_seconds: Optional[float] = None
+        self.first_turn_seconds: Optional[float] = None
+        self.warm_turns = Histogram()
+
+    def record_init(self, seconds: float) -> None:
+        with self._lock:
+            if self.init_seconds is None:
+                self.init_seconds = seconds
+
+    def record_step(self, name: str, seconds: float, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self.warm_up_steps[name] = seconds
+            if error is not None:
+                self.warm_up_errors[name] = f"{type(error).__name__}: {error}"
+
+    def record_warm_up(self, seconds: float) -> None:
+        with self._lock:
+            self.warm_up_seconds = seconds
+
+    # 进程的第一轮对话记为冷启动，之后的轮次计入已预热的直方图。
+    def record_turn(self, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            if self.first_turn_seconds is None:
+                self.first_turn_seconds = seconds
+            else:
+                self.warm_turns.observe(seconds, error)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            warm = self.warm_turns.stats()
+            cold_penalty = None
+            if self.first_turn_seconds is not None and warm["count"]:
+                cold_penalty = self.first_turn_seconds - warm["p50"]
+            return {
+                "uptime_seconds": time.time() - self.started,
+                "init_seconds": self.init_seconds,
+                "warm_up_seconds": self.warm_up_seconds,
+                "warm_up_steps": dict(self.warm_up_steps),
+                "warm_up_errors": dict(self.warm_up_errors),
+                "cold_turn_seconds": self.first_turn_seconds,
+                "warm_turn": warm,
+                "cold_penalty_seconds": cold_penalty,
+            }
+
+    def clear(self) -> None:
+        self.__init__()
+
+
+STARTUP = StartupStats()
+
+# 已经预热过的键，每个键在进程中只预热一次
+_WARMED_UP: Set[Hashable] = set()
+_WARMED_UP_LOCK = threading.Lock()
+
+
+# 按顺序执行预热步骤，记录每一步的耗时。某一步失败只记录警告，不影响其它步骤，第一条消息到来时会再按需完成。
+def run_warm_up(steps: List[Tuple[str, Callable[[], Any]]]) -> Dict[str, Any]:
+    """Run the `(name, step)` pairs in order, recording how long each one took."""
+    started = time.perf_counter()
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            with span(f"warm_up:{name}"):
+                step()
+        except Exception as e:
+            logging.warning(f"Warm-up step {name} failed: {e}")
+            STARTUP.record_step(name, time.perf_counter() - step_started, e)
+        else:
+            STARTUP.record_step(name, time.perf_counter() - step_started)
+    STARTUP.record_warm_up(time.perf_counter() - started)
+    return STARTUP.stats()
+
+
+# 每个键只预热一次：第一次调用时在后台线程中执行预热步骤，之后的调用直接返回。
+# Steamship每次调用都会重新构造机器人对象，因此不能在每次初始化时都预热。
+def warm_up_once(key: Hashable, steps: Callable[[], List[Tuple[str, Callable[[], Any]]]]) -> bool:
+    """Run the warm-up steps in a background thread the first time `key` is seen; return whether it started."""
+    with _WARMED_UP_LOCK:
+        if key in _WARMED_UP:
+            return False
+        _WARMED_UP.add(key)
+    threading.Thread(target=lambda: run_warm_up(steps()), name="warm-up", daemon=True).start()
+    return True
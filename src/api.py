@@ -1,32 +1,112 @@
 """Scaffolding to host your LangChain Chatbot on Steamship and connect it to Telegram."""
-from typing import List, Optional, Type
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple, Type
 
-import langchain
-from langchain.agents import Tool, initialize_agent, AgentType, AgentExecutor
-from langchain.memory import ConversationBufferMemory
 from pydantic import Field
 from steamship.experimental.package_starters.telegram_bot import (
     TelegramBot,
     TelegramBotConfig,
 )
-from steamship.invocable import Config
-from steamship_langchain.llms import OpenAIChat
-from steamship_langchain.memory import ChatMessageHistory
+from steamship.invocable import Config, get, post
+from steamship.utils.kv_store import KeyValueStore
 
+from agent.accounting import TokenUsageLog
 from agent.base import LangChainAgentBot
-from agent.tools.search import SearchTool
-from agent.tools.selfie import SelfieTool
-from agent.tools.speech import GenerateSpeechTool
+from agent.cache import LRUCache
+from agent.dispatch import ChatDispatcher, get_dispatcher
+from agent.image_cache import ImageCache
+from agent.plugins import warm_up_plugins
+from agent.reminders import (
+    KeyValueReminderStore,
+    MemoryReminderStore,
+    Reminder,
+    ReminderScheduler,
+    SqliteReminderStore,
+)
+from agent.tracing import span
+from agent.tts_cache import MemoryTTSCacheBackend, SqliteTTSCacheBackend, TTSCache
+from agent.warmup import STARTUP, import_agent_stack, run_warm_up, warm_up_once
 from personalities import get_personality
-from prompts import SUFFIX, FORMAT_INSTRUCTIONS, PERSONALITY_PROMPT
+from prompts import CHAT_PROMPT, SUFFIX, FORMAT_INSTRUCTIONS, PERSONALITY_PROMPT
+
+# langchain和工具模块导入很慢（约1.5秒），只在类型检查时导入。运行时在构建第一个代理时才导入，或者由预热提前在后台导入。
+if TYPE_CHECKING:
+    from langchain import PromptTemplate
+    from langchain.agents import AgentExecutor, Tool
+    from langchain.chains.base import Chain
 
 MODEL_NAME = "gpt-4"  # or "gpt-4"
 TEMPERATURE = 0.7
+# 用于生成对话摘要的模型
+SUMMARY_MODEL_NAME = "gpt-3.5-turbo"
 VERBOSE = True
 # 设置了选择的个性
 PERSONALITY = "sacha"
+# 每个chat缓存的AgentExecutor数量上限，以及空闲多少秒后过期
+AGENT_CACHE_SIZE = 256
+AGENT_CACHE_TTL_SECONDS = 30 * 60
+
+# 语音缓存的后端（"memory"或"sqlite"），SQLite后端的文件路径，缓存条目数量上限和空闲过期时间
+TTS_CACHE_BACKEND = "memory"
+TTS_CACHE_PATH = "tts_cache.sqlite3"
+TTS_CACHE_SIZE = 512
+TTS_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+# 是否在语音缓存中同时保存音频内容。默认只保存块的UUID：按条目数量限制的缓存保存音频时可能占用数百MB内存
+TTS_CACHE_STORE_AUDIO = False
+
+# 提醒的存储后端和SQLite后端的文件路径。"steamship"（部署时使用）把提醒保存在KeyValueStore中，
+# 通过invoke_later在到期时调用deliver_reminders发送；"sqlite"和"memory"用于本地运行，由进程内的后台线程发送。
+REMINDER_STORE_BACKEND = "steamship"
+REMINDER_STORE_PATH = "reminders.sqlite3"
+
+# 图片缓存的条目数量上限，以及每张缓存的图片最多复用的次数
+IMAGE_CACHE_SIZE = 256
+IMAGE_CACHE_MAX_REUSE = 3
+
+# 进程级的AgentExecutor缓存，键为(instance_handle, chat_id)，值为(配置指纹, AgentExecutor)。
+AGENT_CACHE = LRUCache(maxsize=AGENT_CACHE_SIZE, ttl=AGENT_CACHE_TTL_SECONDS)
+
+
+# 根据TTS_CACHE_BACKEND创建进程级的语音缓存。
+def _create_tts_cache() -> TTSCache:
+    if TTS_CACHE_BACKEND == "sqlite":
+        backend = SqliteTTSCacheBackend(
+            TTS_CACHE_PATH, maxsize=TTS_CACHE_SIZE, ttl=TTS_CACHE_TTL_SECONDS
+        )
+    else:
+        backend = MemoryTTSCacheBackend(maxsize=TTS_CACHE_SIZE, ttl=TTS_CACHE_TTL_SECONDS)
+    return TTSCache(backend, store_audio=TTS_CACHE_STORE_AUDIO)
+
+
+TTS_CACHE = _create_tts_cache()
+
+# 进程级的提醒调度器，键为instance_handle
+_REMINDER_SCHEDULERS = {}
+_REMINDER_SCHEDULERS_LOCK = threading.Lock()
+TOKEN_USAGE = TokenUsageLog()
+IMAGE_CACHE = ImageCache(maxsize=IMAGE_CACHE_SIZE, max_reuse=IMAGE_CACHE_MAX_REUSE)
+
+
+# 代理提示词的前缀（个性描述和工具说明），每个个性只格式化一次。
+@functools.lru_cache(maxsize=None)
+def agent_prefix(personality: str) -> str:
+    return PERSONALITY_PROMPT.format(personality=get_personality(personality))
+
+
+# 闲聊链使用的提示词模板，每个个性只解析一次，在所有聊天之间共享。
+@functools.lru_cache(maxsize=None)
+def chat_prompt(personality: str) -> "PromptTemplate":
+    from langchain import PromptTemplate
+
+    return PromptTemplate.from_template(CHAT_PROMPT).partial(
+        personality=get_personality(personality)
+    )
 
-langchain.cache = None
 
 # 定义了一个GirlFriendAIConfig类，继承自TelegramBotConfig，用于配置GirlfriendGPT类的参数。其中包括elevenlabs_api_key和elevenlabs_voice_id，用于ElevenLabs Voice Bot的API密钥和语音ID。
 class GirlFriendAIConfig(TelegramBotConfig):
@@ -36,6 +116,39 @@ class GirlFriendAIConfig(TelegramBotConfig):
     elevenlabs_voice_id: str = Field(
         default="", description="Optional voice_id for ElevenLabs Voice Bot"
     )
+    tts_max_workers: int = Field(
+        default=4, description="Maximum number of text segments synthesized concurrently"
+    )
+    memory_mode: str = Field(
+        default="buffer",
+        description="Conversation memory: 'buffer' keeps the full history, 'summary_window' keeps recent turns plus a rolling summary",
+    )
+    memory_max_turns: int = Field(
+        default=6, description="Turns kept verbatim in 'summary_window' memory mode"
+    )
+    memory_max_tokens: int = Field(
+        default=1500, description="Token budget of the history in 'summary_window' memory mode"
+    )
+    selfie_pool_size: int = Field(
+        default=0,
+        description="Number of selfies generated ahead of time (0 disables the selfie pool)",
+    )
+    stream_voice: bool = Field(
+        default=False,
+        description="Send spoken audio sentence by sentence as soon as each one is synthesized",
+    )
+    max_concurrent_turns: int = Field(
+        default=8,
+        description="Maximum number of conversation turns processed at the same time across all chats, per process",
+    )
+    max_queued_turns_per_chat: int = Field(
+        default=4,
+        description="Maximum number of messages waiting in one chat before new ones get a busy reply, per process",
+    )
+    coalesce_window_ms: int = Field(
+        default=0,
+        description="Wait this long for follow-up messages and answer a burst of messages once (0 disables coalescing; only messages handled by the same process are merged)",
+    )
 
 
 class GirlfriendGPT(LangChainAgentBot, TelegramBot):
@@ -43,27 +156,232 @@ class GirlfriendGPT(LangChainAgentBot, TelegramBot):
 
     config: GirlFriendAIConfig
 
+    # 初始化时在后台预热（每个实例和配置在进程中只预热一次）：导入代理所需的模块，解析LLM和工具使用的插件实例，编译提示词，这样第一条用户消息不必等待。
+    def __init__(self, **kwargs):
+        started = time.perf_counter()
+        super().__init__(**kwargs)
+        warm_up_once((self._instance_handle(), self._config_fingerprint()), self.warm_up_steps)
+        STARTUP.record_init(time.perf_counter() - started)
+
     # 返回配置类GirlFriendAIConfig。
     @classmethod
     def config_cls(cls) -> Type[Config]:
         """Return the Configuration class."""
         return GirlFriendAIConfig
 
-    # 根据给定的chat_id获取一个AgentExecutor对象。
-    def get_agent(self, chat_id: str) -> AgentExecutor:
-        # 创建一个OpenAIChat对象llm，使用指定的模型名称、温度和详细参数进行初始化。
-        llm = OpenAIChat(
+    # 根据给定的chat_id获取一个AgentExecutor对象。如果缓存中已有该chat的AgentExecutor，并且配置没有变化，则直接复用，只刷新其内存内容。
+    def get_agent(self, chat_id: str) -> "AgentExecutor":
+        key = (self._instance_handle(), chat_id)
+        fingerprint = self._config_fingerprint()
+        cached = AGENT_CACHE.get(key)
+        if cached is not None:
+            cached_fingerprint, agent = cached
+            if cached_fingerprint == fingerprint:
+                # 从持久化的聊天记录中重新加载消息，以防其他worker写入了新的消息。
+                chat_memory = agent.memory.chat_memory
+                with span("memory_load"):
+                    chat_memory.messages = chat_memory.saved_messages
+                return agent
+            logging.info(f"Config changed, rebuilding agent for chat {chat_id}")
+            AGENT_CACHE.pop(key)
+
+        agent = self._build_agent(chat_id)
+        AGENT_CACHE.put(key, (fingerprint, agent))
+        return agent
+
+    # 丢弃给定chat_id缓存的AgentExecutor，下一条消息将重新构建。
+    def invalidate_agent(self, chat_id: str) -> None:
+        AGENT_CACHE.pop((self._instance_handle(), chat_id))
+
+    @get("agent_cache_stats")
+    def agent_cache_stats(self) -> dict:
+        """Return hit / miss / eviction counters of the per-chat agent cache."""
+        return AGENT_CACHE.stats()
+
+    @get("selfie_pool_stats")
+    def selfie_pool_stats(self) -> dict:
+        """Return depth and refill metrics of the selfie pool."""
+        if self.config.selfie_pool_size <= 0:
+            return {}
+        from agent.tools.selfie import get_selfie_pool
+
+        return get_selfie_pool(self.client, self.config.selfie_pool_size).stats()
+
+    @get("tts_cache_stats")
+    def tts_cache_stats(self) -> dict:
+        """Return hit / miss counters of the speech cache."""
+        return TTS_CACHE.stats()
+
+    @get("token_usage")
+    def token_usage(self, chat_id: str = "") -> dict:
+        """Return token usage per prompt section, LLM calls and tool invocations, for one chat or all chats."""
+        return TOKEN_USAGE.summary(chat_id or None)
+
+    @get("image_cache_stats")
+    def image_cache_stats(self) -> dict:
+        """Return hit rate and eviction counters of the image cache."""
+        return IMAGE_CACHE.stats()
+
+    @get("search_cache_stats")
+    def search_cache_stats(self) -> dict:
+        """Return hit / miss / eviction counters of the search cache."""
+        from agent.tools.search import SEARCH_CACHE
+
+        return SEARCH_CACHE.stats()
+
+    @get("parser_stats")
+    def parser_stats(self) -> dict:
+        """Return how many agent outputs parsed cleanly, were repaired locally, or needed another LLM call."""
+        from agent.parser import PARSER_STATS
+
+        return PARSER_STATS.stats()
+
+    @get("reminder_stats")
+    def reminder_stats(self) -> dict:
+        """Return pending / delivered counters of the reminder scheduler."""
+        return self.reminder_scheduler().stats()
+
+    @post("deliver_reminders")
+    def deliver_reminders(self) -> dict:
+        """Deliver the reminders that are due now and return how many were sent."""
+        if REMINDER_STORE_BACKEND == "steamship":
+            # 这次调用就是已安排的那次，清除记录，使dispatch_due之后的下一次调用能够重新安排
+            self._reminder_ticks().delete("next")
+        return {"delivered": self.reminder_scheduler().dispatch_due()}
+
+    # 返回当前实例的提醒调度器。"steamship"后端每次调用都从KeyValueStore重新加载，不启动线程，
+    # 最早的到期时间变化时安排一次deliver_reminders调用；本地后端第一次调用时加载提醒并启动后台发送线程。
+    def reminder_scheduler(self) -> ReminderScheduler:
+        key = self._instance_handle()
+        if REMINDER_STORE_BACKEND == "steamship":
+            return ReminderScheduler(
+                KeyValueReminderStore(
+                    KeyValueStore(client=self.client, store_identifier=f"reminders-{key}")
+                ),
+                self._reminder_sender(self.telegram_transport),
+                on_next_due=self._schedule_reminder_delivery,
+            )
+        with _REMINDER_SCHEDULERS_LOCK:
+            scheduler = _REMINDER_SCHEDULERS.get(key)
+            if scheduler is None:
+                if REMINDER_STORE_BACKEND == "sqlite":
+                    store = SqliteReminderStore(REMINDER_STORE_PATH, instance=key)
+                else:
+                    store = MemoryReminderStore()
+                scheduler = ReminderScheduler(store, self._reminder_sender(self.telegram_transport))
+                _REMINDER_SCHEDULERS[key] = scheduler.start()
+            return scheduler
+
+    # 记录已经安排的deliver_reminders调用的时间，避免每次添加提醒都重复安排
+    def _reminder_ticks(self) -> KeyValueStore:
+        return KeyValueStore(
+            client=self.client, store_identifier=f"reminder-ticks-{self._instance_handle()}"
+        )
+
+    # 在due_at时调用deliver_reminders。已经安排的调用不晚于due_at时不再重复安排；
+    # 调用执行时会清除记录，dispatch_due发送后再按新的最早到期时间安排下一次。
+    def _schedule_reminder_delivery(self, due_at: float) -> None:
+        ticks = self._reminder_ticks()
+        now = time.time()
+        scheduled = (ticks.get("next") or {}).get("due_at")
+        if scheduled is not None and now <= scheduled <= due_at:
+            return
+        self.invoke_later("deliver_reminders", delay_ms=int(max(0.0, due_at - now) * 1000))
+        ticks.set("next", {"due_at": due_at})
+
+    # 一批到期的提醒通过一次send调用发送，优先级低于对话中的回复，同一聊天的多条提醒会合并为一条消息。
+    @staticmethod
+    def _reminder_sender(transport) -> Callable[[List[Reminder]], None]:
+        from steamship.experimental.transports.chat import ChatMessage
+
+        from agent.transport import PRIORITY_BACKGROUND
+
+        def deliver(batch: List[Reminder]) -> None:
+            transport.send(
+                [ChatMessage(text=reminder.message, chat_id=reminder.chat_id) for reminder in batch],
+                priority=PRIORITY_BACKGROUND,
+            )
+
+        return deliver
+
+    @post("warm_up")
+    def warm_up(self) -> dict:
+        """Run the warm-up steps now and return the startup timings."""
+        return run_warm_up(self.warm_up_steps())
+
+    # 返回预热步骤的列表，每一步是(名称, 函数)。
+    def warm_up_steps(self) -> List[Tuple[str, Callable[[], Any]]]:
+        steps = [
+            ("imports", import_agent_stack),
+            ("plugins", lambda: warm_up_plugins(self.client, self.get_plugin_configs())),
+            ("prompts", self._compile_prompts),
+            ("tokenizer", lambda: self._create_llm(MODEL_NAME, TEMPERATURE).get_num_tokens("")),
+        ]
+        if REMINDER_STORE_BACKEND != "steamship":
+            steps.append(("reminders", self.reminder_scheduler))
+        if self.config.selfie_pool_size > 0:
+            steps.append(("selfie_pool", self._start_selfie_pool))
+        return steps
+
+    def _compile_prompts(self) -> None:
+        agent_prefix(PERSONALITY)
+        chat_prompt(PERSONALITY)
+
+    def _start_selfie_pool(self) -> None:
+        from agent.tools.selfie import get_selfie_pool
+
+        get_selfie_pool(self.client, self.config.selfie_pool_size)
+
+    # 创建一个AsyncOpenAIChat对象，使用指定的模型名称、温度和详细参数进行初始化。它同时支持同步和异步调用。
+    def _create_llm(self, model_name: str, temperature: float):
+        from agent.llm import AsyncOpenAIChat
+
+        return AsyncOpenAIChat(
             client=self.client,
-            model_name=MODEL_NAME,
-            temperature=TEMPERATURE,
+            model_name=model_name,
+            temperature=temperature,
             verbose=VERBOSE,
         )
 
+    # 构建一个新的AgentExecutor对象。
+    def _build_agent(self, chat_id: str) -> "AgentExecutor":
+        import langchain
+        from langchain.agents import AgentType, initialize_agent
+        from langchain.agents.conversational.output_parser import ConvoOutputParser
+
+        from agent.parser import MultiModalOutputParser
+        from agent.usage_handler import TokenUsageHandler
+
+        langchain.cache = None
+
+        # 创建一个OpenAIChat对象llm，使用指定的模型名称、温度和详细参数进行初始化。它同时支持同步和异步调用。
+        llm = self._create_llm(MODEL_NAME, TEMPERATURE)
+
         # 然后通过self.get_tools(chat_id)获取工具列表。
         tools = self.get_tools(chat_id=chat_id)
 
         # 接下来，通过self.get_memory(chat_id)获取内存对象。
-        memory = self.get_memory(chat_id)
+        with span("memory_load"):
+            memory = self.get_memory(chat_id)
+
+        prefix = agent_prefix(PERSONALITY)
+
+        # 创建统计每轮token使用情况的回调，同时挂在llm和AgentExecutor上。
+        usage_handler = TokenUsageHandler(
+            chat_id=chat_id,
+            count_tokens=llm.get_num_tokens,
+            static_sections={
+                "personality": prefix,
+                "tools": "\n".join(f"> {tool.name}: {tool.description}" for tool in tools),
+                "format_instructions": FORMAT_INSTRUCTIONS.format(
+                    tool_names=", ".join(tool.name for tool in tools),
+                    ai_prefix="AI",
+                    human_prefix="Human",
+                ),
+            },
+            usage_log=TOKEN_USAGE,
+        )
+        llm.callbacks = [usage_handler]
 
         # 最后，调用initialize_agent方法初始化一个代理对象，并将工具、llm、内存和其他参数传递给该方法。
         return initialize_agent(
@@ -71,46 +389,142 @@ class GirlfriendGPT(LangChainAgentBot, TelegramBot):
             llm,
             agent=AgentType.CONVERSATIONAL_REACT_DESCRIPTION,
             agent_kwargs={
-                # "output_parser": MultiModalOutputParser(ConvoOutputParser()),
-                "prefix": PERSONALITY_PROMPT.format(personality=get_personality(PERSONALITY)),
+                # 在本地修复格式不正确的输出，无法修复时才重新询问LLM
+                "output_parser": MultiModalOutputParser(
+                    ConvoOutputParser(), tool_names=[tool.name for tool in tools]
+                ),
+                "prefix": prefix,
                 "suffix": SUFFIX,
                 "format_instructions": FORMAT_INSTRUCTIONS,
             },
             verbose=VERBOSE,
             memory=memory,
+            callbacks=[usage_handler],
+            handle_parsing_errors=True,
+        )
+
+    # 返回当前实例的handle，本地运行时使用固定的handle。
+    def _instance_handle(self) -> str:
+        if self.context and self.context.invocable_instance_handle:
+            return self.context.invocable_instance_handle
+        return "local-instance-handle"
+
+    # 计算影响AgentExecutor构建的配置的指纹，配置变化时缓存的AgentExecutor会失效。
+    def _config_fingerprint(self) -> str:
+        payload = json.dumps(
+            {
+                "config": self.config.dict(),
+                "model_name": MODEL_NAME,
+                "temperature": TEMPERATURE,
+                "personality": PERSONALITY,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    # 返回用于闲聊的精简对话链：使用与代理相同的llm和内存，只包含个性描述、聊天记录和新的输入，一次LLM调用即可得到回复。
+    def get_chat_chain(self, chat_id: str) -> Optional["Chain"]:
+        from langchain import LLMChain
+
+        agent = self.get_agent(chat_id)
+        llm = agent.agent.llm_chain.llm
+        return LLMChain(
+            llm=llm,
+            prompt=chat_prompt(PERSONALITY),
+            memory=agent.memory,
+            callbacks=llm.callbacks,
+            verbose=VERBOSE,
         )
 
     # 返回一个工具对象，用于生成输出文本的语音版本。在这里，返回一个GenerateSpeechTool对象，使用指定的Steamship客户端、语音ID和Elevenlabs的API密钥进行初始化。
-    def voice_tool(self) -> Optional[Tool]:
+    def voice_tool(self) -> Optional["Tool"]:
         """Return tool to generate spoken version of output text."""
+        from agent.tools.speech import GenerateSpeechTool
+
         return GenerateSpeechTool(
             client=self.client,
             voice_id=self.config.elevenlabs_voice_id,
             elevenlabs_api_key=self.config.elevenlabs_api_key,
+            cache=TTS_CACHE,
+        )
+
+    # 返回并发生成语音的最大线程数，由配置决定。
+    def voice_concurrency(self) -> int:
+        return self.config.tts_max_workers
+
+    # 是否启用流式语音，由配置决定。
+    def is_voice_streaming_enabled(self) -> bool:
+        return self.config.stream_voice
+
+    # 调度对话轮次的ChatDispatcher，并发数和每个聊天的队列长度由配置决定。
+    def dispatcher(self) -> ChatDispatcher:
+        return get_dispatcher(
+            max_workers=self.config.max_concurrent_turns,
+            max_queue_per_chat=self.config.max_queued_turns_per_chat,
         )
 
-    # 根据给定的chat_id返回一个内存对象。在这里，创建一个ConversationBufferMemory对象，使用ChatMessageHistory作为聊天历史记录，并返回内存对象。
+    # 合并连续消息时等待的窗口，由配置决定。
+    def coalesce_window(self) -> float:
+        return self.config.coalesce_window_ms / 1000
+
+    # 返回需要预热的插件句柄及其配置，包括代理和摘要使用的LLM插件。
+    def get_plugin_configs(self) -> List[Tuple[str, dict]]:
+        from agent import llm
+        from agent.tools import selfie, speech
+
+        voice_tool = self.voice_tool()
+        configs = [
+            (llm.PLUGIN_HANDLE, llm.plugin_config(MODEL_NAME, temperature=TEMPERATURE)),
+            (selfie.PLUGIN_HANDLE, selfie.PLUGIN_CONFIG),
+            (speech.PLUGIN_HANDLE, voice_tool.plugin_config),
+        ]
+        if self.config.memory_mode == "summary_window":
+            configs.append(
+                (llm.PLUGIN_HANDLE, llm.plugin_config(SUMMARY_MODEL_NAME, temperature=0))
+            )
+        return configs
+
+    # 根据给定的chat_id返回一个内存对象。默认创建一个ConversationBufferMemory对象，使用ChatMessageHistory作为聊天历史记录。
+    # 当memory_mode为"summary_window"时，创建一个SummaryWindowMemory对象，只保留最近的若干轮对话，更早的对话合并为摘要，摘要保存在与聊天记录对应的KeyValueStore中。
     def get_memory(self, chat_id):
-        if self.context and self.context.invocable_instance_handle:
-            my_instance_handle = self.context.invocable_instance_handle
-        else:
-            my_instance_handle = "local-instance-handle"
+        from langchain.memory import ConversationBufferMemory
+        from steamship_langchain.memory import ChatMessageHistory
+
+        from agent.memory import SummaryWindowMemory
+
+        my_instance_handle = self._instance_handle()
+        history_key = f"history-{chat_id}-{my_instance_handle}"
+        chat_memory = ChatMessageHistory(client=self.client, key=history_key)
+        if self.config.memory_mode == "summary_window":
+            return SummaryWindowMemory(
+                llm=self._create_llm(SUMMARY_MODEL_NAME, 0),
+                chat_memory=chat_memory,
+                max_turns=self.config.memory_max_turns,
+                max_token_limit=self.config.memory_max_tokens,
+                summary_store=KeyValueStore(
+                    client=self.client, store_identifier=f"summary-{history_key}"
+                ),
+                return_messages=True,
+            )
         memory = ConversationBufferMemory(
             memory_key="chat_history",
-            chat_memory=ChatMessageHistory(
-                client=self.client, key=f"history-{chat_id}-{my_instance_handle}"
-            ),
+            chat_memory=chat_memory,
             return_messages=True,
         )
         return memory
 
     # 返回一个工具列表。在这里，返回一个包含SearchTool和SelfieTool的工具列表。
-    def get_tools(self, chat_id: str) -> List[Tool]:
+    def get_tools(self, chat_id: str) -> List["Tool"]:
+        from agent.tools.reminder import RemindMe
+        from agent.tools.search import SearchTool
+        from agent.tools.selfie import SelfieTool
+
         return [
             SearchTool(self.client),
             # MyTool(self.client),
-            # GenerateImageTool(self.client),
-            # GenerateAlbumArtTool(self.client)
-            # RemindMe(invoke_later=self.invoke_later, chat_id=chat_id),
-            SelfieTool(self.client),
+            # GenerateImageTool(self.client, cache=IMAGE_CACHE),
+            # GenerateAlbumArtTool(self.client, cache=IMAGE_CACHE)
+            RemindMe(get_scheduler=self.reminder_scheduler, chat_id=chat_id),
+            SelfieTool(self.client, pool_size=self.config.selfie_pool_size),
         ]
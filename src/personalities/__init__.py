@@ -1,7 +1,13 @@
 # 这些模块定义了不同个性的内容，例如不同的聊天风格、回答方式等。
-from .luna import luna
-from .sacha import sacha
-from .angele import angele
+# 个性模块在第一次使用时才导入，只有配置的个性会被加载。
+import importlib
+
+# 个性名称与模块名称（也是模块中个性变量的名称）的对应关系
+PERSONALITY_MODULES = {
+    "luna": "luna",
+    "sacha": "sacha",
+    "Angèle": "angele",
+}
 
 __all__ = [
     "sacha",
@@ -11,14 +17,25 @@ __all__ = [
 ]
 
 
+# 导入个性模块并返回其中的个性描述。导入后把包的属性替换为个性描述，而不是子模块，与原来的`from .luna import luna`一致。
+def _load(module_name: str) -> str:
+    personality = getattr(importlib.import_module(f".{module_name}", __name__), module_name)
+    globals()[module_name] = personality
+    return personality
+
+
 # get_personality函数接受一个参数name，根据传入的名称返回对应的个性模块。
 def get_personality(name: str):
     # 它使用了一个字典来映射名称与个性模块之间的关系。如果传入的名称不在字典中，函数将引发一个异常，指示选择的个性不存在。
     try:
-        return {
-            "luna": luna,
-            "sacha": sacha,
-            "Angèle": angele
-        }[name]
+        module_name = PERSONALITY_MODULES[name]
     except Exception:
         raise Exception("The personality you selected does not exist!")
+    return _load(module_name)
+
+
+# 支持`from personalities import luna`等写法，按需导入对应的个性。
+def __getattr__(name: str):
+    if name in PERSONALITY_MODULES.values():
+        return _load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -41,3 +41,13 @@ Previous conversation history:
 
 New input: {input}
 {agent_scratchpad}"""
+
+# `CHAT_PROMPT`是闲聊路径使用的精简提示词，不包含工具说明和ReAct格式说明，只需要一次LLM调用。
+# 其中，`{personality}`将被替换为个性描述，`{chat_history}`将被替换为之前对话的历史记录，`{input}`将被替换为新的输入内容。
+CHAT_PROMPT = """{personality}
+
+Previous conversation history:
+{chat_history}
+
+Human: {input}
+AI:"""